@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class GameboardConfig(AppConfig):
     name = 'gameboard'
+
+    def ready(self):
+        # Connect the receivers which keep the denormalized statistics up to date
+        import gameboard.signals
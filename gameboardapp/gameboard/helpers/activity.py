@@ -0,0 +1,164 @@
+from collections import defaultdict
+
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Trunc
+
+from gameboard.models import GameParticipation, GamePlayed, GroupActivity, PlayerActivity
+
+# The rollup model for each scope
+SCOPES = {'group': GroupActivity, 'player': PlayerActivity}
+
+# The periods activity can be grouped into
+PERIODS = ['day', 'week', 'month']
+
+
+def _adjust(model, field, counts, sign):
+    """
+    Adds to (or takes away from) some rollup rows, creating any which are missing.
+
+    :param model: GroupActivity or PlayerActivity
+    :param field: The field which scopes the model, 'group' or 'player'
+    :param counts: A dict of (scope id, date) to the number of games
+    :param sign: 1 to add the games, -1 to take them away
+    :return: None
+    """
+    if not counts:
+        return
+    if sign > 0:
+        model.objects.bulk_create([model(date=date, **{field + '_id': scope_id}) for (scope_id, date) in counts],
+                                  ignore_conflicts=True)
+
+    by_date_count = defaultdict(list)
+    for ((scope_id, date), count) in counts.items():
+        by_date_count[(date, count)].append(scope_id)
+    for ((date, count), scope_ids) in by_date_count.items():
+        model.objects.filter(date=date, **{field + '_id__in': scope_ids}).update(games=F('games') + sign * count)
+
+
+def game_played_added(group_id, date):
+    """
+    Counts a newly recorded game in its group's rollup.
+
+    :param group_id: The id of the game's group
+    :param date: The date the game was played
+    :return: None
+    """
+    _adjust(GroupActivity, 'group', {(group_id, date): 1}, 1)
+
+
+def games_played_added(group_id, dates):
+    """
+    Counts a batch of newly recorded games in their group's rollup, e.g. from an import.
+
+    :param group_id: The id of the games' group
+    :param dates: The dates the games were played, one per game
+    :return: None
+    """
+    counts = defaultdict(int)
+    for date in dates:
+        counts[(group_id, date)] += 1
+    _adjust(GroupActivity, 'group', counts, 1)
+
+
+def game_played_removed(group_id, date):
+    """
+    Takes a deleted (or moved) game out of its group's rollup.
+
+    :param group_id: The id of the game's group
+    :param date: The date the game was played
+    :return: None
+    """
+    _adjust(GroupActivity, 'group', {(group_id, date): 1}, -1)
+
+
+def players_changed(pairs, sign, dates=None):
+    """
+    Updates the player rollups after rows were added to (or removed from) GamePlayed.players.
+
+    :param pairs: An iterable of (game_played_id, player_id) tuples which changed
+    :param sign: 1 if the rows were added, -1 if they were removed
+    :param dates: A dict of game_played_id to date, looked up if not given
+    :return: None
+    """
+    pairs = set(pairs)
+    if dates is None:
+        dates = dict(GamePlayed.objects.filter(pk__in={g for (g, _) in pairs}).values_list('id', 'date'))
+
+    counts = defaultdict(int)
+    for (game_played_id, player_id) in pairs:
+        if game_played_id in dates:
+            counts[(player_id, dates[game_played_id])] += 1
+    _adjust(PlayerActivity, 'player', counts, sign)
+
+
+def rebuild_activity(group=None):
+    """
+    Recomputes the rollups from scratch. Used after bulk writes which skip the signals.
+
+    :param group: Optionally, a PlayerGroup to rebuild, along with the player rollups of its members. Defaults to
+    rebuilding everything.
+    :return: None
+    """
+    group_rows = GroupActivity.objects.all()
+    player_rows = PlayerActivity.objects.all()
+    games = GamePlayed.objects.all()
+    participations = GameParticipation.objects.all()
+    if group is not None:
+        group_rows = group_rows.filter(group=group)
+        games = games.filter(group=group)
+        members = group.players.values('id')
+        player_rows = player_rows.filter(player__in=members)
+        participations = participations.filter(player__in=members)
+
+    groups = games.order_by().values_list('group_id', 'date').annotate(games=Count('id'))
+    players = participations.order_by().values_list('player_id', 'gameplayed__date').annotate(games=Count('id'))
+
+    group_rows.delete()
+    GroupActivity.objects.bulk_create([GroupActivity(group_id=group_id, date=date, games=games)
+                                       for (group_id, date, games) in groups])
+    player_rows.delete()
+    PlayerActivity.objects.bulk_create([PlayerActivity(player_id=player_id, date=date, games=games)
+                                        for (player_id, date, games) in players])
+
+
+def find_activity(field, scope_id, start=None, end=None, period='day'):
+    """
+    Get how many games a group or player played over a range of dates, grouped by day, ISO week or month. The grouping
+    is done by the database, over the rollup rows.
+
+    :param field: The scope, either 'group' or 'player'
+    :param scope_id: The id of the group or player
+    :param start: Optionally, the first date to include
+    :param end: Optionally, the last date to include
+    :param period: One of 'day', 'week' (starting on Monday) or 'month'
+    :return: A list of (first date of the period, games played) tuples, in date order. Periods without games are left
+    out.
+    """
+    if field not in SCOPES:
+        raise ValueError("Unknown activity scope %s" % field)
+    if period not in PERIODS:
+        raise ValueError("Unknown activity period %s" % period)
+
+    rows = SCOPES[field].objects.filter(games__gt=0, **{field: scope_id})
+    if start is not None:
+        rows = rows.filter(date__gte=start)
+    if end is not None:
+        rows = rows.filter(date__lte=end)
+
+    if period == 'day':
+        return list(rows.order_by('date').values_list('date', 'games'))
+    return list(rows.annotate(period=Trunc('date', period, output_field=DateField())).order_by()
+                .values('period').annotate(total=Sum('games')).order_by('period').values_list('period', 'total'))
+
+
+def find_recent_activity(field, scope_id, days):
+    """
+    Get the most recent days on which a group or player played.
+
+    :param field: The scope, either 'group' or 'player'
+    :param scope_id: The id of the group or player
+    :param days: How many days to return
+    :return: A list of (date, games played) tuples, in date order
+    """
+    rows = SCOPES[field].objects.filter(games__gt=0, **{field: scope_id}).order_by('-date')
+    return list(reversed(rows.values_list('date', 'games')[:days]))
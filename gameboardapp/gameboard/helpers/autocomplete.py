@@ -0,0 +1,176 @@
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from gameboard.models import Game, Player
+
+# How many suggestions are given, unless asked for otherwise, and the most there can be
+LIMIT = 10
+MAX_LIMIT = 50
+
+# The catalogues which can be searched
+KINDS = ['games', 'players']
+
+# The indexes built in this process (kind to PrefixIndex)
+_lock = threading.Lock()
+_indexes = dict()
+
+
+def search_key(name):
+    """
+    :param name: A game name or username
+    :return: What it is searched by, so that searches ignore case
+    """
+    return name.casefold()
+
+
+def _version_key(kind):
+    return "gameboard:autocomplete:%s" % kind
+
+
+def _current_version(kind):
+    """
+    :param kind: 'games' or 'players'
+    :return: The catalogue's version, shared by every process using the same cache (see the CACHES setting)
+    """
+    key = _version_key(kind)
+    cache.add(key, int(time.time() * 1000000), None)
+    return cache.get(key)
+
+
+def _bump_version(kind):
+    try:
+        cache.incr(_version_key(kind))
+    except ValueError:
+        cache.set(_version_key(kind), int(time.time() * 1000000), None)
+
+
+def changed(kind):
+    """
+    Moves a catalogue on to a new version, so every process sharing the cache rebuilds its index of it on its next
+    search (a cache in each process's memory would only reach this one). Called from the signals, and by the import
+    (whose bulk inserts send none). The version is moved on again once the transaction commits, in case another process
+    rebuilt its index in between, before the change could be seen.
+
+    :param kind: 'games' or 'players'
+    :return: None
+    """
+    if kind not in KINDS:
+        raise ValueError("Unknown catalogue %s" % kind)
+    _bump_version(kind)
+    transaction.on_commit(lambda: _bump_version(kind))
+
+
+class PrefixIndex:
+    """
+    A catalogue's names, sorted by their search keys, so the names starting with a prefix are found by a binary search
+    for the first of them and read in order from there.
+    """
+
+    def __init__(self, version, entries):
+        """
+        :param version: The version of the catalogue the entries were read at
+        :param entries: A list of (search key, name, id, ...) tuples, or None if the catalogue is too big to keep
+        """
+        self.version = version
+        self.entries = sorted(entries) if entries is not None else None
+        self.keys = [entry[0] for entry in self.entries] if entries is not None else None
+
+    def search(self, prefix, limit):
+        """
+        :param prefix: A search key (see search_key)
+        :param limit: The most entries to find
+        :return: A list of the matching entries, in order
+        """
+        start = bisect.bisect_left(self.keys, prefix)
+        end = start
+        while end < min(start + limit, len(self.keys)) and self.keys[end].startswith(prefix):
+            end += 1
+        return self.entries[start:end]
+
+
+def _load(kind, most):
+    """
+    :param kind: 'games' or 'players'
+    :param most: The most entries to read
+    :return: A list of the catalogue's (search key, name, id, ...) tuples, up to one more than the most
+    """
+    if kind == 'games':
+        rows = Game.objects.values_list('search_name', 'name', 'id')
+    else:
+        rows = Player.objects.values_list('search_name', 'user__username', 'id', 'user__first_name')
+    return list(rows[:most + 1])
+
+
+def get_index(kind):
+    """
+    Gets this process's index of a catalogue, rebuilding it if the catalogue has changed since it was built.
+
+    :param kind: 'games' or 'players'
+    :return: A PrefixIndex, or None if indexes are turned off or the catalogue is too big to keep in memory (more than
+    GAMEBOARD_AUTOCOMPLETE_MAX_ENTRIES)
+    """
+    if not getattr(settings, 'GAMEBOARD_AUTOCOMPLETE_IN_MEMORY', True):
+        return None
+    version = _current_version(kind)
+    index = _indexes.get(kind)
+    if index is not None and index.version == version:
+        return index if index.entries is not None else None
+
+    with _lock:
+        index = _indexes.get(kind)
+        if index is None or index.version != version:
+            most = getattr(settings, 'GAMEBOARD_AUTOCOMPLETE_MAX_ENTRIES', 100000)
+            entries = _load(kind, most)
+            index = _indexes[kind] = PrefixIndex(version, entries if len(entries) <= most else None)
+    return index if index.entries is not None else None
+
+
+def _search_database(kind, prefix, limit, group, in_group):
+    """
+    Finds the matching entries with a range scan of the search name index, for when there is no index in memory or
+    the suggestions are limited to a group's members (or non members).
+    """
+    if kind == 'games':
+        rows = Game.objects.values_list('search_name', 'name', 'id')
+    else:
+        rows = Player.objects.values_list('search_name', 'user__username', 'id', 'user__first_name')
+        if group is not None:
+            rows = rows.filter(players=group) if in_group else rows.exclude(players=group)
+    if prefix:
+        # Everything which starts with the prefix sorts between it and it followed by the highest character
+        rows = rows.filter(search_name__gte=prefix, search_name__lt=prefix + "\U0010ffff")
+    return list(rows.order_by('search_name', 'id')[:limit])
+
+
+def suggest(kind, prefix, limit=LIMIT, group=None, in_group=True):
+    """
+    Suggests the games or players whose names start with what has been typed so far, ignoring case.
+
+    :param kind: 'games' or 'players'
+    :param prefix: What has been typed
+    :param limit: The most suggestions to give
+    :param group: Optionally (for players), a PlayerGroup to suggest only the members of, or only the non members of
+    :param in_group: True to suggest the group's members, False to suggest everyone else
+    :return: A list of dicts, each with the 'id' and 'name' of a game, or the 'id', 'name' (username) and 'first_name'
+    of a player
+    """
+    if kind not in KINDS:
+        raise ValueError("Unknown catalogue %s" % kind)
+    prefix = search_key(prefix)
+    # Filtering the whole catalogue's index down to a small group could walk all of it, so a group's players are found
+    # in the database, through the search name index
+    index = get_index(kind) if group is None else None
+    if index is None:
+        entries = _search_database(kind, prefix, limit, group, in_group)
+    else:
+        entries = index.search(prefix, limit)
+
+    if kind == 'games':
+        return [{'id': game_id, 'name': name} for (_, name, game_id) in entries]
+    return [{'id': player_id, 'name': username, 'first_name': first_name}
+            for (_, username, player_id, first_name) in entries]
@@ -0,0 +1,171 @@
+from collections import defaultdict
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from gameboard.models import GameParticipation, GamePlayed, Player, PlayerGameStats
+
+
+def _group_by_player(pairs):
+    """
+    Groups (game_played_id, player_id) pairs by player.
+
+    :param pairs: An iterable of (game_played_id, player_id) tuples
+    :return: A dict of player id to the set of game played ids for that player
+    """
+    by_player = defaultdict(set)
+    for (game_played_id, player_id) in pairs:
+        by_player[player_id].add(game_played_id)
+    return by_player
+
+
+def _group_by_count(by_player):
+    """
+    Groups players by how many rows changed for them, so each distinct count needs only one UPDATE.
+
+    :param by_player: A dict of player id to the set of game played ids for that player
+    :return: A dict of count to the list of player ids with that count
+    """
+    by_count = defaultdict(list)
+    for player_id, game_played_ids in by_player.items():
+        by_count[len(game_played_ids)].append(player_id)
+    return by_count
+
+
+def _update_game_stats(pairs, field, sign, games=None):
+    """
+    Adjusts the PlayerGameStats rows touched by some GamePlayed changes, creating any rows which are missing.
+
+    :param pairs: An iterable of (game_played_id, player_id) tuples which changed
+    :param field: Either 'plays' or 'wins'
+    :param sign: 1 if the rows were added, -1 if they were removed
+    :param games: A dict of game_played_id to game_id, looked up if not given
+    :return: None
+    """
+    pairs = set(pairs)
+    if games is None:
+        games = dict(GamePlayed.objects.filter(pk__in={g for (g, _) in pairs}).values_list('id', 'game_id'))
+
+    per_player_game = defaultdict(int)
+    for (game_played_id, player_id) in pairs:
+        if game_played_id in games:
+            per_player_game[(player_id, games[game_played_id])] += 1
+    if not per_player_game:
+        return
+
+    if sign > 0:
+        PlayerGameStats.objects.bulk_create(
+            [PlayerGameStats(player_id=player_id, game_id=game_id) for (player_id, game_id) in per_player_game],
+            ignore_conflicts=True)
+
+    by_game_count = defaultdict(list)
+    for (player_id, game_id), count in per_player_game.items():
+        by_game_count[(game_id, count)].append(player_id)
+    for (game_id, count), player_ids in by_game_count.items():
+        PlayerGameStats.objects.filter(game_id=game_id, player_id__in=player_ids) \
+            .update(**{field: F(field) + sign * count})
+
+
+def add_participations(pairs, winners=False, games=None):
+    """
+    Updates the player counters after players (or winners) were added to some games.
+
+    :param pairs: An iterable of (game_played_id, player_id) tuples which were added
+    :param winners: True if the rows were wins, False if they were participations
+    :param games: A dict of game_played_id to game_id, looked up if not given
+    :return: None
+    """
+    by_player = _group_by_player(pairs)
+    if not by_player:
+        return
+
+    field = 'num_wins' if winners else 'num_played'
+    for count, player_ids in _group_by_count(by_player).items():
+        Player.objects.filter(pk__in=player_ids).update(**{field: F(field) + count})
+    _update_game_stats(pairs, 'wins' if winners else 'plays', 1, games)
+
+    if not winners:
+        game_played_ids = set().union(*by_player.values())
+        dates = dict(GamePlayed.objects.filter(pk__in=game_played_ids).values_list('id', 'date'))
+        by_date = defaultdict(list)
+        for player_id, game_played_ids in by_player.items():
+            by_date[max(dates[g] for g in game_played_ids)].append(player_id)
+        for date, player_ids in by_date.items():
+            Player.objects.filter(Q(last_played__isnull=True) | Q(last_played__lt=date), pk__in=player_ids) \
+                .update(last_played=date)
+
+
+def remove_participations(pairs, winners=False, games=None):
+    """
+    Updates the player counters after players (or winners) were removed from some games.
+
+    :param pairs: An iterable of (game_played_id, player_id) tuples which were removed
+    :param winners: True if the rows were wins, False if they were participations
+    :param games: A dict of game_played_id to game_id, needed when the GamePlayed rows no longer exist
+    :return: None
+    """
+    by_player = _group_by_player(pairs)
+    if not by_player:
+        return
+
+    field = 'num_wins' if winners else 'num_played'
+    for count, player_ids in _group_by_count(by_player).items():
+        Player.objects.filter(pk__in=player_ids).update(**{field: F(field) - count})
+    _update_game_stats(pairs, 'wins' if winners else 'plays', -1, games)
+
+    if not winners:
+        refresh_last_played(by_player.keys())
+
+
+def refresh_last_played(player_ids):
+    """
+    Recomputes the last played date of some players, for when games are removed or moved to a different date.
+
+    :param player_ids: The ids of the players to update
+    :return: None
+    """
+    latest = GamePlayed.objects.filter(players=OuterRef('pk')).order_by('-date').values('date')
+    Player.objects.filter(pk__in=list(player_ids)).update(last_played=Subquery(latest[:1]))
+
+
+def rebuild_player_counters(players=None):
+    """
+    Recomputes the player counters from scratch. Used after bulk writes which skip the signals, or to repair drift.
+
+    :param players: A Player queryset to rebuild, defaults to every player
+    :return: None
+    """
+    if players is None:
+        players = Player.objects.all()
+
+    # Plays and wins are counted together, in one pass over the player's participations
+    totals = GameParticipation.objects.filter(player=OuterRef('pk')).order_by().values('player') \
+        .annotate(plays=Count('id'), wins=Count('id', filter=Q(is_winner=True)))
+    latest = GamePlayed.objects.filter(players=OuterRef('pk')).order_by('-date').values('date')
+
+    players.update(
+        num_played=Coalesce(Subquery(totals.values('plays')[:1], output_field=IntegerField()), Value(0)),
+        num_wins=Coalesce(Subquery(totals.values('wins')[:1], output_field=IntegerField()), Value(0)),
+        last_played=Subquery(latest[:1]),
+    )
+
+
+def rebuild_player_game_stats(players=None):
+    """
+    Recomputes the PlayerGameStats table from scratch. Used after bulk writes which skip the signals.
+
+    :param players: A Player queryset to rebuild, defaults to every player
+    :return: None
+    """
+    if players is None:
+        players = Player.objects.all()
+
+    totals = GameParticipation.objects.filter(player__in=players).order_by() \
+        .values_list('player_id', 'gameplayed__game_id') \
+        .annotate(plays=Count('id'), wins=Count('id', filter=Q(is_winner=True)))
+
+    PlayerGameStats.objects.filter(player__in=players).delete()
+    PlayerGameStats.objects.bulk_create([
+        PlayerGameStats(player_id=player_id, game_id=game_id, plays=plays, wins=wins)
+        for (player_id, game_id, plays, wins) in totals
+    ])
@@ -0,0 +1,111 @@
+from collections import Counter, defaultdict
+
+from gameboard.helpers.history import find_history_page
+from gameboard.helpers.leaderboard import find_leaderboard
+from gameboard.helpers.ratings import find_rankings
+from gameboard.helpers.streaks import find_longest_streak
+from gameboard.models import GameParticipation, GamePlayed, Player
+
+
+class GroupDashboard:
+    """
+    Every statistic shown on the group page. The group's history is read once, as flat tuples, and most of the stats are
+    then computed from it in a single pass. The best player and longest win streak come from the group's rating and
+    streak indexes, and the top 5 charts from the leaderboard queries.
+    """
+    # How many of the most recent games are listed on the page
+    num_recent_games = 9
+
+    def __init__(self, group):
+        """
+        Loads the group's history and computes the dashboard.
+
+        :param group: A PlayerGroup object
+        """
+        self.group = group
+        self.players = list(group.players.select_related('user'))
+        self.admins = list(group.admins.select_related('user'))
+        self.num_players = len(self.players)
+
+        # The whole history, as (id, date, game name) and (game played id, player id) tuples
+        games = list(GamePlayed.objects.filter(group=group).order_by('date', 'id')
+                     .values_list('id', 'date', 'game__name'))
+        played_by = defaultdict(list)
+        won_by = defaultdict(set)
+        for (game_played_id, player_id, is_winner) in GameParticipation.objects.filter(gameplayed__group=group) \
+                .values_list('gameplayed_id', 'player_id', 'is_winner'):
+            played_by[game_played_id].append(player_id)
+            if is_winner:
+                won_by[game_played_id].add(player_id)
+
+        self._compute(games, played_by, won_by)
+        (self.longest_win_streak_player, self.longest_win_streak) = find_longest_streak('group', group.id)
+        self.recent_games = self._find_recent_games()
+
+    def _compute(self, games, played_by, won_by):
+        """
+        Walks the group's history once, in date order, computing all of the dashboard statistics.
+
+        :param games: A list of (id, date, game name) tuples in date order
+        :param played_by: A dict of game played id to the ids of the players in it
+        :param won_by: A dict of game played id to the ids of the winners of it
+        :return: None
+        """
+        plays = Counter()
+        wins = Counter()
+        game_counts = Counter()
+        day_counts = Counter()
+
+        for (game_played_id, date, game_name) in games:
+            game_counts[game_name] += 1
+            day_counts[str(date)] += 1
+            winners = won_by.get(game_played_id, set())
+            for player_id in winners:
+                wins[player_id] += 1
+            for player_id in played_by.get(game_played_id, []):
+                plays[player_id] += 1
+
+        # Everyone who has taken part, even if they have since left the group
+        members = {p.id: p for p in self.players}
+        others = set(plays) | set(wins)
+        others.difference_update(members)
+        people = dict(members)
+        people.update({p.id: p for p in Player.objects.filter(id__in=others).select_related('user')})
+
+        self.num_games_played = len(games)
+
+        # Best player: the highest rated current member, shown with their win rate in the group
+        self.best_player = None
+        self.best_player_win_rate = 0
+        rankings = find_rankings('group', self.group.id, players=self.group.players.all(), limit=1)
+        if rankings and plays[rankings[0].player_id] > 0:
+            best_id = rankings[0].player_id
+            self.best_player = members.get(best_id, rankings[0].player)
+            self.best_player_win_rate = (wins[best_id] / plays[best_id]) * 100
+
+        (self.most_active_player, self.most_active_played) = (None, 0)
+        if plays:
+            (active_id, self.most_active_played) = max(plays.items(), key=lambda x: (x[1], -x[0]))
+            self.most_active_player = people.get(active_id)
+
+        (self.favorite_game, self.favorite_game_played) = (None, 0)
+        if game_counts:
+            (self.favorite_game, self.favorite_game_played) = max(game_counts.items(), key=lambda x: (x[1], x[0]))
+
+        # Chart data: the games per day in the csv layout the template parses, and the leaderboards as rows
+        days = sorted(day_counts.items())[-10:]
+        self.games_played_by_date = False
+        if len(days) == 10:
+            self.games_played_by_date = ", ".join([d for (d, _) in days] + [str(c) for (_, c) in days])
+        self.top_5_winners = find_leaderboard('group', self.group.id, 'wins', 5)
+        self.top_5_games = find_leaderboard('group', self.group.id, 'plays', 5, subject='games')
+
+    def _find_recent_games(self):
+        """
+        Gets the most recent games, with their game, players and winners fetched up front.
+
+        :return: A list of lists, containing the game played and an index letter (for the page's modals).
+        """
+        (games, _) = find_history_page(self.group, limit=self.num_recent_games)
+        index = ["a", "b", "c", "d", "e", "f", "g", "h", "i"]
+        return [[game, index[i]] for (i, game) in enumerate(games)]
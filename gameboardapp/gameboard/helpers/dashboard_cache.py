@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+logger = logging.getLogger('gameboard.dashboards')
+
+# The dashboards which are cached, each with its own version per group or player
+KINDS = ['group', 'player']
+
+# How long (in seconds) another process is kept from refreshing a dashboard which is already being refreshed
+REFRESH_LOCK_TIMEOUT = 60
+
+# The dashboards being computed in this process (flight key, the payload key and version, to a Future of the result),
+# and the background threads refreshing them (payload key to thread)
+_lock = threading.Lock()
+_in_flight = dict()
+_refreshes = dict()
+
+
+def _version_key(kind, scope_id):
+    return "gameboard:version:%s:%d" % (kind, scope_id)
+
+
+def _payload_key(kind, scope_id):
+    return "gameboard:dashboard:%s:%d" % (kind, scope_id)
+
+
+def _flight_key(kind, scope_id, version):
+    # A computation which started before a write is for the old version, so requests for the new one must not join it
+    return "%s:%d" % (_payload_key(kind, scope_id), version)
+
+
+def _refresh_lock_key(kind, scope_id):
+    return "gameboard:refreshing:%s:%d" % (kind, scope_id)
+
+
+def _new_version():
+    """
+    :return: A version number which has not been used before, so a version which was evicted from the cache can never
+    come back and match an old payload
+    """
+    return int(time.time() * 1000000)
+
+
+def current_version(kind, scope_id):
+    """
+    Gets a group's or player's version, giving them one if they do not have one yet. Other statistics cached for a
+    group or player can be keyed by it, so that they are out of date whenever its dashboard is.
+
+    :param kind: 'group' or 'player'
+    :param scope_id: The id of the group or player
+    :return: The current version
+    """
+    key = _version_key(kind, scope_id)
+    cache.add(key, _new_version(), None)
+    return cache.get(key)
+
+
+def _bump(kind, scope_ids):
+    for scope_id in scope_ids:
+        try:
+            cache.incr(_version_key(kind, scope_id))
+        except ValueError:
+            cache.set(_version_key(kind, scope_id), _new_version(), None)
+
+
+def bump_versions(kind, scope_ids):
+    """
+    Moves some groups' or players' dashboards on to a new version, so the payloads cached for them are no longer used.
+    Called from the signals whenever a write changes what the dashboards show. The versions are moved on again once
+    the transaction commits, since another request could have read the new version and cached a payload computed from
+    the rows as they were before the write.
+
+    :param kind: 'group' or 'player'
+    :param scope_ids: The ids of the groups or players (None is ignored)
+    :return: None
+    """
+    if kind not in KINDS:
+        raise ValueError("Unknown dashboard %s" % kind)
+    scope_ids = {scope_id for scope_id in scope_ids if scope_id is not None}
+    if scope_ids:
+        _bump(kind, scope_ids)
+        transaction.on_commit(lambda: _bump(kind, scope_ids))
+
+
+def _single_flight(key, compute):
+    """
+    Runs a computation, unless the same key is already being computed in this process, in which case the result of
+    that computation is waited for and shared.
+
+    :param key: The key of the computation
+    :param compute: A function with no arguments
+    :return: The result of the computation
+    """
+    with _lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        result = compute()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _lock:
+            _in_flight.pop(key, None)
+
+
+def _compute_and_store(kind, scope_id, version, compute):
+    """
+    Computes a dashboard payload and caches it under the version it was computed for. If a write bumps the version
+    while this runs, the payload is stored under the old version and will be refreshed again when it is next read.
+
+    :return: The cache entry, a dict of the version, the time it was computed and the payload
+    """
+    entry = {'version': version, 'computed_at': time.time(), 'data': compute()}
+    timeout = getattr(settings, 'GAMEBOARD_DASHBOARD_CACHE_TIMEOUT', 60 * 60 * 24)
+    if getattr(settings, 'GAMEBOARD_DASHBOARD_STALE_WHILE_REVALIDATE', False):
+        timeout += getattr(settings, 'GAMEBOARD_DASHBOARD_STALE_TIMEOUT', 60 * 60 * 24 * 7)
+    cache.set(_payload_key(kind, scope_id), entry, timeout)
+    return entry
+
+
+def _refresh(kind, scope_id, version, compute):
+    """
+    Recomputes a dashboard in a background thread.
+    """
+    key = _payload_key(kind, scope_id)
+    try:
+        _single_flight(_flight_key(kind, scope_id, version),
+                       lambda: _compute_and_store(kind, scope_id, version, compute))
+    except Exception:
+        logger.exception("Refreshing the %s dashboard %d failed", kind, scope_id)
+    finally:
+        cache.delete(_refresh_lock_key(kind, scope_id))
+        connection.close()
+        with _lock:
+            _refreshes.pop(key, None)
+
+
+def _refresh_in_background(kind, scope_id, version, compute):
+    """
+    Starts recomputing a dashboard in a background thread, unless it is already being recomputed (by this process, or
+    by another one sharing the cache).
+    """
+    key = _payload_key(kind, scope_id)
+    with _lock:
+        if _flight_key(kind, scope_id, version) in _in_flight or key in _refreshes:
+            return
+        if not cache.add(_refresh_lock_key(kind, scope_id), True, REFRESH_LOCK_TIMEOUT):
+            return
+        thread = threading.Thread(target=_refresh, args=(kind, scope_id, version, compute), daemon=True)
+        _refreshes[key] = thread
+    thread.start()
+
+
+def wait_for_refreshes(timeout=None):
+    """
+    Waits for the background refreshes started by this process to finish.
+
+    :param timeout: Optionally, the most seconds to wait for each refresh
+    :return: None
+    """
+    with _lock:
+        threads = list(_refreshes.values())
+    for thread in threads:
+        thread.join(timeout)
+
+
+def cached_dashboard(kind, scope_id, compute):
+    """
+    Gets a group's or player's dashboard payload from the cache. The version and the payload are read together, so a
+    repeat view costs a single cache read.
+
+    A payload is fresh if it was computed for the current version within the cache timeout. If there is no fresh
+    payload, it is computed, and concurrent requests for the same dashboard share one computation. In stale while
+    revalidate mode a payload of the current version which has only outlived the timeout is served straight away
+    instead, while a single background thread computes a new one. A payload of an old version (one a write has changed)
+    is never served.
+
+    :param kind: 'group' or 'player'
+    :param scope_id: The id of the group or player
+    :param compute: A function with no arguments which computes the payload (the payload must be picklable)
+    :return: A tuple of the payload and its age in seconds
+    """
+    if kind not in KINDS:
+        raise ValueError("Unknown dashboard %s" % kind)
+    (version_key, payload_key) = (_version_key(kind, scope_id), _payload_key(kind, scope_id))
+    found = cache.get_many([version_key, payload_key])
+    version = found.get(version_key)
+    entry = found.get(payload_key)
+    if version is None:
+        version = current_version(kind, scope_id)
+
+    if entry is not None:
+        age = time.time() - entry['computed_at']
+        timeout = getattr(settings, 'GAMEBOARD_DASHBOARD_CACHE_TIMEOUT', 60 * 60 * 24)
+        if entry['version'] == version and age < timeout:
+            return (entry['data'], age)
+        # Only a payload which has aged out is served stale: after a write, the writer must see what they wrote
+        if entry['version'] == version and getattr(settings, 'GAMEBOARD_DASHBOARD_STALE_WHILE_REVALIDATE', False):
+            _refresh_in_background(kind, scope_id, version, compute)
+            return (entry['data'], age)
+
+    entry = _single_flight(_flight_key(kind, scope_id, version),
+                           lambda: _compute_and_store(kind, scope_id, version, compute))
+    return (entry['data'], time.time() - entry['computed_at'])
@@ -0,0 +1,143 @@
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from gameboard.helpers.dashboard_cache import current_version
+from gameboard.models import GameParticipation
+
+
+def _cache_key(group_id, version):
+    return "gameboard:head_to_head:%d:%d" % (group_id, version)
+
+
+class HeadToHead:
+    """
+    The head to head record of every pair of players in a group. Built from a players x games incidence matrix of who
+    played and who won each game, so every pairwise record comes from a couple of matrix products.
+    """
+
+    def __init__(self, player_ids, beat, together):
+        """
+        :param player_ids: The player ids, in the order of the matrix rows and columns
+        :param beat: A matrix where beat[a, b] is the number of games player a won and player b played and lost
+        :param together: A matrix where together[a, b] is the number of games players a and b both played
+        """
+        self.player_ids = list(player_ids)
+        self.position = {player_id: i for (i, player_id) in enumerate(self.player_ids)}
+        self.beat = beat
+        self.together = together
+
+    @classmethod
+    def build(cls, group):
+        """
+        Builds the head to head matrices from a group's history, which is read in one query.
+
+        :param group: A PlayerGroup object
+        :return: A HeadToHead object
+        """
+        rows = list(GameParticipation.objects.filter(gameplayed__group=group)
+                    .values_list('gameplayed_id', 'player_id', 'is_winner'))
+        played = [(game_played_id, player_id) for (game_played_id, player_id, _) in rows]
+        won = [(game_played_id, player_id) for (game_played_id, player_id, is_winner) in rows if is_winner]
+
+        player_ids = sorted({player_id for (_, player_id) in played + won})
+        game_ids = sorted({game_played_id for (game_played_id, _) in played + won})
+        player_position = {player_id: i for (i, player_id) in enumerate(player_ids)}
+        game_position = {game_played_id: i for (i, game_played_id) in enumerate(game_ids)}
+
+        participated = np.zeros((len(player_ids), len(game_ids)), dtype=bool)
+        winners = np.zeros((len(player_ids), len(game_ids)), dtype=bool)
+        for (rows, matrix) in [(played, participated), (won, winners)]:
+            if rows:
+                (games, players) = zip(*rows)
+                matrix[[player_position[p] for p in players], [game_position[g] for g in games]] = True
+
+        losers = participated & ~winners
+        beat = winners.astype(np.int64) @ losers.T.astype(np.int64)
+        together = participated.astype(np.int64) @ participated.T.astype(np.int64)
+        np.fill_diagonal(together, 0)
+        return cls(player_ids, beat, together)
+
+    @classmethod
+    def for_group(cls, group):
+        """
+        Gets the head to head matrices of a group, from the cache if they have been built since the group's results
+        last changed. They are cached under the version of the group's dashboard, which every write to its results
+        moves on, and for no longer than the dashboard is.
+
+        :param group: A PlayerGroup object
+        :return: A HeadToHead object
+        """
+        key = _cache_key(group.id, current_version('group', group.id))
+        head_to_head = cache.get(key)
+        if head_to_head is None:
+            head_to_head = cls.build(group)
+            cache.set(key, head_to_head, getattr(settings, 'GAMEBOARD_DASHBOARD_CACHE_TIMEOUT', 60 * 60 * 24))
+        return head_to_head
+
+    def _best(self, row):
+        """
+        :param row: A row of counts, one per player
+        :return: A tuple of the player id with the biggest count and that count, or (None, 0) if every count is zero
+        """
+        if len(row) == 0 or row.max() == 0:
+            return (None, 0)
+        best = int(row.argmax())
+        return (self.player_ids[best], int(row[best]))
+
+    def nemesis(self, player_id):
+        """
+        :param player_id: The id of a player
+        :return: A tuple of the id of the player who has beaten them the most, and how many times
+        """
+        if player_id not in self.position:
+            return (None, 0)
+        return self._best(self.beat[:, self.position[player_id]])
+
+    def favorite_victim(self, player_id):
+        """
+        :param player_id: The id of a player
+        :return: A tuple of the id of the player they have beaten the most, and how many times
+        """
+        if player_id not in self.position:
+            return (None, 0)
+        return self._best(self.beat[self.position[player_id], :])
+
+    def rival(self, player_id):
+        """
+        :param player_id: The id of a player
+        :return: A tuple of the id of the player they have played against the most, and how many games
+        """
+        if player_id not in self.position:
+            return (None, 0)
+        return self._best(self.together[self.position[player_id], :])
+
+    def record(self, player_id, opponent_id):
+        """
+        :param player_id: The id of a player
+        :param opponent_id: The id of another player
+        :return: A tuple of how many times the player has beaten the opponent, and lost to them
+        """
+        if player_id not in self.position or opponent_id not in self.position:
+            return (0, 0)
+        (a, b) = (self.position[player_id], self.position[opponent_id])
+        return (int(self.beat[a, b]), int(self.beat[b, a]))
+
+
+def forget_groups(group_ids):
+    """
+    Drops the cached head to head matrices of some groups, after their results changed. They are dropped again once
+    the transaction commits, in case another request built them from the results as they were before the change.
+
+    :param group_ids: The ids of the groups
+    :return: None
+    """
+    group_ids = {group_id for group_id in group_ids if group_id is not None}
+
+    def forget():
+        cache.delete_many([_cache_key(group_id, current_version('group', group_id)) for group_id in group_ids])
+
+    if group_ids:
+        forget()
+        transaction.on_commit(forget)
@@ -0,0 +1,76 @@
+import datetime
+
+from django.db.models import Prefetch, Sum
+
+from gameboard.models import GameParticipation, GamePlayed, GroupActivity
+
+# How many games are on a page of a group's history, unless asked for otherwise, and the most there can be
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(game_played):
+    """
+    :param game_played: The last GamePlayed on a page
+    :return: The cursor of the page after it, e.g. "2019-12-04.17"
+    """
+    return "%s.%d" % (game_played.date.isoformat(), game_played.id)
+
+
+def decode_cursor(cursor):
+    """
+    :param cursor: A cursor from encode_cursor
+    :return: A tuple of the date and id of the last game on the page before
+    :raises ValueError: If the cursor is not valid
+    """
+    (date, game_played_id) = cursor.split(".")
+    return (datetime.datetime.strptime(date, "%Y-%m-%d").date(), int(game_played_id))
+
+
+def find_history_page(group, cursor=None, limit=PAGE_SIZE):
+    """
+    Gets a page of a group's games, newest first, with their game, players and winners fetched up front.
+
+    Pages are found by key (the date and id of the last game on the previous page) rather than by offset, so the
+    database seeks straight to the start of the page through the (group, date, id) index, and a deep page costs the
+    same as the first. New games being added while someone scrolls do not shift the pages either.
+
+    :param group: A PlayerGroup object (or its id)
+    :param cursor: Optionally, the cursor returned with the previous page
+    :param limit: How many games to get
+    :return: A tuple of the list of GamePlayed objects and the cursor of the next page (None if this is the last page)
+    :raises ValueError: If the cursor is not valid
+    """
+    games = GamePlayed.objects.filter(group=group)
+    if cursor:
+        (date, game_played_id) = decode_cursor(cursor)
+        games = games.filter(date__lte=date).exclude(date=date, id__gte=game_played_id)
+    participations = GameParticipation.objects.select_related('player__user').order_by('id')
+    games = games.order_by('-date', '-id').select_related('game') \
+        .prefetch_related(Prefetch('participations', queryset=participations))
+
+    page = list(games[:limit + 1])
+    if len(page) > limit:
+        return (page[:limit], encode_cursor(page[limit - 1]))
+    return (page, None)
+
+
+def count_history(group):
+    """
+    Counts a group's games from its activity rollup, which has a row per day rather than per game.
+
+    :param group: A PlayerGroup object (or its id)
+    :return: The number of games the group has played
+    """
+    return GroupActivity.objects.filter(group=group).aggregate(total=Sum('games'))['total'] or 0
+
+
+def serialize_game_played(game_played):
+    """
+    :param game_played: A GamePlayed object, with its game and participations fetched
+    :return: The game as a dict, ready to be serialized to JSON
+    """
+    participations = game_played.participations.all()
+    return {'id': game_played.id, 'game': game_played.game.name, 'date': game_played.date.isoformat(),
+            'players': [p.player.user.username for p in participations],
+            'winners': [p.player.user.username for p in participations if p.is_winner]}
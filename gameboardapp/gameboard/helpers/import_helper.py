@@ -1,72 +1,169 @@
-import csv
+import hashlib
+import logging
 import os
+from collections import Counter
+from itertools import islice
 
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
 
-from gameboardapp.settings import STATIC_ROOT, PROJECT_ROOT, BASE_DIR, APP_ROOT, STATIC_URL, MEDIA_ROOT, MEDIA_URL, \
-    REPOSITORY_ROOT
+from gameboardapp.settings import STATIC_ROOT
 from datetime import datetime
-from django.db import IntegrityError
-from gameboard.models import Game, GamePlayed, Player, PlayerGroup, DashboardConfiguration
+from gameboard.helpers import activity, autocomplete, counters
+from gameboard.helpers.import_parsers import PARSERS, RejectedRow, guess_format, read_chunks, read_lines
+from gameboard.helpers.results import count_games_played, insert_rows, insert_with_ids, results_added
+from gameboard.models import Game, GameParticipation, GamePlayed, Player, PlayerGroup, DashboardConfiguration, \
+    ImportCheckpoint, ImportedRow
 
+logger = logging.getLogger('gameboard.imports')
 
-def import_scores_from_csv(f):
-    """
-    Imports a csv (which is in the right format) into the models. Generates a new group and populates it with the
-    appropriate data.
+# How many rejected rows an import keeps the reasons of (the rest are only counted)
+MAX_REJECTIONS = 20
 
-    :param f: The CSV file to import from.
-    :return: The group if it was created, otherwise None.
-    """
-    print(f)
-    with open(os.path.join(STATIC_ROOT, 'dataset.csv'), 'wb+') as destination:
-        for chunk in f.chunks():
-            destination.write(chunk)
-    return None
+# How many results are read and written at a time, unless the GAMEBOARD_IMPORT_BATCH_SIZE setting says otherwise
+BATCH_SIZE = 1000
+
+# How many row hashes are looked up in the import ledger per query, within SQLite's limit on query parameters
+LOOKUP_SIZE = 500
+
+# How imported players get their passwords: 'shared' gives everyone the temporary password, hashed once for the whole
+# import, and 'invite' gives them unusable passwords and a one time token each for choosing their own
+PASSWORD_MODES = ['shared', 'invite']
 
 
 class ImportScores:
     """
-    Imports scores form a custom formatted csv (stored as a static file).
+    Imports scores from a file: the original score spreadsheet (a csv, by default the static dataset) or JSON Lines,
+    see gameboard.helpers.import_parsers.
+
+    The file is streamed a chunk at a time through the parser, and read once, a batch of rows at a time, so memory use
+    does not grow with its size. Names are looked up in maps kept in memory, and each batch is written with bulk
+    inserts. Bulk inserts skip the signals, so the import keeps the player counters and activity current itself, and
+    marks the group's streaks and ratings to be rebuilt when they are next read.
+
+    Every imported row is recorded in the import ledger (ImportedRow) by a hash of its contents, and rows already in
+    the ledger are skipped, so the same spreadsheet can be imported into a group again as it grows. An import into an
+    existing group commits each batch along with a checkpoint (ImportCheckpoint), so an interrupted import of a file
+    resumes where it stopped.
     """
-    # The csv file to get data from
-    csv_log = os.path.join(STATIC_ROOT, 'dataset.csv')
+    # The file to get data from
+    source = os.path.join(STATIC_ROOT, 'dataset.csv')
 
-    # Specific locations of columns within the csv
-    day_loc = 0
-    game_loc = 1
-    first_player_loc = 3
-    coop_flag_loc = 16
-    total_loc = 17
-    end_junk_cnt = 2
+    # The temporary password imported players are given
+    default_password = "WebAppsIsTheBestCourse"
 
-    # Storing the player information
-    players = []
-
-    def __init__(self):
+    def __init__(self, source=None, batch_size=None, password_mode='shared', group=None, progress=None, format=None):
+        """
+        Without a group, wipes all past data (be careful to only use this in a testing environment!) and then adds
+        data, into a new group, all in one transaction. With a group, nothing is deleted: the file's players are added
+        to the group (creating any which do not exist), and only rows which have not been imported into the group yet
+        are added. Adding starts with players, then individual games by the date they were played, adding each game the
+        first time it is seen.
+
+        :param source: Optionally, the file to import instead of the static dataset: a path, or a django File such as
+        an upload
+        :param batch_size: Optionally, how many rows to write at a time
+        :param password_mode: How new players get their passwords, one of PASSWORD_MODES
+        :param group: Optionally, an existing PlayerGroup to import into
+        :param progress: Optionally, a function called with the importer after each batch is written
+        :param format: The format of the file, one of import_parsers.PARSERS (by default, guessed from its name)
         """
-        Wipes all past data (be careful to only use this in a testing environment!) and then adds data. Adding starts
-        with players, then games, then individual games by the date they were played. Assumes the dataset contains all
-        games played by a single group, which hasn't been created yet.
+        if password_mode not in PASSWORD_MODES:
+            raise ValueError("Unknown password mode %s" % password_mode)
+        self.password_mode = password_mode
+        if source is not None:
+            self.source = source
+        self.format = format or guess_format(self.source)
+        if self.format not in PARSERS:
+            raise ValueError("Unknown import format %s" % self.format)
+        self.batch_size = batch_size or getattr(settings, 'GAMEBOARD_IMPORT_BATCH_SIZE', BATCH_SIZE)
+        self.progress = progress
+
+        # The ids of the players and games by name
+        self.player_ids = dict()
+        self.game_ids = dict()
+
+        # What the import did: games added, rows imported, rows skipped because they were imported before and rows
+        # which could not be imported (malformed, or needing to be entered by hand)
+        self.num_games_played = 0
+        self.num_rows = 0
+        self.num_skipped = 0
+        self.num_rejected = 0
+        self.imported_game_ids = set()
+
+        # Why the first MAX_REJECTIONS rejected rows could not be imported
+        self.rejections = []
+
+        # In shared mode, the hash of the temporary password (made when the first new user is added), and in invite
+        # mode, the (uidb64, token) pair to send each new user, by username
+        self.shared_password = None
+        self.invites = dict()
+
+        # A fresh import rebuilds the counters once at the end, an import into a group updates them with each batch
+        self.fresh = group is None
+        if self.fresh:
+            with transaction.atomic():
+                # Wipe the db
+                self.wipe_db()
+                self.import_rows(None)
+        else:
+            self.import_rows(group)
+
+    def import_rows(self, group):
         """
-        # Wipe the db
-        self.wipe_db()
+        Adds the players named up front (in a csv's header) and then the rows of the file, a batch at a time. Each
+        batch, along with its ledger rows and the checkpoint, is committed on its own (unless the whole import is in a
+        transaction).
 
+        :param group: The PlayerGroup to import into, or None to create a new one
+        :return: None
+        """
         # Set some global things
-        try:
-            dashboard_configuration = DashboardConfiguration(type="default")
-            dashboard_configuration.save()
-        except IntegrityError:
-            dashboard_configuration = DashboardConfiguration.objects.filter(type="default").first()
+        (self.dashboard_configuration, _) = DashboardConfiguration.objects.get_or_create(type="default")
 
-        # Add all players from dataset
-        group = self.add_players(dashboard_configuration)
+        source_hash = hashlib.sha256()
+        for chunk in read_chunks(self.source):
+            source_hash.update(chunk)
+        source_hash = source_hash.hexdigest()
 
-        # Add all games from the dataset
-        self.add_games()
+        self.parser = PARSERS[self.format](read_lines(read_chunks(self.source)))
 
-        # Create the games played for this group
-        self.add_game_played(group)
+        # A new group has everyone it is created with as an admin
+        self.new_group = group is None
+        if self.new_group:
+            group = PlayerGroup(name="TAS and Friends")
+            group.save()
+        self.group = group
+        with transaction.atomic():
+            self.add_players(self.parser.players, group)
+
+        # Rows before the checkpoint are known to be imported, so they are not even looked up
+        checkpoint = ImportCheckpoint.objects.filter(group=group, source_hash=source_hash).first()
+        rows_done = checkpoint.rows_done if checkpoint is not None else 0
+        self.num_skipped += rows_done
+
+        # Create the games played for this group, a batch at a time
+        rows = self.read_rows(self.parser.rows(), skip=rows_done)
+        batch = list(islice(rows, self.batch_size))
+        while batch:
+            with transaction.atomic():
+                # The checkpoint is written first, so the transaction holds the write lock from the start
+                rows_done += len(batch)
+                ImportCheckpoint.objects.update_or_create(group=group, source_hash=source_hash,
+                                                          defaults={'rows_done': rows_done})
+                self.add_rows(batch, group)
+            if self.progress is not None:
+                self.progress(self)
+            batch = list(islice(rows, self.batch_size))
+
+        ImportCheckpoint.objects.filter(group=group, source_hash=source_hash).delete()
+        self.finish(group)
 
     def wipe_db(self):
         """
@@ -78,186 +175,200 @@ class ImportScores:
         Game.objects.all().delete()
         GamePlayed.objects.all().delete()
 
-    def add_players(self, dashboard_configuration):
+    def add_players(self, names, group):
         """
-        Adds all the players within the csv to the Player database table.
+        Adds players to the Player database table, and to the group.
 
-        Gets the first line of the csv. Loops over all the players in that line (marked by location marks). Adds those
-        players as users, with a temporary password (WebAppsIsTheBestCourse) and usernames/first names cooresponding
-        to the player name.
+        Adds the players which have not been seen yet in this import as users, with usernames/first names cooresponding
+        to the player name, all in one insert. Depending on the password mode, new users either share a temporary
+        password (WebAppsIsTheBestCourse), which is only hashed once since hashing is deliberately slow, or get an
+        unusable password and an invite token. Users and players which already exist are reused.
 
+        :param names: The player names
+        :param group: The group to add the players to. A new group has them as members and admins, an existing one gets
+        any players it is missing as members.
         :return: None
         """
-        print("BASE_DIR       ", BASE_DIR)
-        print("PROJECT_ROOT   ", PROJECT_ROOT)
-        print("APP_ROOT       ", APP_ROOT)
-        print("STATIC_ROOT    ", STATIC_ROOT)
-        print("STATIC_URL     ", STATIC_URL)
-        print("MEDIA_ROOT     ", MEDIA_ROOT)
-        print("MEDIA_URL      ", MEDIA_URL)
-        print("REPOSITORY_ROOT", REPOSITORY_ROOT)
-        with open(self.csv_log, newline='') as f:
-            # Get the first line
-            reader = csv.reader(f)
-            people = next(reader)
-            self.players = people[self.first_player_loc:-self.end_junk_cnt]
-            group = PlayerGroup(name="TAS and Friends")
-            group.save()
+        names = [name for name in dict.fromkeys(names) if name not in self.player_ids]
+        if not names:
+            return
+        usernames = {player: player.replace(" ", "") for player in names}
+        existing = set(User.objects.filter(username__in=usernames.values()).values_list('username', flat=True))
+        new_usernames = set(usernames.values()) - existing
+        if self.password_mode == 'shared' and new_usernames and self.shared_password is None:
+            self.shared_password = make_password(self.default_password)
+        self._bulk_create(User, [
+            User(first_name=player, last_name="", username=usernames[player],
+                 password=self.shared_password if self.password_mode == 'shared' else make_password(None))
+            for player in names if usernames[player] in new_usernames
+        ])
+        users = list(User.objects.filter(username__in=usernames.values()))
+        user_ids = {user.username: user.id for user in users}
+        if self.password_mode == 'invite':
+            self.invites.update({user.username: (urlsafe_base64_encode(force_bytes(user.pk)),
+                                                 default_token_generator.make_token(user))
+                                 for user in users if user.username in new_usernames})
+
+        existing = set(Player.objects.filter(user__in=user_ids.values()).values_list('user_id', flat=True))
+        new_players = self._bulk_create(Player, [
+            Player(user_id=user_id, dashboard_configuration=self.dashboard_configuration,
+                   date_of_birth=datetime.now().date(), search_name=autocomplete.search_key(username))
+            for (username, user_id) in user_ids.items() if user_id not in existing
+        ])
+        if new_players:
+            autocomplete.changed('players')
+        player_ids = dict(Player.objects.filter(user__in=user_ids.values()).values_list('user_id', 'id'))
+
+        new_ids = {player: player_ids[user_ids[usernames[player]]] for player in names}
+        self.player_ids.update(new_ids)
+        group.players.add(*new_ids.values())
+        if self.new_group:
+            group.admins.add(*new_ids.values())
+
+    def read_rows(self, rows, skip=0):
+        """
+        Identifies each row by a hash of its contents and of how many identical rows came before it, since the same
+        game can be recorded twice in a day.
 
-            # Loop over those players
-            for player in self.players:
-                try:
-                    # Set the user object
-                    username = player.replace(" ", "")
-                    u = User(first_name=player, last_name="", username=username)
-                    u.save()
-                    u.set_password("WebAppsIsTheBestCourse")
-                    u.save()
-
-                    # Set the player object
-                    p = Player(user=u, dashboard_configuration=dashboard_configuration, date_of_birth=datetime.now())
-                    p.save()
-
-                    group.players.add(p)
-                    group.admins.add(p)
-                except IntegrityError:
-                    print("Player object exists already.")
-                    pass
-            return group
-
-    def add_games(self):
+        :param rows: The parser's (content, row) tuples
+        :param skip: How many rows to skip, e.g. the rows before a checkpoint
+        :return: A generator of (row hash, row) tuples
         """
-        Adds all the games within the csv for later relation with the GamePlayed object.
+        seen = Counter()
+        for (content, row) in rows:
+            seen[content] += 1
+            if skip > 0:
+                skip -= 1
+                continue
+            row_hash = hashlib.sha256(("%s\x1e%d" % (content, seen[content])).encode()).hexdigest()
+            yield (row_hash, row)
+
+    def add_rows(self, rows, group):
+        """
+        Adds a batch of rows, skipping those which are already in the group's import ledger (without parsing them), and
+        records the rest in it.
 
-        Loops through all lines in the sheet, looking at a specific column and pulling all the unique names it finds
-        in that column.
+        :param rows: A list of (row hash, row) tuples, where each row is as the parser read it
+        :param group: The group which played the games
+        :return: None
+        """
+        hashes = [row_hash for (row_hash, _) in rows]
+        imported = set()
+        for start in range(0, len(hashes), LOOKUP_SIZE):
+            imported.update(ImportedRow.objects.filter(group=group, row_hash__in=hashes[start:start + LOOKUP_SIZE])
+                            .values_list('row_hash', flat=True))
+        rows = [(row_hash, line) for (row_hash, line) in rows if row_hash not in imported]
+        self.num_skipped += len(imported)
+        self.num_rows += len(rows)
+
+        results = []
+        for (_, row) in rows:
+            try:
+                results.extend(self.parser.parse(row))
+            except RejectedRow as e:
+                self.reject(row, e)
+            except (ValueError, IndexError) as e:
+                # A malformed date, win count or line of JSON
+                self.reject(row, "Malformed row (%s)" % e)
+        # Players who were not named up front (in JSON Lines, all of them) are added as they are found
+        self.add_players([player for (_, _, players, _) in results for player in players], group)
+        if results:
+            self.add_games_played(results, group)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        insert_rows(ImportedRow, ['group_id', 'row_hash', 'imported_at'],
+                    [(group.pk, row_hash, now) for (row_hash, _) in rows])
+
+    def reject(self, row, reason):
+        """
+        Counts a row which could not be imported, and keeps why, for the first few.
 
+        :param row: The row, as the parser read it
+        :param reason: Why it was rejected
         :return: None
         """
-        with open(self.csv_log, newline='') as f:
-            # Open the csv
-            reader = csv.reader(f)
-            for line in reader:
-                # Get the game data
-                game = line[self.game_loc]
-                if len(game) > 0:
-                    try:
-                        # Add it if it is unique
-                        g = Game(name=game)
-                        g.save()
-                    except IntegrityError:
-                        pass
-
-    def add_game_played(self, group):
+        self.num_rejected += 1
+        line = row if isinstance(row, str) else ",".join(row)
+        logger.warning("Rejecting row: %s: %s", reason, line)
+        if len(self.rejections) < MAX_REJECTIONS:
+            self.rejections.append("%s: %s" % (reason, line[:200]))
+
+    def add_games_played(self, results, group):
         """
-        Adds all games that were played which were recorded, as long as they are properly formatted.
+        Actually adds a batch of games played to the database, along with any games which have not been seen yet.
 
+        :param results: A list of (game name, date, player names, winner names) tuples
+        :param group: The group which played the games
         :return: None
         """
-        with open(self.csv_log, newline='') as f:
-            # Open the csv, and read through every line (but the header)
-            reader = csv.reader(f)
-            next(reader)  # skip header line
-            for line in reader:
-                # Get the game (if it is not there, ignore this line)
-                game = line[self.game_loc]
-                if len(game) > 0:
-                    # Get the date the game was played on
-                    date = datetime.strptime(line[self.day_loc], "%A, %m/%d/%y")
-
-                    # Get the players (and their win counts) that played on that day
-                    players_wins = line[self.first_player_loc:-self.end_junk_cnt]
-
-                    players = list()
-                    win_count = list()
-                    # Loop through all the players who played
-                    for player_index in range(len(players_wins)):
-                        # Get their names, and the wins they had
-                        player = self.players[player_index]
-                        player_win_count = players_wins[player_index]
-
-                        if player_win_count != "":
-                            # Actually played in this game
-                            players.append(player)
-                            win_count.append(int(player_win_count))
-
-                    # Try to get the number of wins that occurred on that day (for calculating ties)
-                    try:
-                        total_win_count = int(line[self.total_loc])
-                    except ValueError:
-                        total_win_count = 0
-
-                    # Check if this was a coop game
-                    if line[self.coop_flag_loc] != "":
-                        # coop win, ignore
-                        pass
-                    elif total_win_count > 1:
-                        # Add together all the wins which occurred
-                        sum = 0
-                        for num in players_wins:
-                            try:
-                                sum += int(num)
-                            except ValueError:
-                                pass
-
-                        # Check if there were ties
-                        if sum != total_win_count:
-                            # Some ties occurred, handle this special case manually...
-                            print("WARNING: Found a difficult case to handle, please manually enter.")
-                            print("    Game: %s" % game)
-                            print("    Date: %s" % date)
-                            print("    Total wins: %d" % total_win_count)
-                            for num_index in range(len(players_wins)):
-                                if players_wins[num_index] != "":
-                                    print("    %s: %s" % (self.players[num_index], players_wins[num_index]))
-                        else:
-                            # No ties, so just repeat submission, 1 for every win.
-                            winners = []
-                            for player_index in range(len(players)):
-                                player = players[player_index]
-                                win = win_count[player_index]
-                                for i in range(win):
-                                    winners.append(player)
-                            for winner in winners:
-                                self.enter_game_played(players, [winner], game, date, group)
-
-                    # Only one win, so assign win to everyone without a zero in their column.
-                    elif total_win_count == 1:
-                        winners = []
-                        for player_index in range(len(players)):
-                            player = players[player_index]
-                            win = win_count[player_index]
-                            if win > 0:
-                                winners.append(player)
-
-                        self.enter_game_played(players, winners, game, date, group)
-
-                    else:
-                        # Something went wrong, we should check these out manually.
-                        print("Not counting %s" % game)
-
-    def enter_game_played(self, players_names, winners_names, game, date, group):
+        new_games = {game for (game, _, _, _) in results} - self.game_ids.keys()
+        if new_games:
+            self._bulk_create(Game, [Game(name=game, search_name=autocomplete.search_key(game)) for game in new_games],
+                              ignore_conflicts=True)
+            autocomplete.changed('games')
+            self.game_ids.update(Game.objects.filter(name__in=new_games).values_list('name', 'id'))
+
+        # Names which are the same username (e.g. "A B" and "AB") are the same player, who only plays once
+        results = [(self.game_ids[game], date, list(dict.fromkeys(self.player_ids[player] for player in players)),
+                    {self.player_ids[winner] for winner in winners}) for (game, date, players, winners) in results]
+        game_played_ids = insert_with_ids(GamePlayed, ['game_id', 'date', 'group_id'], [
+            (game_id, connection.ops.adapt_datefield_value(date), group.pk) for (game_id, date, _, _) in results
+        ], batch_size=self.batch_size)
+        insert_rows(GameParticipation, ['gameplayed_id', 'player_id', 'is_winner'], [
+            (game_played_id, player_id, player_id in winner_ids)
+            for (game_played_id, (_, _, player_ids, winner_ids)) in zip(game_played_ids, results)
+            for player_id in player_ids
+        ])
+        self.num_games_played += len(game_played_ids)
+        self.imported_game_ids.update(game_id for (game_id, _, _, _) in results)
+        if not self.fresh:
+            self.count_games_played(game_played_ids, results, group)
+            # The batch is committed on its own, so an import which is interrupted later has still marked it
+            results_added(group.pk, {game_id for (game_id, _, _, _) in results},
+                          {player_id for (_, _, player_ids, _) in results for player_id in player_ids})
+
+    def count_games_played(self, game_played_ids, results, group):
         """
-        Actually adds the game played to the database, linking to Player objects and Game objects.
+        Updates the player counters and the activity rollups for a batch of new games, as the signals would have done
+        had they not been bulk inserted. Used when importing into an existing group, so each committed batch leaves the
+        counters correct.
 
-        :param players_names: The names of the players
-        :param winners_names: The names of the winners of the game
-        :param game: The game that was played (string)
-        :param date: A date object to use for when the game was played
+        :param game_played_ids: The ids of the new GamePlayed rows
+        :param results: The (game id, date, player ids, winner ids) tuple of each of them
+        :param group: The group which played the games
         :return: None
         """
-        try:
-            game_played = GamePlayed()
-            game_played.game = Game.objects.get(name__exact=game)
-            game_played.date = date
-            game_played.group = group
-            game_played.save()
-
-            for player in players_names:
-                game_played.players.add(Player.objects.get(user__first_name__exact=player))
-            for winner in winners_names:
-                game_played.winners.add(Player.objects.get(user__first_name__exact=winner))
-        except:
-            print("Error entering game", game)
-            pass
+        count_games_played(group.pk, [(game_played_id,) + result
+                                      for (game_played_id, result) in zip(game_played_ids, results)])
+
+    def _bulk_create(self, model, objects, **kwargs):
+        """
+        Bulk inserts rows a batch at a time, keeping each INSERT within the database's limits (SQLite only allows so
+        many values in one statement).
 
+        :param model: The model to insert into
+        :param objects: The new model instances
+        :param kwargs: Passed on to bulk_create
+        :return: The instances
+        """
+        fields = model._meta.concrete_fields
+        batch_size = min(self.batch_size, max(connection.ops.bulk_batch_size(fields, objects), 1))
+        return model.objects.bulk_create(objects, batch_size=batch_size, **kwargs)
+
+    def finish(self, group):
+        """
+        Brings the statistics of a fresh import up to date once everything is imported. The player counters and
+        activity are rebuilt from scratch (far cheaper than updating them a batch at a time), the group's (and the
+        imported games') streaks and ratings are marked to be rebuilt when they are next read, and the group's cached
+        statistics are dropped. An import into an existing group did all this with each batch.
+
+        :param group: The group the results were imported into
+        :return: None
+        """
+        if not self.fresh or not self.num_games_played:
+            return
+        players = Player.objects.filter(pk__in=self.player_ids.values())
+        counters.rebuild_player_counters(players)
+        counters.rebuild_player_game_stats(players)
+        activity.rebuild_activity(group)
+
+        results_added(group.pk, self.imported_game_ids, self.player_ids.values())
@@ -0,0 +1,149 @@
+import datetime
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from gameboard.helpers.import_helper import ImportScores
+from gameboard.models import ImportJob
+
+logger = logging.getLogger('gameboard.imports')
+
+# How long (in seconds) a running job can go without reporting progress before it is queued again, unless
+# GAMEBOARD_IMPORT_LEASE is set
+LEASE = 60 * 10
+
+# The pool running this process's import jobs, started when the first job is submitted
+_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor():
+    """
+    :return: The ThreadPoolExecutor import jobs run on, with GAMEBOARD_IMPORT_WORKERS threads (SQLite only has one
+    writer at a time, so one is the default)
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'GAMEBOARD_IMPORT_WORKERS', 1),
+                                           thread_name_prefix='gameboard-import')
+        return _executor
+
+
+def queue_import(source, group=None, created_by=None):
+    """
+    Stores an uploaded file and queues a job to import it. Unless the GAMEBOARD_IMPORT_IN_BACKGROUND setting is off
+    (e.g. when the run_import_jobs command is run as a separate worker), the job is handed to this process's pool once
+    the current transaction commits, so the caller returns straight away.
+
+    :param source: The uploaded file
+    :param group: Optionally, the group to import into (without one, the database is wiped first)
+    :param created_by: Optionally, the player who uploaded the file
+    :return: The ImportJob
+    """
+    job = ImportJob(group=group, created_by=created_by)
+    job.source.save(source.name, source, save=False)
+    job.save()
+    if getattr(settings, 'GAMEBOARD_IMPORT_IN_BACKGROUND', True):
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_background, job.pk))
+    return job
+
+
+def _run_in_background(job_id):
+    """
+    Runs a job on a pool thread, which has its own database connection to close afterwards.
+    """
+    try:
+        run_job(job_id)
+    except Exception:
+        logger.exception("Import job %d could not be run", job_id)
+    finally:
+        connection.close()
+
+
+def _claim(job_id):
+    """
+    Moves a job from queued to running, unless something else (another thread, or the command) got to it first.
+
+    :param job_id: The id of an ImportJob
+    :return: The job if it was claimed, otherwise None
+    """
+    now = timezone.now()
+    claimed = ImportJob.objects.filter(pk=job_id, status='queued').update(status='running', started_at=now,
+                                                                          heartbeat_at=now)
+    if not claimed:
+        return None
+    return ImportJob.objects.select_related('group').get(pk=job_id)
+
+
+def run_job(job_id):
+    """
+    Runs a queued import job, recording its progress after each batch and how it ended.
+
+    :param job_id: The id of an ImportJob
+    :return: The job once it has finished, or None if it was not queued
+    """
+    job = _claim(job_id)
+    if job is None:
+        return None
+
+    def report(importer):
+        ImportJob.objects.filter(pk=job.pk).update(rows_processed=importer.num_rows + importer.num_skipped,
+                                                   rows_rejected=importer.num_rejected,
+                                                   games_added=importer.num_games_played,
+                                                   rejections="\n".join(importer.rejections),
+                                                   heartbeat_at=timezone.now())
+
+    try:
+        importer = ImportScores(source=job.source, group=job.group, progress=report)
+    except Exception:
+        logger.exception("Import job %d failed", job.pk)
+        ImportJob.objects.filter(pk=job.pk).update(status='failed', error=traceback.format_exc(),
+                                                   finished_at=timezone.now())
+    else:
+        report(importer)
+        ImportJob.objects.filter(pk=job.pk).update(status='done', group=importer.group, finished_at=timezone.now())
+        # The file is kept when an import fails, so it can be queued again
+        job.source.delete(save=False)
+    return ImportJob.objects.get(pk=job.pk)
+
+
+def requeue_interrupted():
+    """
+    Queues the running jobs which have not reported progress within the lease (GAMEBOARD_IMPORT_LEASE) again, as the
+    process running them must have stopped. An import into a group picks up from its checkpoint, and a fresh import
+    (which is one transaction) starts over.
+
+    :return: How many jobs were queued again
+    """
+    lease = datetime.timedelta(seconds=getattr(settings, 'GAMEBOARD_IMPORT_LEASE', LEASE))
+    requeued = ImportJob.objects.filter(status='running', heartbeat_at__lt=timezone.now() - lease) \
+        .update(status='queued')
+    if requeued:
+        logger.warning("Queued %d interrupted import jobs again", requeued)
+    return requeued
+
+
+def drain(limit=None):
+    """
+    Runs the queued jobs in this thread, oldest first, until there are none left. Interrupted jobs are queued again
+    first.
+
+    :param limit: Optionally, the most jobs to run
+    :return: A list of the jobs which were run
+    """
+    requeue_interrupted()
+    finished = []
+    while limit is None or len(finished) < limit:
+        job_id = ImportJob.objects.filter(status='queued').order_by('id').values_list('id', flat=True).first()
+        if job_id is None:
+            break
+        job = run_job(job_id)
+        if job is not None:
+            finished.append(job)
+    return finished
@@ -0,0 +1,275 @@
+import codecs
+import csv
+import json
+import os
+from datetime import datetime
+
+# How many bytes are read from a file at a time
+CHUNK_SIZE = 1 << 16
+
+# The date formats a row's date may be written in, tried in order
+DATE_FORMATS = ["%A, %m/%d/%y", "%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y"]
+
+# What a named csv column holds, by its (lower case) header. Any other named column is a player, and None marks a
+# column which is ignored.
+CSV_COLUMNS = {'date': 'date', 'day': 'date', 'game': 'game', 'coop': 'coop', 'total': 'total', 'total wins': 'total',
+               'notes': None}
+
+# Unnamed columns, as in the original spreadsheet, are given their roles by where they are: the ones before the first
+# player, and the ones after the last player
+CSV_LEADING_COLUMNS = ['date', 'game']
+CSV_TRAILING_COLUMNS = ['coop', 'total']
+
+
+class RejectedRow(ValueError):
+    """
+    A row which cannot be imported as it is, and has to be entered by hand.
+    """
+
+
+def read_chunks(source):
+    """
+    Reads a file a chunk at a time, without ever holding the whole of it.
+
+    :param source: The path of a file, or a django File (e.g. an upload or a FileField's file)
+    :return: A generator of bytes
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+    else:
+        yield from source.chunks(CHUNK_SIZE)
+
+
+def read_lines(chunks, encoding='utf-8-sig'):
+    """
+    Splits chunks of bytes into lines of text, decoding as it goes. Line endings are kept, as the csv module needs
+    them for values which span lines.
+
+    :param chunks: An iterable of bytes
+    :param encoding: The file's encoding (a byte order mark is skipped by default)
+    :return: A generator of strings
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def parse_date(value, dates):
+    """
+    :param value: A date as written in a file, in one of the DATE_FORMATS
+    :param dates: A dict of the dates parsed so far (most days have several games, so each is only parsed once)
+    :return: The date
+    """
+    date = dates.get(value)
+    if date is None:
+        for date_format in DATE_FORMATS:
+            try:
+                date = datetime.strptime(value, date_format).date()
+                break
+            except ValueError:
+                continue
+        else:
+            raise RejectedRow("Unknown date %r" % value)
+        dates[value] = date
+    return date
+
+
+class CsvParser:
+    """
+    Reads the original score spreadsheet: a header row naming the players, then one row per game and day with each
+    player's win count. The columns are found from the header, so they can be in any order.
+    """
+
+    def __init__(self, lines):
+        """
+        :param lines: An iterable of the lines of the file, header first
+        """
+        self.reader = csv.reader(lines)
+        self.dates = dict()
+        self.columns = self.map_columns(next(self.reader, []))
+        self.players = [name for (name, _) in self.columns['players']]
+
+    @staticmethod
+    def map_columns(header):
+        """
+        Works out which column holds what from the header row.
+
+        :param header: The first row of the csv
+        :return: A dict of the column index of 'date', 'game', 'coop' and 'total' (those which are present), and of
+        'players', a list of (player name, column index) pairs
+        """
+        columns = {'players': []}
+        unnamed = []
+        for (index, name) in enumerate(header):
+            name = name.strip()
+            if not name:
+                unnamed.append(index)
+            elif name.lower() in CSV_COLUMNS:
+                if CSV_COLUMNS[name.lower()] is not None:
+                    columns[CSV_COLUMNS[name.lower()]] = index
+            else:
+                columns['players'].append((name, index))
+
+        if columns['players']:
+            (first, last) = (columns['players'][0][1], columns['players'][-1][1])
+            leading = [index for index in unnamed if index < first]
+            trailing = [index for index in unnamed if index > last]
+            for (role, index) in zip(CSV_LEADING_COLUMNS, leading):
+                columns.setdefault(role, index)
+            for (role, index) in zip(CSV_TRAILING_COLUMNS, trailing):
+                columns.setdefault(role, index)
+
+        if 'date' not in columns or 'game' not in columns:
+            raise ValueError("The csv header does not say which columns hold the date and the game")
+        return columns
+
+    def rows(self):
+        """
+        :return: A generator of (content, row) tuples for the rows which name a game, where the content identifies the
+        row in the import ledger
+        """
+        game_loc = self.columns['game']
+        for line in self.reader:
+            # Get the game (if it is not there, ignore this line)
+            if len(line) <= game_loc or len(line[game_loc]) == 0:
+                continue
+            yield (self.content(line), line)
+
+    def content(self, line):
+        """
+        Identifies a row by what it records rather than by its cells, so it is still recognised after the spreadsheet
+        gains a player column, or its columns are moved around.
+
+        :param line: A row of the csv
+        :return: A string of the row's date, game, coop and total columns and its (player, win count) pairs, leaving
+        out the players who did not play
+        """
+        players = sorted("%s\x1d%s" % (player, line[index].strip()) for (player, index) in self.columns['players']
+                         if index < len(line) and line[index].strip() != "")
+        fields = [self._get(line, role).strip() for role in ['date', 'game', 'coop', 'total']]
+        return "\x1f".join(fields + players)
+
+    def _get(self, line, role, default=""):
+        index = self.columns.get(role)
+        if index is None or index >= len(line):
+            return default
+        return line[index]
+
+    def parse(self, line):
+        """
+        Reads the games that were played in one row.
+
+        :param line: A row of the csv, which names a game
+        :return: A list of (game name, date, player names, winner names) tuples, one per game played
+        """
+        game = line[self.columns['game']]
+        date = parse_date(self._get(line, 'date'), self.dates)
+
+        # Get the players who played (and their win counts)
+        players = list()
+        win_count = list()
+        for (player, index) in self.columns['players']:
+            if index < len(line) and line[index] != "":
+                players.append(player)
+                win_count.append(int(line[index]))
+
+        # Get the number of wins that occurred on that day (for calculating ties)
+        try:
+            total_win_count = int(self._get(line, 'total', str(sum(win_count))))
+        except ValueError:
+            total_win_count = 0
+
+        # Check if this was a coop game
+        if self._get(line, 'coop') != "":
+            # coop win, ignore
+            return []
+        elif total_win_count > 1:
+            # Check if there were ties
+            if sum(win_count) != total_win_count:
+                # Some ties occurred, handle this special case manually...
+                raise RejectedRow("Ties in %s on %s, please enter manually (%d total wins, %s)" % (
+                    game, date, total_win_count,
+                    ", ".join("%s: %s" % (player, win) for (player, win) in zip(players, win_count))))
+            # No ties, so just repeat submission, 1 for every win.
+            return [(game, date, players, [player]) for (player, win) in zip(players, win_count) for i in range(win)]
+
+        # Only one win, so assign win to everyone without a zero in their column.
+        elif total_win_count == 1:
+            return [(game, date, players, [player for (player, win) in zip(players, win_count) if win > 0])]
+
+        # Something went wrong, we should check these out manually.
+        raise RejectedRow("No wins recorded for %s on %s" % (game, date))
+
+
+class JsonLinesParser:
+    """
+    Reads one game played per line, as a JSON object, e.g.
+    {"date": "2019-12-02", "game": "Catan", "players": ["Jeff", "Jenny"], "winners": ["Jeff"]}
+    The players are not known up front, they are found in the rows.
+    """
+
+    def __init__(self, lines):
+        """
+        :param lines: An iterable of the lines of the file
+        """
+        self.lines = lines
+        self.dates = dict()
+        self.players = []
+
+    def rows(self):
+        """
+        :return: A generator of (content, row) tuples for the non-blank lines, where the content identifies the row in
+        the import ledger
+        """
+        for line in self.lines:
+            line = line.strip()
+            if line:
+                yield (line, line)
+
+    def parse(self, line):
+        """
+        Reads the game played in one line.
+
+        :param line: A line of JSON
+        :return: A list with a (game name, date, player names, winner names) tuple, or an empty list for a coop game
+        """
+        result = json.loads(line)
+        if not isinstance(result, dict):
+            raise RejectedRow("Expected a JSON object")
+        (game, players, winners) = (result.get('game'), result.get('players'), result.get('winners', []))
+        if not game or not isinstance(game, str):
+            raise RejectedRow("No game")
+        if not isinstance(players, list) or not players or not isinstance(winners, list):
+            raise RejectedRow("The players and winners must be lists, with at least one player")
+        players = list(dict.fromkeys(str(player) for player in players))
+        winners = list(dict.fromkeys(str(winner) for winner in winners))
+        if not set(winners) <= set(players):
+            raise RejectedRow("Every winner must be one of the players")
+        date = parse_date(str(result.get('date', "")), self.dates)
+        if result.get('coop'):
+            return []
+        return [(game, date, players, winners)]
+
+
+# The parser for each format a file can be imported from
+PARSERS = {'csv': CsvParser, 'jsonl': JsonLinesParser}
+
+# The format of a file by its extension, when it is not given
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+def guess_format(source):
+    """
+    :param source: The path of a file, or a django File
+    :return: The format of the file (one of PARSERS) by its extension, defaulting to csv
+    """
+    name = source if isinstance(source, str) else (source.name or "")
+    return EXTENSIONS.get(os.path.splitext(name)[1].lower(), 'csv')
@@ -0,0 +1,113 @@
+import heapq
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+# The gameboard package, used to find which of our functions issued a query
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The instrumentation itself, which is never the origin of a query
+SKIPPED_FILES = {os.path.join(PACKAGE_DIR, 'helpers', 'instrumentation.py'),
+                 os.path.join(PACKAGE_DIR, 'middleware.py')}
+
+# How much of each statement goes into a summary
+SQL_PREVIEW_LENGTH = 300
+
+
+def find_origin():
+    """
+    Finds the gameboard function (e.g. a query helper or a view) which issued the query being run.
+
+    :return: A string like "queries.find_groups", or "" if the query did not come from gameboard code
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PACKAGE_DIR) and filename not in SKIPPED_FILES:
+            module = os.path.splitext(os.path.basename(filename))[0]
+            return "%s.%s" % (module, frame.f_code.co_name)
+        frame = frame.f_back
+    return ""
+
+
+class QueryRecorder:
+    """
+    Records the SQL statements run on the database connection while it is active (use it as a context manager):
+    how many there were, the total time they took, and the slowest of them along with the function which issued them.
+    """
+
+    def __init__(self, keep=3):
+        """
+        :param keep: How many of the slowest statements to keep, or None to keep all of them
+        """
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            # Walking the stack for the origin is only worth it for the statements which are kept
+            if self.keep is None or len(self.statements) < self.keep:
+                heapq.heappush(self.statements, (elapsed, self.count, sql, find_origin()))
+            elif self.keep > 0 and elapsed > self.statements[0][0]:
+                heapq.heapreplace(self.statements, (elapsed, self.count, sql, find_origin()))
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+        self._wrapper = None
+
+    @property
+    def slowest(self):
+        """
+        :return: The kept statements, slowest first, as (seconds, sql, origin) tuples
+        """
+        return [(elapsed, sql, origin) for (elapsed, _, sql, origin) in sorted(self.statements, reverse=True)]
+
+    @property
+    def in_order(self):
+        """
+        :return: The kept statements in the order they were run, as (seconds, sql, origin) tuples
+        """
+        return [(elapsed, sql, origin) for (elapsed, _, sql, origin) in sorted(self.statements, key=lambda s: s[1])]
+
+    def summary(self):
+        """
+        :return: A dict of the count, the total time and the slowest statements (times in milliseconds, statements cut
+        short)
+        """
+        return {'queries': self.count, 'db_ms': round(self.duration * 1000, 2),
+                'slowest': [{'ms': round(elapsed * 1000, 2), 'origin': origin, 'sql': sql[:SQL_PREVIEW_LENGTH]}
+                            for (elapsed, sql, origin) in self.slowest]}
+
+
+@contextmanager
+def query_budget(limit):
+    """
+    Fails (with an AssertionError) if the code inside runs more than a given number of queries. Meant for tests, e.g.
+    to check that a view does not issue a query per row.
+
+    :param limit: The most queries which may be run
+    :return: The QueryRecorder, for looking at the queries afterwards
+    """
+    with QueryRecorder(keep=None) as recorder:
+        yield recorder
+    if recorder.count > limit:
+        lines = ["%d. [%s] %s" % (i, origin or "?", sql) for (i, (_, sql, origin)) in enumerate(recorder.in_order, 1)]
+        raise AssertionError("%d queries were run, over the budget of %d:\n%s" % (recorder.count, limit,
+                                                                                  "\n".join(lines)))
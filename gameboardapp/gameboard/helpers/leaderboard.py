@@ -0,0 +1,149 @@
+from django.db.models import Count, F, FloatField, IntegerField, Q, Value
+from django.db.models.functions import Cast
+
+from gameboard.models import GameParticipation, GamePlayed, PlayerGameStats, PlayerGroup
+
+# The statistics a leaderboard can be ranked by
+METRICS = ['plays', 'wins', 'win_rate']
+
+# What each scope ranks by default: the players in a group or game, or the games of a player
+SUBJECTS = {'group': 'players', 'game': 'players', 'player': 'games'}
+
+# The most rows the leaderboard endpoint gives
+MAX_LIMIT = 100
+
+
+class LeaderboardRow:
+    """
+    One entry on a leaderboard: a player or game, and how it did within the scope.
+    """
+
+    def __init__(self, rank, id, name, plays=0, wins=0):
+        self.rank = rank
+        self.id = id
+        self.name = name
+        self.plays = plays
+        self.wins = wins
+
+    @property
+    def win_rate(self):
+        if self.plays > 0:
+            return (self.wins / self.plays) * 100
+        return 0
+
+    def as_dict(self):
+        """
+        :return: The row as a dict, ready to be serialized to JSON
+        """
+        return {'rank': self.rank, 'id': self.id, 'name': self.name, 'plays': self.plays, 'wins': self.wins,
+                'win_rate': round(self.win_rate, 2)}
+
+    def __repr__(self):
+        return "LeaderboardRow(%d, %r, plays=%d, wins=%d)" % (self.rank, self.name, self.plays, self.wins)
+
+
+def _group_players(group_id):
+    """
+    :param group_id: The id of a group
+    :return: A queryset of (id, name, plays, wins) for everyone who has played in the group, counted in one pass over
+    the group's participations
+    """
+    return GameParticipation.objects.filter(gameplayed__group=group_id).order_by().values('player').annotate(
+        plays=Count('id'), wins=Count('id', filter=Q(is_winner=True)), name=F('player__user__username'),
+    ).values_list('player', 'name', 'plays', 'wins')
+
+
+def _group_games(group_id):
+    """
+    :param group_id: The id of a group
+    :return: A queryset of (id, name, plays, wins) for every game the group has played. Games have no wins.
+    """
+    return GamePlayed.objects.filter(group=group_id).order_by().values('game').annotate(
+        plays=Count('id'), wins=Value(0, output_field=IntegerField()), name=F('game__name'),
+    ).values_list('game', 'name', 'plays', 'wins')
+
+
+def _game_players(game_id):
+    """
+    :param game_id: The id of a game
+    :return: A queryset of (id, name, plays, wins) for everyone who has played the game
+    """
+    return PlayerGameStats.objects.filter(game=game_id, plays__gt=0).annotate(name=F('player__user__username')) \
+        .values_list('player', 'name', 'plays', 'wins')
+
+
+def _player_games(player_id):
+    """
+    :param player_id: The id of a player
+    :return: A queryset of (id, name, plays, wins) for every game the player has played
+    """
+    return PlayerGameStats.objects.filter(player=player_id, plays__gt=0).annotate(name=F('game__name')) \
+        .values_list('game', 'name', 'plays', 'wins')
+
+
+# The query behind each (scope, subject) pair
+QUERIES = {
+    ('group', 'players'): _group_players,
+    ('group', 'games'): _group_games,
+    ('game', 'players'): _game_players,
+    ('player', 'games'): _player_games,
+}
+
+
+def can_view_leaderboard(scope, scope_id, player, group_ids):
+    """
+    Checks that a player may see a scope's leaderboard: it must be one of their groups, themselves or a player who
+    shares a group with them, or a game one of their groups has played.
+
+    :param scope: The scope, one of 'group', 'game' or 'player'
+    :param scope_id: The id of the group, game or player
+    :param player: The Player asking (or None)
+    :param group_ids: The ids of the groups they belong to
+    :return: A boolean value
+    """
+    if scope == 'group':
+        return scope_id in group_ids
+    if scope == 'player':
+        return (player is not None and scope_id == player.id) or PlayerGroup.players.through.objects.filter(
+            playergroup__in=group_ids, player=scope_id).exists()
+    if scope == 'game':
+        return GamePlayed.objects.filter(group__in=group_ids, game=scope_id).exists()
+    raise ValueError("Unknown leaderboard scope %s" % scope)
+
+
+def find_leaderboard(scope, scope_id, metric='wins', limit=5, subject=None, players=None):
+    """
+    Ranks the players or games within a scope. The counting, ordering and limiting are all done by the database, so
+    only the rows which are shown are read. Ties are broken by name.
+
+    :param scope: The scope, one of 'group', 'game' or 'player'
+    :param scope_id: The id of the group, game or player
+    :param metric: What to rank by, one of 'plays', 'wins' or 'win_rate'
+    :param limit: How many rows to return, or None for all of them
+    :param subject: What to rank, 'players' or 'games'. Defaults to the players of a group or game, and the games of a
+    player.
+    :param players: Optionally, the ids of the only players who may be ranked (a list or a queryset), e.g. so that a
+    game's leaderboard only shows the players someone shares a group with
+    :return: A list of LeaderboardRow objects, best first
+    """
+    if subject is None:
+        subject = SUBJECTS.get(scope)
+    if (scope, subject) not in QUERIES:
+        raise ValueError("Unknown leaderboard %s of %s" % (subject, scope))
+    if metric not in METRICS:
+        raise ValueError("Unknown leaderboard metric %s" % metric)
+    if subject == 'games' and scope == 'group' and metric != 'plays':
+        raise ValueError("Games in a group can only be ranked by plays")
+
+    rows = QUERIES[(scope, subject)](scope_id)
+    if players is not None and subject == 'players':
+        rows = rows.filter(player__in=players)
+    if metric == 'win_rate':
+        rows = rows.annotate(win_rate=Cast('wins', FloatField()) / Cast('plays', FloatField()))
+        rows = rows.order_by('-win_rate', '-plays', 'name')
+    else:
+        rows = rows.order_by('-' + metric, 'name')
+    if limit is not None:
+        rows = rows[:limit]
+
+    return [LeaderboardRow(rank, *row[:4]) for (rank, row) in enumerate(rows, start=1)]
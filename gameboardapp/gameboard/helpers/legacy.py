@@ -0,0 +1,36 @@
+from django.db import connection
+
+from gameboard.helpers import counters
+from gameboard.models import GameParticipation
+
+# The table GamePlayed.winners used before the winners became a flag on GameParticipation
+LEGACY_WINNERS_TABLE = 'gameboard_gameplayed_winners'
+
+
+def copy_legacy_winners():
+    """
+    Moves the results of a database created before GameParticipation over to it. GameParticipation uses the old players
+    table, so only the winners need copying: winners who were players have their participation flagged, and winners who
+    were not are added as winning participations. Safe to run more than once. Meant to be run from a RunPython
+    migration, once the new columns exist; the old table can be dropped afterwards.
+
+    :return: The number of winners in the old table, or 0 if there is no old table
+    """
+    if LEGACY_WINNERS_TABLE not in connection.introspection.table_names():
+        return 0
+
+    participations = GameParticipation._meta.db_table
+    same_row = "w.gameplayed_id = {p}.gameplayed_id AND w.player_id = {p}.player_id".format(p=participations)
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE {p} SET is_winner = %s WHERE EXISTS (SELECT 1 FROM {w} w WHERE {same})"
+                       .format(p=participations, w=LEGACY_WINNERS_TABLE, same=same_row), [True])
+        cursor.execute("INSERT INTO {p} (gameplayed_id, player_id, is_winner) SELECT w.gameplayed_id, w.player_id, %s "
+                       "FROM {w} w WHERE NOT EXISTS (SELECT 1 FROM {p} WHERE {same})"
+                       .format(p=participations, w=LEGACY_WINNERS_TABLE, same=same_row), [True])
+        cursor.execute("SELECT COUNT(*) FROM {w}".format(w=LEGACY_WINNERS_TABLE))
+        (copied,) = cursor.fetchone()
+
+    # Winners who were not players now count as plays too
+    counters.rebuild_player_counters()
+    counters.rebuild_player_game_stats()
+    return copied
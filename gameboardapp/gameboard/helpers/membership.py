@@ -0,0 +1,66 @@
+from django.db import transaction
+
+from gameboard.models import Player
+
+
+def find_member_choices(group, editor):
+    """
+    Sorts a group's members into the choices of the edit group form, in one pass over them. The editor is left out, so
+    they cannot remove or demote themselves.
+
+    :param group: A PlayerGroup object
+    :param editor: The Player editing the group
+    :return: A tuple of three lists of (username, first name) tuples: every member, the members who are not admins, and
+    the members who are admins
+    """
+    admin_ids = set(group.admins.values_list('id', flat=True))
+    (members, players, admins) = ([], [], [])
+    for member in group.players.select_related('user').order_by('user__username'):
+        if member.pk == editor.pk:
+            continue
+        choice = (member.user.username, member.user.first_name)
+        members.append(choice)
+        (admins if member.pk in admin_ids else players).append(choice)
+    return (members, players, admins)
+
+
+def edit_membership(group, editor, add=(), remove=(), make_admin=(), make_player=()):
+    """
+    Applies a whole set of roster changes at once. Every username is looked up in one query, what has to change is
+    worked out from the current members and admins with set differences, and each change is a single bulk add or
+    remove, all in one transaction.
+
+    A player who is both removed and added stays in the group (but loses being an admin), and only members can be made
+    admins. The editor cannot change their own membership, and unknown usernames are ignored.
+
+    :param group: The PlayerGroup to edit
+    :param editor: The Player editing the group
+    :param add: The usernames of the players to add to the group
+    :param remove: The usernames of the players to remove from the group (and its admins)
+    :param make_admin: The usernames of the members to make admins
+    :param make_player: The usernames of the admins to make ordinary players
+    :return: A dict of the ids of the players 'added', 'removed', 'promoted' and 'demoted'
+    """
+    (add, remove, make_admin, make_player) = [set(usernames) for usernames in (add, remove, make_admin, make_player)]
+    ids = dict(Player.objects.filter(user__username__in=add | remove | make_admin | make_player)
+               .exclude(pk=editor.pk).values_list('user__username', 'id'))
+    (add, remove, make_admin, make_player) = [{ids[name] for name in usernames if name in ids}
+                                              for usernames in (add, remove, make_admin, make_player)]
+
+    with transaction.atomic():
+        members = set(group.players.values_list('id', flat=True))
+        admins = set(group.admins.values_list('id', flat=True))
+        changes = {'added': add - members, 'removed': (remove - add) & members}
+        members = (members - changes['removed']) | changes['added']
+        changes['promoted'] = ((make_admin - make_player - remove) & members) - admins
+        changes['demoted'] = admins & (make_player | remove)
+
+        if changes['removed']:
+            group.players.remove(*changes['removed'])
+        if changes['added']:
+            group.players.add(*changes['added'])
+        if changes['demoted']:
+            group.admins.remove(*changes['demoted'])
+        if changes['promoted']:
+            group.admins.add(*changes['promoted'])
+    return changes
@@ -1,9 +1,74 @@
-from gameboard.models import Player, GamePlayed, PlayerGroup, Game
+from django.db.models import Count, IntegerField, CharField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from gameboard.helpers.activity import find_recent_activity
+from gameboard.helpers.head_to_head import HeadToHead
+from gameboard.helpers.ratings import find_rankings
+from gameboard.helpers.streaks import find_longest_streak
+from gameboard.models import Player, GameParticipation, GamePlayed, PlayerGroup, Game, PlayerGameStats
 from operator import itemgetter, attrgetter
-from collections import Counter
 from datetime import datetime
 
 
+class PlayerStats:
+    """
+    The headline statistics for a single player (across all groups), as shown on the profile page.
+    """
+
+    def __init__(self, player=None, num_played=0, num_wins=0, num_games=0, fav_game='', last_played=None):
+        self.player = player
+        self.num_played = num_played
+        self.num_wins = num_wins
+        self.num_games = num_games
+        self.fav_game = fav_game
+        self.last_played = last_played
+
+    @property
+    def num_losses(self):
+        return self.num_played - self.num_wins
+
+    @property
+    def win_percentage(self):
+        if self.num_played > 0:
+            return (self.num_wins / self.num_played) * 100
+        return 0
+
+
+def _played_game_stats(player):
+    """
+    Get the PlayerGameStats rows for the games a player has actually played.
+
+    :param player: A Player object (or an OuterRef to one)
+    :return: A queryset of PlayerGameStats
+    """
+    return PlayerGameStats.objects.filter(player=player, plays__gt=0)
+
+
+def find_player_stats(player):
+    """
+    Calculate the games played, wins, losses, win percentage, distinct games and favorite game of a player. Everything
+    is read by the database in a single query, with the totals coming from the counters stored on the player.
+
+    :param player: A Player object, which contains the user info
+    :return: A PlayerStats object (all zeros if there is no player).
+    """
+    if not player:
+        return PlayerStats()
+
+    game_stats = _played_game_stats(OuterRef('pk'))
+    num_games = game_stats.order_by().values('player').annotate(c=Count('id')).values('c')
+    favorite = game_stats.order_by('-plays', 'game__name').values('game__name')
+
+    row = Player.objects.filter(pk=player.pk).annotate(
+        num_games=Coalesce(Subquery(num_games[:1], output_field=IntegerField()), Value(0)),
+        fav_game=Coalesce(Subquery(favorite[:1], output_field=CharField()), Value('')),
+    ).values('num_played', 'num_wins', 'num_games', 'fav_game', 'last_played').first()
+
+    if row is None:
+        return PlayerStats(player)
+    return PlayerStats(player, **row)
+
+
 def num_games_played(player):
     """
     Get the number of games a single player has played, across all groups.
@@ -11,11 +76,7 @@ def num_games_played(player):
     :param player: A Player object, which contains the user info
     :return: The number of games played.
     """
-    num_played = 0
-    if player:
-        games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.first_name)
-        num_played = len(games_played)
-    return num_played
+    return find_player_stats(player).num_played
 
 
 def find_wins(player):
@@ -25,12 +86,7 @@ def find_wins(player):
     :param player: A Player object, which contains the user info
     :return: The number of wins for a player.
     """
-    num_wins = 0
-    if player:
-        games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.first_name)
-        wins = GamePlayed.objects.all().filter(winners__user__username__exact=player.user.first_name)
-        num_wins = len(wins)
-    return num_wins
+    return find_player_stats(player).num_wins
 
 
 def find_losses(player):
@@ -40,12 +96,7 @@ def find_losses(player):
     :param player: A Player object, which contains the user info
     :return: The number of losses for a player.
     """
-    num_losses = 0
-    if player:
-        games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.first_name)
-        wins = GamePlayed.objects.all().filter(winners__user__username__exact=player.user.first_name)
-        num_losses = len(games_played) - len(wins)
-    return num_losses
+    return find_player_stats(player).num_losses
 
 
 def find_win_percentage(player):
@@ -55,14 +106,7 @@ def find_win_percentage(player):
     :param player: A Player object, which contains the user info
     :return: The player's win percentage across all games played (and all groups)
     """
-
-    percentage = 0
-    if player:
-        games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.first_name)
-        wins = GamePlayed.objects.all().filter(winners__user__username__exact=player.user.first_name)
-        if len(games_played) > 0:
-            percentage = (len(wins)/len(games_played)) * 100
-    return percentage
+    return find_player_stats(player).win_percentage
 
 
 def find_win_percentage_for_game(player, game_name):
@@ -75,14 +119,9 @@ def find_win_percentage_for_game(player, game_name):
     """
     percentage = 0
     if player:
-        #print("Found user " + player.user.first_name)
-        games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.first_name)
-        #print("Games played: " + str(len(games_played)))
-        wins = GamePlayed.objects.all().filter(winners__user__username__exact=player.user.first_name, game__name__exact=game_name)
-        #print("Wins: " + str(len(wins)))
-        if len(games_played) > 0:
-            percentage = (len(wins)/len(games_played)) * 100
-            #print("Percentage won: " + str(percentage))
+        game_stats = _played_game_stats(player).filter(game__name__exact=game_name).first()
+        if game_stats:
+            percentage = (game_stats.wins/game_stats.plays) * 100
     return percentage
 
 
@@ -95,9 +134,7 @@ def find_games_played(player):
     """
     played = set()
     if player:
-        games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.username)
-        for g in games_played:
-            played.add(g.game.name)
+        played = set(_played_game_stats(player).values_list('game__name', flat=True))
     return played
 
 
@@ -108,21 +145,7 @@ def find_favorite_game(player):
     :param player: A Player object, which contains the user info
     :return: The player's favorite game (as an object).
     """
-    fav_game = ''
-    if player:
-        games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.username)
-        game_dict = dict()
-        for g in games_played:
-            if g.game.name not in game_dict:
-                game_dict[g.game.name] = 0
-            game_dict[g.game.name] += 1
-
-        max_count = 0 
-        for name in game_dict:
-            if game_dict[name] > max_count:
-                max_count = game_dict[name]
-                fav_game = name
-    return fav_game
+    return find_player_stats(player).fav_game
 # TODO something similar to find_favorite_game for find_best_game, where wins are factored at a higher weight
 
 
@@ -139,24 +162,22 @@ def find_players_in_game(game_id):
 
 def find_best_player_in_group(group):
     """
-    Find the best player in a given group.
+    Find the best player in a given group, which is the current member with the highest rating in the group.
 
     :param group: The group object to look through for the best player
-    :return:
+    :return: A tuple of the best player (None if nobody has played) and their win percentage in the group
     """
-    players = group.players.all()
-    max_win_rate = 0
-    best_player = None
+    rankings = find_rankings('group', group.id, players=group.players.all(), limit=1)
+    if not rankings:
+        return None, 0
+
+    best_player = rankings[0].player
+    totals = GameParticipation.objects.filter(gameplayed__group=group, player=best_player) \
+        .aggregate(played=Count('id'), wins=Count('id', filter=Q(is_winner=True)))
+    (played, wins) = (totals['played'], totals['wins'])
     percentage = 0
-    for player in players:
-        if player:
-            games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.username)
-            wins = GamePlayed.objects.all().filter(winners__user__username__exact=player.user.username)
-            if len(games_played) > 0:
-                percentage = (len(wins)/len(games_played)) * 100
-                if percentage > max_win_rate:
-                    max_win_rate = percentage
-                    best_player = player
+    if played > 0:
+        percentage = (wins/played) * 100
     return best_player, percentage
 
 
@@ -178,52 +199,20 @@ def find_longest_win_streak_in_group(group):
     :param group: A Group object, which contains the group info
     :return: the longest streak player and the longest streaks
     """
-    group_id = group.id
-    games_played = GamePlayed.objects.all().filter(group__id=group_id)
-    games_played = list(games_played)
-    games_played = sorted(games_played, key=attrgetter('date'))
-
-    longest_streak = 0
-    longest_streak_player = None
-    curr_streak = 0
-    curr_player = None
-
-    for i in range(len(games_played)-1):
-        if games_played[i].winners == games_played[i+1].winners:
-            curr_player = games_played[i].winners
-            curr_streak += 1
-        else:
-            longest_streak_player = curr_player
-            longest_streak = curr_streak
-
-    return longest_streak_player, longest_streak
+    return find_longest_streak('group', group.id)
 
 
 def find_longest_win_streak_in_game(game_name):
     """
-    Find the longest win streak and player in a given group
+    Find the longest win streak and player in a given game
 
     :param game_name: The name of the game to find TODO this should be a game object
     :return: the longest streak player and the longest streaks
     """
-    games_played = GamePlayed.objects.all().filter(game__name__exact=game_name)
-    games_played = list(games_played)
-    games_played = sorted(games_played, key=attrgetter('date'))
-
-    longest_streak = 0
-    longest_streak_player = None
-    curr_streak = 0
-    curr_player = None
-
-    for i in range(len(games_played)-1):
-        if games_played[i].winners == games_played[i+1].winners:
-            curr_player = games_played[i].winners
-            curr_streak += 1
-        else:
-            longest_streak_player = curr_player
-            longest_streak = curr_streak
-
-    return (longest_streak_player, longest_streak)
+    game = Game.objects.filter(name__exact=game_name).first()
+    if game is None:
+        return (None, 0)
+    return find_longest_streak('game', game.id)
 
 
 def find_players_in_group(group):
@@ -233,12 +222,7 @@ def find_players_in_group(group):
     :param group: A Group object, which contains the group info
     :return: All players who have played a game in a group
     """
-    group_id = group.id
-    players_ids = PlayerGroup.objects.filter(id=group_id).values('players')
-    players = []
-    for item in players_ids:
-        players.append(Player.objects.filter(id=item["players"]).first())
-    return players
+    return list(group.players.select_related('user'))
 
 
 def find_admins_in_group(group):
@@ -248,12 +232,7 @@ def find_admins_in_group(group):
     :param group: A Group object, which contains the group info
     :return: The admins in a given group
     """
-    group_id = group.id
-    admins_ids = PlayerGroup.objects.filter(id=group_id).values('admins')
-    admins = []
-    for item in admins_ids:
-        admins.append(Player.objects.filter(id=item["admins"]).first())
-    return admins
+    return list(group.admins.select_related('user'))
 
 
 def find_games():
@@ -274,9 +253,7 @@ def find_groups(player):
     :param player: A Player object, which contains the user info
     :return: A queryset of group objects the player belongs to
     """
-    group = PlayerGroup.objects.filter(players__user__username=player.user.username)
-
-    return group
+    return PlayerGroup.objects.filter(players=player.pk).order_by('id')
 
 
 def find_first_group(player):
@@ -302,7 +279,7 @@ def find_games_by_group(group):
     """
     games = set()
     if group:
-        games = GamePlayed.objects.filter(group__id=group.id).order_by('-date')
+        games = GamePlayed.objects.filter(group=group.pk).order_by('-date')
     return games
 
 
@@ -317,20 +294,10 @@ def find_rival_in_group(group, player):
     of that player
     """
 
-    group_players = group.players.all()
-    games_played = GamePlayed.objects.all().filter(group__name__exact=group.name)
-
-    max_win = 0
+    (rival_id, max_win) = HeadToHead.for_group(group).nemesis(player.id)
     max_player = None
-    for p in group_players:
-        if player.user.username != p.user.username:
-            p_games_won = 0
-            for g in games_played:
-                if p in g.winners.all():
-                    p_games_won += 1
-            if p_games_won > max_win:
-                max_win = p_games_won
-                max_player = player.user.username
+    if rival_id is not None:
+        max_player = Player.objects.filter(id=rival_id).values_list('user__username', flat=True).first()
     return (max_win, max_player)
 
 
@@ -342,16 +309,12 @@ def find_most_active_player_in_group(group):
     :return: a tuple of the most active player and the number of games they played
     """
 
-    games_played = GamePlayed.objects.all().filter(group__name__exact=group.name)
-
-    played = []
-    for game in games_played:
-        players = list(game.players.all())
-        played += players
+    most_active = GameParticipation.objects.filter(gameplayed__group=group.pk).order_by() \
+        .values('player').annotate(played=Count('id')).order_by('-played', 'player').first()
+    if most_active is None:
+        return (None, 0)
 
-    (most_active, num_most_active) = Counter(played).most_common(1)[0]
-
-    return (most_active, num_most_active)
+    return (Player.objects.select_related('user').get(pk=most_active['player']), most_active['played'])
 
 
 def find_favorite_game_in_group(group):
@@ -362,15 +325,12 @@ def find_favorite_game_in_group(group):
     :return: a tuple of favorite game and number of times the game is played
     """
 
-    games_played = GamePlayed.objects.all().filter(group__name__exact=group.name)
-
-    played = []
-    for g in games_played:
-        played.append(g.game.name)
-
-    (favorite_game, favorite_played) = Counter(played).most_common(1)[0]
+    favorite = GamePlayed.objects.filter(group=group.pk).order_by().values('game__name') \
+        .annotate(played=Count('id')).order_by('-played', 'game__name').first()
+    if favorite is None:
+        return (None, 0)
 
-    return (favorite_game, favorite_played)
+    return (favorite['game__name'], favorite['played'])
 
 
 def find_num_player_in_group(group):
@@ -395,23 +355,9 @@ def games_played_by_group_by_day(group):
     date in ascending order limit 10
     """
 
-    games_played = GamePlayed.objects.all().filter(group__name__exact=group.name)
-
-    dateDict = dict()
-    for game in games_played:
-        date = str(game.date)
-        if date not in dateDict:
-            dateDict[date] = 0
-        dateDict[date] += 1
-
-    dateList = list()
-    for date in dateDict:
-        dateList.append([date, dateDict[date]])
-    dateList = sorted(dateList, key=lambda x: (x[0]))
+    dateList = find_recent_activity('group', group.id, 10)
     if len(dateList) < 10:
         return False
-    else:
-        dateList = dateList[-10:]
 
     result = str()
     for i in range(10):
@@ -423,79 +369,8 @@ def games_played_by_group_by_day(group):
     return result
 
 
-def top_5_winners_by_group(group):
-    """
-    get the top 5 winners in a group
-
-    :param group: A group object
-    :return: csv of username, username..., wins, wins... sorted by wins in 
-    descending order limit 5
-    """
-
-    games_played = GamePlayed.objects.all().filter(group__name__exact=group.name)
-
-    winDict = dict()
-    for game in games_played:
-        for winner in game.winners.all():
-            if winner.user.username not in winDict:
-                winDict[winner.user.username] = 0
-            winDict[winner.user.username] += 1
-
-    winList = list()
-    for winner in winDict:
-        winList.append([winner, winDict[winner]])
-    winList = sorted(winList, key=lambda x: (x[1]))
-    if len(winList) < 5:
-        return False
-    else:
-        winList = winList[-5:]
-    winList = sorted(winList, key=lambda x: (-x[1]))
-
-    result = str()
-    for i in range(5):
-        result += (str(winList[i][0]) + ", ")
-    for j in range(4):
-        result += (str(winList[j][1]) + ", ")
-    result += str(winList[4][1])
-
-    return result
-
-
-def top_5_games_by_group(group):
-    """
-    find the top 5 games played by a group
-
-    :param group: A group object
-    :return: a csv of game name, game name..., times played, times played...
-    sorted by times played in descending order limit 5
-    """
-
-    games_played = GamePlayed.objects.all().filter(group__name__exact=group.name)
 
-    gameDict = dict()
-    for game in games_played:
-        if game.game.name not in gameDict:
-            gameDict[game.game.name] = 0
-        gameDict[game.game.name] += 1
 
-    gameList = list()
-    for game in gameDict:
-        gameList.append([game, gameDict[game]])
-    gameList = sorted(gameList, key=lambda x: (x[1]))
-
-    if len(gameList) < 5:
-        return False
-    else:
-        gameList = gameList[-5:]
-
-    result = str()
-    for i in range(5):
-        result += (str(gameList[i][0]) + ", ")
-    for j in range(4):
-        result += (str(gameList[j][1]) + ", ")
-    result += str(gameList[4][1])
-
-    return result
 
 
 def games_played_by_player_by_day(player):
@@ -507,23 +382,9 @@ def games_played_by_player_by_day(player):
     date in ascending order limit 5
     """
 
-    games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.username)
-
-    dateDict = dict()
-    for game in games_played:
-        date = str(game.date)
-        if date not in dateDict:
-            dateDict[date] = 0
-        dateDict[date] += 1
-
-    dateList = list()
-    for date in dateDict:
-        dateList.append([date, dateDict[date]])
-    dateList = sorted(dateList, key=lambda x: (x[0]))
+    dateList = find_recent_activity('player', player.id, 5)
     if len(dateList) < 5:
         return False
-    else:
-        dateList = dateList[-5:]
 
     result = str()
     for i in range(5):
@@ -533,81 +394,3 @@ def games_played_by_player_by_day(player):
     result += str(dateList[4][1])
 
     return result
-
-
-def wins_by_player_by_game(player):
-    """
-    find the top 5 games that the player wins
-
-    :param player: A Player object
-    :return: csv of game name, game name..., wins, wins... sorted by wins in
-    descending order limit 5
-    """
-
-    games_played = GamePlayed.objects.all().filter(winners__user__username__exact=player.user.username)
-
-    winDict = dict()
-    for game in games_played:
-        if game.game.name not in winDict:
-            winDict[game.game.name] = 0
-        winDict[game.game.name] += 1
-
-    winList = list()
-    for game in winDict:
-        winList.append([game, winDict[game]])
-    winList = sorted(winList, key=lambda x: (x[1]))
-
-    if len(winList) < 5:
-        return False
-    else:
-        winList = winList[-5:]
-    winList = sorted(winList, key=lambda x: (-x[1]))
-
-    result = str()
-    for i in range(5):
-        result += (str(winList[i][0]) + ", ")
-    for j in range(4):
-        result += (str(winList[j][1]) + ", ")
-    result += str(winList[4][1])
-
-    return result
-
-
-def top_5_games_by_player(player):
-    """
-    find the top 5 game that the player plays
-
-    :param player: A Player object
-    :return: csv of game name, game name..., times played, times played... 
-    sorted by times played in ascending order limit 5
-    """
-
-    games_played = GamePlayed.objects.all().filter(players__user__username__exact=player.user.username)
-
-    gameDict = dict()
-    for game in games_played:
-        if game.game.name not in gameDict:
-            gameDict[game.game.name] = 0
-        gameDict[game.game.name] += 1
-
-    gameList = list()
-    for game in gameDict:
-        gameList.append([game, gameDict[game]])
-    gameList = sorted(gameList, key=lambda x: (x[1]))
-
-    if len(gameList) < 5:
-        return False
-    else:
-        gameList = gameList[-5:]
-
-    result = str()
-    for i in range(5):
-        result += (str(gameList[i][0]) + ", ")
-    for j in range(4):
-        result += (str(gameList[j][1]) + ", ")
-    result += str(gameList[4][1])
-
-    return result
-
-
-
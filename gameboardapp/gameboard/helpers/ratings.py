@@ -0,0 +1,233 @@
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+
+from gameboard.models import Game, GameParticipation, GamePlayed, GameRating, GroupRating, PlayerGroup
+
+# Elo parameters: every player starts at the initial rating, and can gain or lose at most K points in a game
+INITIAL_RATING = 1500
+K_FACTOR = 32
+
+# Each rating scope, as (rating model, owner model, the GamePlayed field which scopes it)
+SCOPES = [(GroupRating, PlayerGroup, 'group'), (GameRating, Game, 'game')]
+
+
+def active_scopes():
+    """
+    :return: The rating scopes which are switched on (per game ratings can be turned off in the settings)
+    """
+    if getattr(settings, 'GAMEBOARD_GAME_RATINGS', True):
+        return SCOPES
+    return SCOPES[:1]
+
+
+def elo_deltas(ratings, won, k=K_FACTOR):
+    """
+    Calculates the rating changes from one game. Every participant is scored against every other participant: a win
+    over a loser counts 1, a loss to a winner 0, and two winners (or two losers) draw.
+
+    :param ratings: A numpy array of the participants' ratings before the game
+    :param won: A numpy boolean array, True for the participants who won
+    :param k: The K factor, the most a player can gain or lose in one game
+    :return: A numpy array of the change in each participant's rating
+    """
+    n = len(ratings)
+    if n < 2:
+        return np.zeros(n)
+    expected = 1 / (1 + 10 ** ((ratings[np.newaxis, :] - ratings[:, np.newaxis]) / 400))
+    won = won.astype(float)
+    score = 0.5 + 0.5 * (won[:, np.newaxis] - won[np.newaxis, :])
+    return (k / (n - 1)) * (score - expected).sum(axis=1)
+
+
+def replay_ratings(field, scope_id):
+    """
+    Recomputes every rating in a scope by replaying its whole history in date order. Used for backfills, and when a
+    scope has been marked stale.
+
+    :param field: The scope, either 'group' or 'game'
+    :param scope_id: The id of the group or game
+    :return: None
+    """
+    (model, owner) = _scope(field)
+    results = list(GameParticipation.objects.filter(**{'gameplayed__' + field: scope_id})
+                   .order_by('gameplayed__date', 'gameplayed_id')
+                   .values_list('gameplayed_id', 'gameplayed__date', 'player_id', 'is_winner'))
+    rows = [(game_played_id, date, player_id) for (game_played_id, date, player_id, _) in results]
+    won = {(game_played_id, player_id) for (game_played_id, _, player_id, is_winner) in results if is_winner}
+
+    # Work on arrays indexed by position rather than by player id
+    player_ids = sorted({player_id for (_, _, player_id) in rows})
+    position = {player_id: i for (i, player_id) in enumerate(player_ids)}
+    ratings = np.full(len(player_ids), float(INITIAL_RATING))
+    previous = ratings.copy()
+    games = np.zeros(len(player_ids), dtype=int)
+    last = dict()
+
+    # Group the rows into games, as arrays of participant positions and whether they won
+    by_game = defaultdict(list)
+    order = []
+    for (game_played_id, date, player_id) in rows:
+        if game_played_id not in by_game:
+            order.append((game_played_id, date))
+        by_game[game_played_id].append(player_id)
+
+    for (game_played_id, date) in order:
+        participants = by_game[game_played_id]
+        index = np.array([position[p] for p in participants])
+        winners = np.array([(game_played_id, p) in won for p in participants])
+        previous[index] = ratings[index]
+        ratings[index] += elo_deltas(ratings[index], winners)
+        games[index] += 1
+        for player_id in participants:
+            last[player_id] = (game_played_id, date)
+
+    model.objects.filter(**{field: scope_id}).delete()
+    model.objects.bulk_create([
+        model(player_id=player_id, rating=float(ratings[i]), previous_rating=float(previous[i]), games=int(games[i]),
+              last_game_played_id=last[player_id][0], last_date=last[player_id][1], **{field + '_id': scope_id})
+        for (i, player_id) in enumerate(player_ids)
+    ])
+    owner.objects.filter(pk=scope_id).update(ratings_stale=False)
+
+
+def refresh_ratings(field, scope_id):
+    """
+    Replays a scope's ratings, but only if it has been marked stale.
+
+    :param field: The scope, either 'group' or 'game'
+    :param scope_id: The id of the group or game
+    :return: None
+    """
+    (_, owner) = _scope(field)
+    if owner.objects.filter(pk=scope_id, ratings_stale=True).exists():
+        replay_ratings(field, scope_id)
+
+
+def mark_stale(field, scope_id):
+    """
+    Marks a scope's ratings as needing a replay, which happens the next time they are read.
+
+    :param field: The scope, either 'group' or 'game'
+    :param scope_id: The id of the group or game
+    :return: None
+    """
+    (_, owner) = _scope(field)
+    owner.objects.filter(pk=scope_id).update(ratings_stale=True)
+
+
+def rate_game_played(game_played_id):
+    """
+    Updates the ratings of a game's participants, in each of its scopes. Only the participants' rows are touched. If
+    the game has been rated before, it is re-rated from the ratings its participants had before it, so changing the
+    players or winners of a game is safe. A game which is older than a participant's last rated game marks the scope
+    stale instead.
+
+    :param game_played_id: The id of the GamePlayed
+    :return: None
+    """
+    results = list(GameParticipation.objects.filter(gameplayed=game_played_id).values_list('player_id', 'is_winner'))
+    participants = [player_id for (player_id, _) in results]
+    winners = {player_id for (player_id, is_winner) in results if is_winner}
+    for (_, _, field) in active_scopes():
+        _rate_in_scope(field, game_played_id, participants, winners)
+
+
+def results_changed(game_played_ids):
+    """
+    Re-rates some games after their players or winners were added to (or winners removed), oldest first.
+
+    :param game_played_ids: The ids of the GamePlayed objects which changed
+    :return: None
+    """
+    ordered = GamePlayed.objects.filter(pk__in=list(game_played_ids)).order_by('date', 'id')
+    for game_played_id in ordered.values_list('id', flat=True):
+        rate_game_played(game_played_id)
+
+
+def players_removed(game_played_ids):
+    """
+    Marks the scopes of some games stale after players were taken out of them, since the removed players' ratings
+    need the game undone.
+
+    :param game_played_ids: The ids of the GamePlayed objects which changed
+    :return: None
+    """
+    for (group_id, game_id) in GamePlayed.objects.filter(pk__in=list(game_played_ids)) \
+            .values_list('group_id', 'game_id'):
+        mark_stale('group', group_id)
+        mark_stale('game', game_id)
+
+
+def _rate_in_scope(field, game_played_id, participants, winners):
+    """
+    Rates one game within one of its scopes.
+
+    :param field: The scope, either 'group' or 'game'
+    :param game_played_id: The id of the GamePlayed
+    :param participants: The ids of the players in the game
+    :param winners: The ids of the winners of the game
+    :return: None
+    """
+    (model, _) = _scope(field)
+    row = GamePlayed.objects.filter(pk=game_played_id).values_list('date', field, field + '__ratings_stale').first()
+    if row is None or row[2] or not participants:
+        return
+    (date, scope_id, _) = row
+
+    model.objects.bulk_create([model(player_id=p, **{field + '_id': scope_id}) for p in participants],
+                              ignore_conflicts=True)
+    ratings = list(model.objects.filter(player_id__in=participants, **{field: scope_id}))
+
+    before = []
+    for rating in ratings:
+        if rating.last_game_played_id == game_played_id:
+            before.append(rating.previous_rating)
+        elif rating.last_date is None or (rating.last_date, rating.last_game_played_id or 0) < (date, game_played_id):
+            before.append(rating.rating)
+            rating.games += 1
+        else:
+            # The player already has a later game, so this one has to be replayed in order
+            mark_stale(field, scope_id)
+            return
+
+    before = np.array(before, dtype=float)
+    deltas = elo_deltas(before, np.array([r.player_id in winners for r in ratings]))
+    for (rating, base, delta) in zip(ratings, before, deltas):
+        rating.previous_rating = float(base)
+        rating.rating = float(base + delta)
+        rating.last_game_played_id = game_played_id
+        rating.last_date = date
+    model.objects.bulk_update(ratings, ['rating', 'previous_rating', 'games', 'last_game_played', 'last_date'])
+
+
+def _scope(field):
+    """
+    :param field: The scope, either 'group' or 'game'
+    :return: A tuple of the rating model and the owner model for the scope
+    """
+    for (model, owner, scope_field) in SCOPES:
+        if scope_field == field:
+            return (model, owner)
+    raise ValueError("Unknown rating scope %s" % field)
+
+
+def find_rankings(field, scope_id, players=None, limit=None):
+    """
+    Get the ratings in a scope, best first. The scope is replayed first if it is stale.
+
+    :param field: The scope, either 'group' or 'game'
+    :param scope_id: The id of the group or game
+    :param players: Optionally, a queryset of the players to include (e.g. the current members of a group)
+    :param limit: Optionally, how many ratings to return
+    :return: A list of rating objects (with their player and user loaded)
+    """
+    (model, _) = _scope(field)
+    refresh_ratings(field, scope_id)
+    ratings = model.objects.filter(**{field: scope_id}).order_by('-rating', 'player_id').select_related('player__user')
+    if players is not None:
+        ratings = ratings.filter(player__in=players)
+    if limit is not None:
+        ratings = ratings[:limit]
+    return list(ratings)
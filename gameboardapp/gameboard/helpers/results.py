@@ -0,0 +1,191 @@
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils.dateparse import parse_date
+
+from gameboard.helpers import activity, counters, dashboard_cache, head_to_head
+from gameboard.models import Game, GameParticipation, GamePlayed, Player, PlayerGroup
+
+# The most results which can be recorded at once
+MAX_RESULTS = 500
+
+
+def insert_rows(model, columns, rows):
+    """
+    Inserts plain rows with a single executemany, skipping the model instances bulk_create would build.
+
+    :param model: The model to insert into
+    :param columns: The names of the columns being set
+    :param rows: Tuples of values for those columns, as the database takes them
+    :return: None
+    """
+    quote = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (quote(model._meta.db_table), ", ".join(quote(c) for c in columns),
+                                              ", ".join(["%s"] * len(columns)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def insert_with_ids(model, columns, rows, batch_size=None):
+    """
+    Bulk inserts rows which other rows will refer to, so their ids are needed. Databases which return the new ids from
+    a bulk insert (PostgreSQL) go through bulk_create. On the others (SQLite) the rows are inserted directly and the new
+    rows are then the ones with the highest ids, since ids only go up and the transaction holds the write lock from its
+    first insert until it commits. Must be run inside a transaction.
+
+    :param model: The model to insert into
+    :param columns: The names of the columns being set
+    :param rows: Tuples of values for those columns, as the database takes them
+    :param batch_size: Optionally, the most rows bulk_create inserts per statement
+    :return: The ids of the new rows, in order
+    """
+    if not rows:
+        return []
+    if connection.features.can_return_ids_from_bulk_insert:
+        objects = model.objects.bulk_create([model(**dict(zip(columns, row))) for row in rows], batch_size=batch_size)
+        return [obj.pk for obj in objects]
+    insert_rows(model, columns, rows)
+    return list(reversed(model.objects.order_by('-id').values_list('id', flat=True)[:len(rows)]))
+
+
+def _clean_result(index, result, games, players, errors):
+    """
+    Checks one result of a batch against the games and group members which were looked up for the whole batch.
+
+    :return: A tuple of (game id, date, player ids, winner ids), or None if the result is not valid (the reasons are
+    added to errors)
+    """
+    problems = []
+    if not isinstance(result, dict):
+        errors[str(index)] = ["Each result must be an object"]
+        return None
+
+    game = result.get('game')
+    if not isinstance(game, str) or game not in games:
+        problems.append("Unknown game %s" % game)
+    date = result.get('date')
+    try:
+        if isinstance(date, str):
+            date = parse_date(date)
+        elif not isinstance(date, datetime.date):
+            date = None
+    except ValueError:
+        date = None
+    if date is None:
+        problems.append("The date must be given as YYYY-MM-DD")
+
+    (names, winner_names) = (result.get('players'), result.get('winners', []))
+    if not isinstance(names, list) or not names or not isinstance(winner_names, list):
+        problems.append("The players and winners must be lists of usernames, with at least one player")
+        names = winner_names = []
+    elif not all(isinstance(name, str) for name in names + winner_names):
+        problems.append("The players and winners must be usernames")
+        names = winner_names = []
+    for name in dict.fromkeys(names + winner_names):
+        if name not in players:
+            problems.append("Unknown player %s" % name)
+        elif not players[name][1]:
+            problems.append("%s is not in the group" % name)
+    if not set(winner_names) <= set(names):
+        problems.append("Every winner must be one of the players")
+
+    if problems:
+        errors[str(index)] = problems
+        return None
+    return (games[game], date, [players[name][0] for name in dict.fromkeys(names)],
+            {players[name][0] for name in winner_names})
+
+
+def count_games_played(group_id, games_played):
+    """
+    Updates the player counters and the activity rollups for bulk inserted games, as the signals would have done.
+
+    :param group_id: The id of the group which played the games
+    :param games_played: (game played id, game id, date, player ids, winner ids) tuples
+    :return: None
+    """
+    (games, dates, played, won) = (dict(), dict(), [], [])
+    for (game_played_id, game_id, date, player_ids, winner_ids) in games_played:
+        games[game_played_id] = game_id
+        dates[game_played_id] = date
+        played.extend((game_played_id, player_id) for player_id in player_ids)
+        won.extend((game_played_id, player_id) for player_id in winner_ids)
+
+    counters.add_participations(played, False, games)
+    counters.add_participations(won, True, games)
+    activity.games_played_added(group_id, dates.values())
+    activity.players_changed(played, 1, dates)
+
+
+def results_added(group_id, game_ids, player_ids):
+    """
+    Marks the statistics which depend on a group's history as out of date after games were bulk inserted: the streaks
+    and ratings of the group and games are rebuilt when they are next read, and the cached statistics are dropped.
+
+    :param group_id: The id of the group
+    :param game_ids: The ids of the games which were played
+    :param player_ids: The ids of the players who played
+    :return: None
+    """
+    PlayerGroup.objects.filter(pk=group_id).update(streaks_stale=True, ratings_stale=True)
+    Game.objects.filter(pk__in=set(game_ids)).update(streaks_stale=True, ratings_stale=True)
+    head_to_head.forget_groups([group_id])
+    dashboard_cache.bump_versions('group', [group_id])
+    dashboard_cache.bump_versions('player', player_ids)
+
+
+def record_results(group, results):
+    """
+    Records many games played at once, e.g. a whole game night. Every game name and username in the batch is looked up
+    with one query each, and the players are checked against the group's members in the same query. Nothing is
+    written unless every result is valid, and then the games and their participations are each written with one bulk
+    insert, in one transaction.
+
+    :param group: The PlayerGroup which played the games
+    :param results: A list of dicts, each with a 'game' name, a 'date' (a date, or a string as YYYY-MM-DD), a list of
+    'players' usernames and a list of 'winners' usernames
+    :return: A list of the new GamePlayed objects, in the order of the results
+    :raises ValidationError: If any result is not valid, with the reasons by the result's index
+    """
+    if not isinstance(results, list) or not results:
+        raise ValidationError({'results': ["Expected a list of results"]})
+    if len(results) > MAX_RESULTS:
+        raise ValidationError({'results': ["At most %d results can be recorded at once" % MAX_RESULTS]})
+
+    (game_names, usernames) = (set(), set())
+    for result in results:
+        if isinstance(result, dict):
+            if isinstance(result.get('game'), str):
+                game_names.add(result['game'])
+            for key in ['players', 'winners']:
+                if isinstance(result.get(key), list):
+                    usernames.update(name for name in result[key] if isinstance(name, str))
+    games = dict(Game.objects.filter(name__in=game_names).values_list('name', 'id'))
+    members = PlayerGroup.players.through.objects.filter(playergroup=group, player=OuterRef('pk'))
+    players = {username: (player_id, is_member) for (username, player_id, is_member) in
+               Player.objects.filter(user__username__in=usernames).annotate(is_member=Exists(members))
+               .values_list('user__username', 'id', 'is_member')}
+
+    errors = dict()
+    cleaned = [_clean_result(index, result, games, players, errors) for (index, result) in enumerate(results)]
+    if errors:
+        raise ValidationError(errors)
+
+    with transaction.atomic():
+        ids = insert_with_ids(GamePlayed, ['game_id', 'date', 'group_id'],
+                              [(game_id, connection.ops.adapt_datefield_value(date), group.pk)
+                               for (game_id, date, _, _) in cleaned])
+        games_played = [GamePlayed(pk=pk, game_id=game_id, date=date, group=group)
+                        for (pk, (game_id, date, _, _)) in zip(ids, cleaned)]
+        GameParticipation.objects.bulk_create([
+            GameParticipation(gameplayed_id=game_played.pk, player_id=player_id, is_winner=player_id in winner_ids)
+            for (game_played, (_, _, player_ids, winner_ids)) in zip(games_played, cleaned) for player_id in player_ids
+        ])
+        count_games_played(group.pk, [(game_played.pk, game_id, date, player_ids, winner_ids)
+                                      for (game_played, (game_id, date, player_ids, winner_ids))
+                                      in zip(games_played, cleaned)])
+        results_added(group.pk, [game_id for (game_id, _, _, _) in cleaned],
+                      {player_id for (_, _, player_ids, _) in cleaned for player_id in player_ids})
+    return games_played
@@ -0,0 +1,190 @@
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import F, FilteredRelation, Q
+from django.db.models.functions import Greatest
+
+from gameboard.models import Game, GameParticipation, GamePlayed, GameWinStreak, GroupWinStreak, PlayerGroup
+
+# Each streak index, as (streak model, owner model, the GamePlayed field which scopes it)
+SCOPES = [(GroupWinStreak, PlayerGroup, 'group'), (GameWinStreak, Game, 'game')]
+
+
+def scan_streaks(results):
+    """
+    Walks the results of a scope once, in date order, tracking the current and longest win streak of every player.
+    A streak is the number of consecutive games (within the scope) that a player has won.
+
+    :param results: (game_played_id, winner_id) tuples, ordered by date then game played id. A game without any winners
+    has a single tuple with a winner_id of None.
+    :return: A dict of player id to (current, longest, previous_current, previous_longest), where the previous values
+    are the streaks before the last game.
+    """
+    games = [{w for (_, w) in rows if w is not None} for (_, rows) in groupby(results, key=itemgetter(0))]
+
+    current = dict()
+    longest = dict()
+    previous = (dict(), dict())
+    for (index, winners) in enumerate(games):
+        if index == len(games) - 1:
+            previous = (current, dict(longest))
+        current = {w: current.get(w, 0) + 1 for w in winners}
+        for (player_id, streak) in current.items():
+            if streak > longest.get(player_id, 0):
+                longest[player_id] = streak
+
+    return {player_id: (current.get(player_id, 0), streak, previous[0].get(player_id, 0),
+                        previous[1].get(player_id, 0))
+            for (player_id, streak) in longest.items()}
+
+
+def rebuild_streaks(field, scope_id):
+    """
+    Rescans every game in a scope, and replaces its streak index with the results.
+
+    :param field: The scope, either 'group' or 'game'
+    :param scope_id: The id of the group or game
+    :return: None
+    """
+    (model, owner) = _scope(field)
+    won = FilteredRelation('participations', condition=Q(participations__is_winner=True))
+    results = GamePlayed.objects.filter(**{field: scope_id}).annotate(won=won).order_by('date', 'id') \
+        .values_list('id', 'won__player')
+    streaks = scan_streaks(results.iterator())
+
+    model.objects.filter(**{field: scope_id}).delete()
+    model.objects.bulk_create([
+        model(player_id=player_id, current=current, longest=longest, previous_current=previous_current,
+              previous_longest=previous_longest, **{field + '_id': scope_id})
+        for (player_id, (current, longest, previous_current, previous_longest)) in streaks.items()
+    ])
+    owner.objects.filter(pk=scope_id).update(streaks_stale=False)
+
+
+def refresh_streaks(field, scope_id):
+    """
+    Rebuilds a scope's streak index, but only if it has been marked stale.
+
+    :param field: The scope, either 'group' or 'game'
+    :param scope_id: The id of the group or game
+    :return: None
+    """
+    (_, owner) = _scope(field)
+    if owner.objects.filter(pk=scope_id, streaks_stale=True).exists():
+        rebuild_streaks(field, scope_id)
+
+
+def mark_stale(field, scope_id):
+    """
+    Marks a scope's streak index as needing a rescan, which happens the next time it is read.
+
+    :param field: The scope, either 'group' or 'game'
+    :param scope_id: The id of the group or game
+    :return: None
+    """
+    (_, owner) = _scope(field)
+    owner.objects.filter(pk=scope_id).update(streaks_stale=True)
+
+
+def game_played_added(game_played_id):
+    """
+    Extends the streak indexes of a newly recorded game's group and game. If the game is the latest in its scope, every
+    streak in it is moved forward by one game. Otherwise (a game recorded out of order) the scope is marked stale.
+
+    :param game_played_id: The id of the new GamePlayed
+    :return: None
+    """
+    for (model, owner, field) in SCOPES:
+        scope_id = _latest_in_scope(field, game_played_id)
+        if scope_id is not None:
+            model.objects.filter(**{field: scope_id}).update(previous_current=F('current'),
+                                                             previous_longest=F('longest'))
+            _apply_latest(field, scope_id, game_played_id)
+
+
+def winners_changed(game_played_ids):
+    """
+    Updates the streak indexes after the winners of some games changed. The latest game in a scope is replayed on top
+    of the stored previous streaks, anything older marks the scope stale.
+
+    :param game_played_ids: The ids of the GamePlayed objects whose winners changed
+    :return: None
+    """
+    for game_played_id in game_played_ids:
+        for (_, _, field) in SCOPES:
+            scope_id = _latest_in_scope(field, game_played_id)
+            if scope_id is not None:
+                _apply_latest(field, scope_id, game_played_id)
+
+
+def _scope(field):
+    """
+    :param field: The scope, either 'group' or 'game'
+    :return: A tuple of the streak model and the owner model for the scope
+    """
+    for (model, owner, scope_field) in SCOPES:
+        if scope_field == field:
+            return (model, owner)
+    raise ValueError("Unknown streak scope %s" % field)
+
+
+def _latest_in_scope(field, game_played_id):
+    """
+    Checks whether a game is the latest one in its scope. If it is not, or the scope is already stale, the scope is
+    (left) marked stale so it will be rescanned when read.
+
+    :param field: The scope, either 'group' or 'game'
+    :param game_played_id: The id of a GamePlayed
+    :return: The id of the scope if the game is the latest one in it and the scope is up to date, otherwise None
+    """
+    (_, owner) = _scope(field)
+    row = GamePlayed.objects.filter(pk=game_played_id).values_list(field, 'date', field + '__streaks_stale').first()
+    if row is None:
+        return None
+    (scope_id, date, stale) = row
+    if stale:
+        return None
+
+    later = GamePlayed.objects.filter(Q(date__gt=date) | Q(date=date, id__gt=game_played_id), **{field: scope_id})
+    if later.exists():
+        mark_stale(field, scope_id)
+        return None
+    return scope_id
+
+
+def _apply_latest(field, scope_id, game_played_id):
+    """
+    Sets every streak in a scope from its previous values and the winners of the scope's latest game.
+
+    :param field: The scope, either 'group' or 'game'
+    :param scope_id: The id of the group or game
+    :param game_played_id: The id of the latest GamePlayed in the scope
+    :return: None
+    """
+    (model, _) = _scope(field)
+    winner_ids = list(GameParticipation.objects.filter(gameplayed=game_played_id, is_winner=True)
+                      .values_list('player_id', flat=True))
+    model.objects.bulk_create([model(player_id=w, **{field + '_id': scope_id}) for w in winner_ids],
+                              ignore_conflicts=True)
+
+    streaks = model.objects.filter(**{field: scope_id})
+    streaks.filter(player_id__in=winner_ids).update(current=F('previous_current') + 1,
+                                                     longest=Greatest('previous_longest', F('previous_current') + 1))
+    streaks.exclude(player_id__in=winner_ids).update(current=0, longest=F('previous_longest'))
+
+
+def find_longest_streak(field, scope_id):
+    """
+    Finds the longest win streak in a scope, rescanning it first if it is stale.
+
+    :param field: The scope, either 'group' or 'game'
+    :param scope_id: The id of the group or game
+    :return: A tuple of the player (None if nobody has won) and their longest streak
+    """
+    (model, _) = _scope(field)
+    refresh_streaks(field, scope_id)
+    streak = model.objects.filter(**{field: scope_id}, longest__gt=0).order_by('-longest', 'player_id') \
+        .select_related('player__user').first()
+    if streak is None:
+        return (None, 0)
+    return (streak.player, streak.longest)
@@ -0,0 +1,179 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger('gameboard.writes')
+
+# The pragmas each SQLite connection is opened with in write queue mode: write ahead logging lets readers carry on
+# while the writer commits, NORMAL sync is safe with it (and only syncs at checkpoints), and a busy timeout makes any
+# other writer (e.g. an import) wait for the lock rather than fail straight away
+SQLITE_PRAGMAS = ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL', 'PRAGMA busy_timeout=5000']
+
+# The process's queue, started by the first write
+_lock = threading.Lock()
+_queue = None
+
+
+class WriteQueue:
+    """
+    Coalesces writes from many requests into few transactions (a group commit). Writes are queued, and a single writer
+    thread runs them in batches, each batch in one transaction: it waits a few milliseconds after the first write for
+    more to arrive, up to a batch's worth. Each write has its own savepoint, so one which fails is rolled back without
+    affecting the rest of its batch. With one writer per process, requests never contend for SQLite's write lock, and
+    the cost of each commit is shared by the whole batch.
+    """
+
+    def __init__(self, delay=0.005, batch_size=100):
+        """
+        :param delay: How long (in seconds) to wait for more writes after the first one of a batch
+        :param batch_size: The most writes in one transaction
+        """
+        self.delay = delay
+        self.batch_size = batch_size
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='gameboard-writer', daemon=True)
+        self._thread.start()
+
+        # How many transactions and writes the writer has committed
+        self.flushes = 0
+        self.writes = 0
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queues a write.
+
+        :param func: A function which writes to the database
+        :param args: Passed on to the function
+        :param kwargs: Passed on to the function
+        :return: A Future of the function's result, which is set once its transaction has committed
+        """
+        future = Future()
+        self._pending.put((future, func, args, kwargs))
+        return future
+
+    def stop(self, timeout=None):
+        """
+        Runs the writes already queued, then stops the writer thread.
+
+        :param timeout: Optionally, the most seconds to wait for the thread
+        :return: None
+        """
+        self._pending.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._pending.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.delay
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._pending.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+        connection.close()
+
+    def _flush(self, batch):
+        """
+        Runs a batch of writes in one transaction, and then hands each caller its result.
+        """
+        outcomes = []
+        try:
+            close_old_connections()
+            with transaction.atomic():
+                for (future, func, args, kwargs) in batch:
+                    # A caller which gave up before its write started has cancelled it
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((future, func(*args, **kwargs), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            logger.exception("A batch of %d writes failed to commit", len(batch))
+            outcomes = [(future, None, e) for (future, _, _, _) in batch if not future.cancelled()]
+
+        self.flushes += 1
+        self.writes += len(outcomes)
+        for (future, result, error) in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+def get_queue():
+    """
+    :return: The process's WriteQueue, started with the GAMEBOARD_WRITE_QUEUE_DELAY and GAMEBOARD_WRITE_QUEUE_BATCH
+    settings
+    """
+    global _queue
+    with _lock:
+        if _queue is None:
+            _queue = WriteQueue(getattr(settings, 'GAMEBOARD_WRITE_QUEUE_DELAY', 0.005),
+                                getattr(settings, 'GAMEBOARD_WRITE_QUEUE_BATCH', 100))
+        return _queue
+
+
+def stop_queue(timeout=None):
+    """
+    Stops the process's write queue (if it was started), once the writes already queued have run.
+
+    :param timeout: Optionally, the most seconds to wait for the writer thread
+    :return: None
+    """
+    global _queue
+    with _lock:
+        (write_queue, _queue) = (_queue, None)
+    if write_queue is not None:
+        write_queue.stop(timeout)
+
+
+def write(func, *args, **kwargs):
+    """
+    Runs a write: through the process's write queue, waiting for it to commit, if the GAMEBOARD_WRITE_QUEUE setting is
+    on, and otherwise straight away.
+
+    :param func: A function which writes to the database
+    :param args: Passed on to the function
+    :param kwargs: Passed on to the function
+    :return: The function's result (its exceptions are raised here too)
+    """
+    if not getattr(settings, 'GAMEBOARD_WRITE_QUEUE', False):
+        return func(*args, **kwargs)
+    future = get_queue().submit(func, *args, **kwargs)
+    try:
+        return future.result(getattr(settings, 'GAMEBOARD_WRITE_QUEUE_TIMEOUT', 10))
+    except TimeoutError:
+        # Once a write has started it will be committed (or not) with its batch, so it is waited for
+        if future.cancel():
+            raise
+        return future.result()
+
+
+def configure_sqlite(db_connection):
+    """
+    Sets the write queue pragmas on a new SQLite connection.
+
+    :param db_connection: A django database connection
+    :return: None
+    """
+    if db_connection.vendor != 'sqlite':
+        return
+    with db_connection.cursor() as cursor:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
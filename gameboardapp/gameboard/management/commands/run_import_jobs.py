@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from gameboard.helpers.import_jobs import drain
+
+
+class Command(BaseCommand):
+    help = "Runs the queued score imports, oldest first, until there are none left. Imports which were interrupted " \
+           "are queued again first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help="The most jobs to run")
+
+    def handle(self, *args, **options):
+        jobs = drain(limit=options['limit'])
+        for job in jobs:
+            self.stdout.write("Import job %d %s: %d rows processed, %d rejected, %d games added (%.1f rows/s)"
+                              % (job.id, job.status, job.rows_processed, job.rows_rejected, job.games_added,
+                                 job.throughput))
+        self.stdout.write("Ran %d import jobs" % len(jobs))
@@ -0,0 +1,85 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from gameboard.helpers.instrumentation import QueryRecorder
+from gameboard.models import Player, PlayerGroup
+
+logger = logging.getLogger('gameboard.queries')
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records the SQL queries run while handling each request: how many, the total database time, and the slowest
+    statements along with the gameboard function which issued them. In debug mode these are added to the response as
+    headers, otherwise they are logged as a single JSON line.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with QueryRecorder(keep=getattr(settings, 'GAMEBOARD_SLOWEST_QUERIES', 3)) as recorder:
+            response = self.get_response(request)
+        summary = recorder.summary()
+        summary['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(summary['queries'])
+            response['X-Query-Time-Ms'] = str(summary['db_ms'])
+            response['X-Slowest-Queries'] = ", ".join("%s %sms" % (s['origin'] or "?", s['ms'])
+                                                      for s in summary['slowest'])
+        else:
+            summary.update({'method': request.method, 'path': request.path, 'status': response.status_code})
+            logger.info(json.dumps(summary))
+        return response
+
+
+def get_player(request):
+    """
+    Gets the Player of the logged in user, looking it up at most once per request.
+
+    :param request: A html request which has been through the authentication middleware
+    :return: The Player object (with its user and dashboard configuration loaded), or None if there is no player
+    """
+    if not hasattr(request, '_cached_player'):
+        player = None
+        if request.user.is_authenticated:
+            player = Player.objects.select_related('user', 'dashboard_configuration').filter(user=request.user).first()
+        request._cached_player = player
+    return request._cached_player
+
+
+def get_groups(request):
+    """
+    Gets the groups the logged in user's player belongs to, looking them up at most once per request.
+
+    :param request: A html request which has been through the authentication middleware
+    :return: A list of PlayerGroup objects, oldest first (empty if there is no player)
+    """
+    if not hasattr(request, '_cached_groups'):
+        player = get_player(request)
+        groups = []
+        if player is not None:
+            groups = list(PlayerGroup.objects.filter(players=player).order_by('id'))
+        request._cached_groups = groups
+    return request._cached_groups
+
+
+class PlayerMiddleware:
+    """
+    Attaches the logged in user's player (request.player) and their groups (request.groups) to each request. Both are
+    lazy, so requests which never use them cost no queries, and are only looked up once however often they are used.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.player = SimpleLazyObject(lambda: get_player(request))
+        request.groups = SimpleLazyObject(lambda: get_groups(request))
+        return self.get_response(request)
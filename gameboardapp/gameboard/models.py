@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
+from django.dispatch import Signal
 
 
 class DashboardConfiguration(models.Model):
@@ -21,6 +22,15 @@ class Player(models.Model):
     dashboard_configuration = models.ForeignKey(DashboardConfiguration, on_delete=models.CASCADE)
     date_of_birth = models.DateField(default=timezone.now().strftime("%Y-%m-%d"))
     profile_image = models.ImageField(upload_to='',blank=True)
+
+    # Running totals, kept current by gameboard.signals whenever a GamePlayed changes
+    num_played = models.PositiveIntegerField(default=0)
+    num_wins = models.PositiveIntegerField(default=0)
+    last_played = models.DateField(null=True, blank=True)
+
+    # The username as it is searched by (see gameboard.helpers.autocomplete), kept in step with the user by the signals
+    search_name = models.CharField(max_length=255, db_index=True, editable=False, default="")
+
     def __str__(self):
         return str(self.user.username)
 
@@ -34,6 +44,14 @@ class Game(models.Model):
     description = models.CharField(max_length=400)
     game_picture = models.ImageField(upload_to='',blank=True)
 
+    # The name as it is searched by (see gameboard.helpers.autocomplete), set by the signals
+    search_name = models.CharField(max_length=150, db_index=True, editable=False, default="")
+
+    # Set when the game's win streaks or ratings need a rescan (e.g. a result was deleted), see
+    # gameboard.helpers.streaks and gameboard.helpers.ratings
+    streaks_stale = models.BooleanField(default=False)
+    ratings_stale = models.BooleanField(default=False)
+
     def __str__(self):
         return str(self.name)
 
@@ -48,10 +66,20 @@ class PlayerGroup(models.Model):
     admins = models.ManyToManyField(Player, related_name='admins')
     group_picture = models.ImageField(upload_to='',blank=True)
 
+    # Set when the group's win streaks or ratings need a rescan (e.g. a game was deleted), see gameboard.helpers.streaks
+    # and gameboard.helpers.ratings
+    streaks_stale = models.BooleanField(default=False)
+    ratings_stale = models.BooleanField(default=False)
+
     def __str__(self):
         return str(self.name)
 
 
+# Sent by GamePlayed.winners after winners are added ('post_add') or removed ('post_remove'), with the same arguments as
+# m2m_changed, since the winners are a flag on GameParticipation rather than their own many to many table
+winners_changed = Signal(providing_args=['instance', 'action', 'pk_set'])
+
+
 class GamePlayed(models.Model):
     """
     When a group plays a game, they will create a new instance of this class. This stores all of the relevant
@@ -59,9 +87,343 @@ class GamePlayed(models.Model):
     """
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
     date = models.DateField(default=timezone.now().strftime("%Y-%m-%d"))
-    winners = models.ManyToManyField(Player, related_name='game_winners')
-    players = models.ManyToManyField(Player, related_name='game_players')
+    players = models.ManyToManyField(Player, related_name='game_players', through='GameParticipation')
     group = models.ForeignKey(PlayerGroup, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'date', 'id'], name='gameboard_gp_group_date_idx'),
+            models.Index(fields=['game', 'date'], name='gameboard_gp_game_date_idx'),
+        ]
+
+    @property
+    def winners(self):
+        return Winners(self)
+
     def __str__(self):
         return str(self.id)
+
+
+class GameParticipation(models.Model):
+    """
+    One player's result in a GamePlayed: whether they won, and optionally their score and finishing place. These are the
+    rows of GamePlayed.players, so plays and wins are counted from the one table.
+    """
+    gameplayed = models.ForeignKey(GamePlayed, on_delete=models.CASCADE, related_name='participations')
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='participations')
+    is_winner = models.BooleanField(default=False)
+    score = models.IntegerField(null=True, blank=True)
+    placement = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        # The table GamePlayed.players has always used, so existing rows carry over
+        db_table = 'gameboard_gameplayed_players'
+        unique_together = ('gameplayed', 'player')
+        indexes = [models.Index(fields=['player', 'is_winner', 'gameplayed'], name='gameboard_gpp_player_idx')]
+
+    def __str__(self):
+        return "%s: %s" % (self.gameplayed_id, self.player_id)
+
+
+class Winners:
+    """
+    The winners of a GamePlayed, i.e. its participations with is_winner set. Works like a many to many manager (add,
+    remove, clear, set and all), and sends winners_changed for each change.
+    """
+
+    def __init__(self, game_played):
+        self.game_played = game_played
+
+    def _participations(self):
+        return GameParticipation.objects.filter(gameplayed=self.game_played.pk)
+
+    def all(self):
+        """
+        :return: The winning players, read from the prefetched participations if there are any
+        """
+        prefetched = getattr(self.game_played, '_prefetched_objects_cache', {}).get('participations')
+        if prefetched is not None:
+            return [participation.player for participation in prefetched if participation.is_winner]
+        return Player.objects.filter(participations__gameplayed=self.game_played.pk, participations__is_winner=True)
+
+    def count(self):
+        return self._participations().filter(is_winner=True).count()
+
+    def _mark(self, players, is_winner):
+        """
+        Sets or clears the winner flag of some players, sending winners_changed for the ones which changed.
+        """
+        player_ids = {getattr(player, 'pk', player) for player in players}
+        pk_set = set(self._participations().filter(player__in=player_ids, is_winner=not is_winner)
+                     .values_list('player_id', flat=True))
+        if pk_set:
+            self._participations().filter(player__in=pk_set).update(is_winner=is_winner)
+            winners_changed.send(sender=GamePlayed, instance=self.game_played,
+                                 action='post_add' if is_winner else 'post_remove', pk_set=pk_set)
+
+    def add(self, *players):
+        """
+        Marks some players as winners, adding them to the game's players first if they are not already.
+
+        :param players: Player objects or ids
+        :return: None
+        """
+        self.game_played.players.add(*players)
+        self._mark(players, True)
+
+    def remove(self, *players):
+        """
+        Marks some players as no longer winning. They are still players of the game.
+
+        :param players: Player objects or ids
+        :return: None
+        """
+        self._mark(players, False)
+
+    def clear(self):
+        self._mark(self._participations().filter(is_winner=True).values_list('player_id', flat=True), False)
+
+    def set(self, players):
+        player_ids = {getattr(player, 'pk', player) for player in players}
+        current = set(self._participations().filter(is_winner=True).values_list('player_id', flat=True))
+        self.remove(*(current - player_ids))
+        self.add(*(player_ids - current))
+
+
+class PlayerGameStats(models.Model):
+    """
+    How many times a player has played and won a specific game, across all groups. These rows are kept current by
+    gameboard.signals whenever a GamePlayed changes, so per game statistics never need to scan a player's history.
+    """
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='game_stats')
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='player_stats')
+    plays = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('player', 'game')
+        indexes = [
+            models.Index(fields=['player', '-plays'], name='gameboard_pgs_plays_idx'),
+            models.Index(fields=['player', '-wins'], name='gameboard_pgs_wins_idx'),
+        ]
+
+    def __str__(self):
+        return "%s: %s" % (self.player_id, self.game_id)
+
+
+class WinStreak(models.Model):
+    """
+    A player's current and longest run of consecutive wins, counted over every game played within some scope (a group
+    or a game). Kept current by gameboard.helpers.streaks.
+    """
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    current = models.PositiveIntegerField(default=0)
+    longest = models.PositiveIntegerField(default=0)
+
+    # The streaks as they were before the most recent game in the scope, so its winners can change without a rescan
+    previous_current = models.PositiveIntegerField(default=0)
+    previous_longest = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class GroupWinStreak(WinStreak):
+    """
+    Win streaks over the games played by a group.
+    """
+    group = models.ForeignKey(PlayerGroup, on_delete=models.CASCADE, related_name='win_streaks')
+
+    class Meta:
+        unique_together = ('group', 'player')
+        indexes = [models.Index(fields=['group', '-longest'], name='gameboard_gws_longest_idx')]
+
+    def __str__(self):
+        return "%s: %s" % (self.group_id, self.player_id)
+
+
+class GameWinStreak(WinStreak):
+    """
+    Win streaks over every time a game has been played, across all groups.
+    """
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='win_streaks')
+
+    class Meta:
+        unique_together = ('game', 'player')
+        indexes = [models.Index(fields=['game', '-longest'], name='gameboard_gmws_longest_idx')]
+
+    def __str__(self):
+        return "%s: %s" % (self.game_id, self.player_id)
+
+
+class Rating(models.Model):
+    """
+    A player's Elo rating within some scope (a group or a game). Kept current by gameboard.helpers.ratings.
+    """
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    rating = models.FloatField(default=1500)
+    games = models.PositiveIntegerField(default=0)
+
+    # The last game which changed this rating, and the rating before it, so that game's result can change later
+    # without replaying the scope
+    last_game_played = models.ForeignKey(GamePlayed, null=True, blank=True, on_delete=models.SET_NULL,
+                                         related_name='+')
+    last_date = models.DateField(null=True, blank=True)
+    previous_rating = models.FloatField(default=1500)
+
+    class Meta:
+        abstract = True
+
+
+class GroupRating(Rating):
+    """
+    Ratings over the games played by a group.
+    """
+    group = models.ForeignKey(PlayerGroup, on_delete=models.CASCADE, related_name='ratings')
+
+    class Meta:
+        unique_together = ('group', 'player')
+        indexes = [models.Index(fields=['group', '-rating'], name='gameboard_grr_rating_idx')]
+
+    def __str__(self):
+        return "%s: %s" % (self.group_id, self.player_id)
+
+
+class GameRating(Rating):
+    """
+    Ratings over every time a game has been played, across all groups.
+    """
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='ratings')
+
+    class Meta:
+        unique_together = ('game', 'player')
+        indexes = [models.Index(fields=['game', '-rating'], name='gameboard_gmr_rating_idx')]
+
+    def __str__(self):
+        return "%s: %s" % (self.game_id, self.player_id)
+
+
+class GroupActivity(models.Model):
+    """
+    How many games a group played on a day. Kept current by gameboard.helpers.activity.
+    """
+    group = models.ForeignKey(PlayerGroup, on_delete=models.CASCADE, related_name='activity')
+    date = models.DateField()
+    games = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('group', 'date')
+
+    def __str__(self):
+        return "%s: %s" % (self.group_id, self.date)
+
+
+class PlayerActivity(models.Model):
+    """
+    How many games a player played on a day, across all groups. Kept current by gameboard.helpers.activity.
+    """
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='activity')
+    date = models.DateField()
+    games = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('player', 'date')
+
+    def __str__(self):
+        return "%s: %s" % (self.player_id, self.date)
+
+
+class ImportedRow(models.Model):
+    """
+    The import ledger: a csv row which has been imported into a group, by a hash of its contents, so importing a file
+    again (e.g. a spreadsheet which has grown) skips it. See gameboard.helpers.import_helper.
+    """
+    group = models.ForeignKey(PlayerGroup, on_delete=models.CASCADE, related_name='imported_rows')
+    row_hash = models.CharField(max_length=64)
+    imported_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('group', 'row_hash')
+
+    def __str__(self):
+        return "%s: %s" % (self.group_id, self.row_hash)
+
+
+class ImportCheckpoint(models.Model):
+    """
+    How many rows of a file have been imported into a group, so an import which was interrupted resumes where it
+    stopped. The file is identified by a hash of its contents, and the checkpoint is removed once the import finishes.
+    """
+    group = models.ForeignKey(PlayerGroup, on_delete=models.CASCADE, related_name='import_checkpoints')
+    source_hash = models.CharField(max_length=64)
+    rows_done = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('group', 'source_hash')
+
+    def __str__(self):
+        return "%s: %s" % (self.group_id, self.rows_done)
+
+
+class ImportJob(models.Model):
+    """
+    A score import which runs off the request path: the uploaded file is stored, the job is queued, and a background
+    worker (or the run_import_jobs command) imports it, reporting its progress here as it goes. See
+    gameboard.helpers.import_jobs.
+    """
+    STATUSES = ['queued', 'running', 'done', 'failed']
+
+    # The group to import into, or none to wipe the database and import into a new group
+    group = models.ForeignKey(PlayerGroup, on_delete=models.CASCADE, null=True, blank=True, related_name='import_jobs')
+    created_by = models.ForeignKey(Player, on_delete=models.SET_NULL, null=True, blank=True, related_name='import_jobs')
+    source = models.FileField(upload_to='imports/')
+    status = models.CharField(max_length=10, choices=[(status, status) for status in STATUSES], default='queued')
+
+    # How far the import has got: rows read (imported or already in the ledger), rows which could not be imported,
+    # and games played added
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_rejected = models.PositiveIntegerField(default=0)
+    games_added = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    # Why the first rejected rows could not be imported, one per line
+    rejections = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    # When a running job last reported progress. One which has not for longer than GAMEBOARD_IMPORT_LEASE is taken to
+    # have been interrupted (e.g. its process was restarted), and is queued again
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'], name='gameboard_importjob_queue_idx')]
+
+    @property
+    def throughput(self):
+        """
+        :return: The rows processed per second since the job started (0 if it has not started)
+        """
+        if self.started_at is None:
+            return 0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        if elapsed > 0:
+            return self.rows_processed / elapsed
+        return 0
+
+    def as_dict(self):
+        """
+        :return: The job's progress as a dict, ready to be serialized to JSON
+        """
+        return {'id': self.id, 'group': self.group_id, 'status': self.status, 'rows_processed': self.rows_processed,
+                'rows_rejected': self.rows_rejected, 'games_added': self.games_added,
+                'rows_per_second': round(self.throughput, 2), 'error': self.error,
+                'rejections': self.rejections.splitlines(),
+                'created_at': self.created_at.isoformat(),
+                'started_at': self.started_at.isoformat() if self.started_at else None,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None}
+
+    def __str__(self):
+        return "%s: %s" % (self.id, self.status)
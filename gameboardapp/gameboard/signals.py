@@ -0,0 +1,253 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from gameboard.helpers import activity, autocomplete, counters, dashboard_cache, head_to_head, ratings, streaks, \
+    write_queue
+from gameboard.models import Game, GameParticipation, GamePlayed, Player, PlayerGroup, winners_changed
+
+
+def _changed_pairs(instance, reverse, pk_set):
+    """
+    Turns the arguments of an m2m_changed signal into (game_played_id, player_id) pairs, whichever side of the
+    relation the change was made from.
+
+    :param instance: The GamePlayed (or Player, when reverse) whose relation changed
+    :param reverse: True if the change was made from the Player side
+    :param pk_set: The primary keys which were added or removed
+    :return: A list of (game_played_id, player_id) tuples
+    """
+    if reverse:
+        return [(game_played_id, instance.pk) for game_played_id in pk_set]
+    return [(instance.pk, player_id) for player_id in pk_set]
+
+
+def _current_pairs(instance, reverse, pk_set=None):
+    """
+    Reads the participations of an instance, before they are removed or cleared.
+
+    :param instance: The GamePlayed (or Player, when reverse) whose players are changing
+    :param reverse: True if the change was made from the Player side
+    :param pk_set: The primary keys being removed, or None if every row is being cleared
+    :return: A tuple of two lists of (game_played_id, player_id) tuples, for all the rows and for the winning rows
+    """
+    rows = GameParticipation.objects.filter(**{'player' if reverse else 'gameplayed': instance.pk})
+    if pk_set is not None:
+        rows = rows.filter(**{('gameplayed' if reverse else 'player') + '__in': pk_set})
+    rows = list(rows.values_list('gameplayed_id', 'player_id', 'is_winner'))
+    return ([(g, p) for (g, p, _) in rows], [(g, p) for (g, p, is_winner) in rows if is_winner])
+
+
+def _results_changed(instance, reverse, played, won, sign):
+    """
+    Shared handling for changes to GamePlayed.players and GamePlayed.winners.
+
+    :param instance: The GamePlayed (or Player, when reverse) which changed
+    :param reverse: True if the change was made from the Player side
+    :param played: (game_played_id, player_id) tuples of the participations which were added or removed
+    :param won: (game_played_id, player_id) tuples of the wins which were added or removed
+    :param sign: 1 if they were added, -1 if they were removed
+    :return: None
+    """
+    update = counters.add_participations if sign > 0 else counters.remove_participations
+    update(played, False)
+    update(won, True)
+    if played:
+        activity.players_changed(played, sign)
+
+    game_played_ids = sorted({game_played_id for (game_played_id, _) in played + won})
+    if reverse:
+        group_ids = list(GamePlayed.objects.filter(pk__in=game_played_ids).values_list('group_id', flat=True))
+    else:
+        group_ids = [instance.group_id]
+    head_to_head.forget_groups(group_ids)
+    dashboard_cache.bump_versions('group', group_ids)
+    dashboard_cache.bump_versions('player', [player_id for (_, player_id) in played + won])
+    if won:
+        streaks.winners_changed(game_played_ids)
+    if sign > 0 or not played:
+        ratings.results_changed(game_played_ids)
+    else:
+        ratings.players_removed(game_played_ids)
+
+
+@receiver(m2m_changed, sender=GameParticipation)
+def players_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Removing a player removes their win too, so the rows are read before they go
+    if action == 'pre_remove':
+        instance._gameboard_removed = _current_pairs(instance, reverse, pk_set)
+    elif action == 'pre_clear':
+        instance._gameboard_removed = _current_pairs(instance, reverse)
+    elif action == 'post_add':
+        _results_changed(instance, reverse, _changed_pairs(instance, reverse, pk_set), [], 1)
+    elif action in ('post_remove', 'post_clear'):
+        (played, won) = getattr(instance, '_gameboard_removed', ([], []))
+        _results_changed(instance, reverse, played, won, -1)
+
+
+@receiver(winners_changed, sender=GamePlayed)
+def game_winners_changed(sender, instance, action, pk_set, **kwargs):
+    _results_changed(instance, False, [], _changed_pairs(instance, False, pk_set), 1 if action == 'post_add' else -1)
+
+
+def _game_played_pairs(game_played_id):
+    """
+    Reads the players and winners of a single GamePlayed.
+
+    :param game_played_id: The id of the GamePlayed
+    :return: A tuple of two lists of (game_played_id, player_id) tuples, for the players and the winners
+    """
+    return _current_pairs(GamePlayed(pk=game_played_id), False)
+
+
+def _date(instance):
+    """
+    :param instance: A GamePlayed object
+    :return: The date it was played, as a date (data entry sets it to a datetime)
+    """
+    return GamePlayed._meta.get_field('date').to_python(instance.date)
+
+
+@receiver(pre_save, sender=GamePlayed)
+def game_played_saving(sender, instance, **kwargs):
+    # Remember what the game, date and group were, in case this save moves it
+    instance._gameboard_previous = None
+    if instance.pk:
+        instance._gameboard_previous = GamePlayed.objects.filter(pk=instance.pk) \
+            .values_list('game_id', 'date', 'group_id').first()
+
+
+@receiver(post_save, sender=GamePlayed)
+def game_played_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_gameboard_previous', None)
+    if created or previous is None:
+        # A new game has no players yet, they are counted as they are added
+        streaks.game_played_added(instance.pk)
+        activity.game_played_added(instance.group_id, _date(instance))
+        dashboard_cache.bump_versions('group', [instance.group_id])
+        return
+
+    current = GamePlayed.objects.filter(pk=instance.pk).values_list('game_id', 'date', 'group_id').first()
+    if current != previous:
+        # Move the results from the old game/date over to the new one
+        (players, winners) = _game_played_pairs(instance.pk)
+        for (pairs, winners_table) in [(players, False), (winners, True)]:
+            counters.remove_participations(pairs, winners_table, {instance.pk: previous[0]})
+            counters.add_participations(pairs, winners_table, {instance.pk: current[0]})
+        activity.game_played_removed(previous[2], previous[1])
+        activity.game_played_added(current[2], current[1])
+        activity.players_changed(players, -1, {instance.pk: previous[1]})
+        activity.players_changed(players, 1, {instance.pk: current[1]})
+        for (game_id, _, group_id) in [previous, current]:
+            for stats in [streaks, ratings]:
+                stats.mark_stale('game', game_id)
+                stats.mark_stale('group', group_id)
+        head_to_head.forget_groups([previous[2], current[2]])
+        dashboard_cache.bump_versions('group', [previous[2], current[2]])
+        dashboard_cache.bump_versions('player', [player_id for (_, player_id) in players])
+
+
+@receiver(pre_delete, sender=GamePlayed)
+def game_played_deleting(sender, instance, **kwargs):
+    # The participations are deleted without an m2m_changed signal, so remember them here
+    (instance._gameboard_players, instance._gameboard_winners) = _game_played_pairs(instance.pk)
+
+
+@receiver(post_delete, sender=GamePlayed)
+def game_played_deleted(sender, instance, **kwargs):
+    games = {instance.pk: instance.game_id}
+    players = getattr(instance, '_gameboard_players', [])
+    counters.remove_participations(players, False, games)
+    counters.remove_participations(getattr(instance, '_gameboard_winners', []), True, games)
+    activity.game_played_removed(instance.group_id, _date(instance))
+    activity.players_changed(players, -1, {instance.pk: _date(instance)})
+    for stats in [streaks, ratings]:
+        stats.mark_stale('game', instance.game_id)
+        stats.mark_stale('group', instance.group_id)
+    head_to_head.forget_groups([instance.group_id])
+    dashboard_cache.bump_versions('group', [instance.group_id])
+    dashboard_cache.bump_versions('player', [player_id for (_, player_id) in players])
+
+
+def _membership_changed(sender, instance, action, reverse, pk_set):
+    """
+    Shared handling for changes to PlayerGroup.players and PlayerGroup.admins. Every member's profile lists the
+    members of their groups, so the dashboards of the group and of everyone in it are moved on to a new version.
+    Clears are handled before they happen, while the rows to be cleared can still be read.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if action == 'pre_clear':
+        key = 'player' if reverse else 'playergroup'
+        pk_set = set(sender.objects.filter(**{key: instance.pk}).values_list(
+            'playergroup_id' if reverse else 'player_id', flat=True))
+
+    (group_ids, player_ids) = (set(pk_set), {instance.pk}) if reverse else ({instance.pk}, set(pk_set))
+    player_ids.update(PlayerGroup.players.through.objects.filter(playergroup__in=group_ids)
+                      .values_list('player_id', flat=True))
+    dashboard_cache.bump_versions('group', group_ids)
+    dashboard_cache.bump_versions('player', player_ids)
+
+
+@receiver(m2m_changed, sender=PlayerGroup.players.through)
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _membership_changed(sender, instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=PlayerGroup.admins.through)
+def admins_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _membership_changed(sender, instance, action, reverse, pk_set)
+
+
+@receiver(post_save, sender=PlayerGroup)
+def group_saved(sender, instance, created, **kwargs):
+    # A renamed group shows up on its own page and on every member's profile
+    if not created:
+        dashboard_cache.bump_versions('group', [instance.pk])
+        dashboard_cache.bump_versions('player', instance.players.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Names and pictures appear on the dashboards of the player and their groups (logging in only touches last_login)
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    player_ids = list(Player.objects.filter(user=instance).values_list('id', flat=True))
+    if player_ids:
+        # The username and first name are suggested when typing a player's name
+        Player.objects.filter(pk__in=player_ids).update(search_name=autocomplete.search_key(instance.username))
+        autocomplete.changed('players')
+        dashboard_cache.bump_versions('player', player_ids)
+        dashboard_cache.bump_versions('group', PlayerGroup.players.through.objects.filter(player__in=player_ids)
+                                      .values_list('playergroup_id', flat=True))
+
+
+@receiver(pre_save, sender=Game)
+def game_saving(sender, instance, **kwargs):
+    instance.search_name = autocomplete.search_key(instance.name)
+
+
+@receiver(pre_save, sender=Player)
+def player_saving(sender, instance, **kwargs):
+    instance.search_name = autocomplete.search_key(instance.user.username)
+
+
+@receiver(post_save, sender=Game)
+@receiver(post_delete, sender=Game)
+def game_changed(sender, instance, **kwargs):
+    autocomplete.changed('games')
+
+
+@receiver(post_save, sender=Player)
+@receiver(post_delete, sender=Player)
+def player_changed(sender, instance, **kwargs):
+    autocomplete.changed('players')
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # Write queue mode is meant for SQLite, which needs WAL and a busy timeout to serve reads alongside the writer
+    if getattr(settings, 'GAMEBOARD_WRITE_QUEUE', False):
+        write_queue.configure_sqlite(connection)
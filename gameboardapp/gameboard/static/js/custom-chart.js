@@ -111,17 +111,17 @@ var myChart = new Chart(ctx, {
     }
 });
 
-var top_5_player_data = CSVToArray(document.getElementById("top_5_winners_chart_info").innerHTML, ",")[0]
+var top_5_player_data = JSON.parse(document.getElementById("top_5_winners_chart_info").textContent)
 
 new Chart(document.getElementById("winsDonut"), {
     type: 'doughnut',
     data: {
-        labels: [top_5_player_data[0], top_5_player_data[1], top_5_player_data[2], top_5_player_data[3], top_5_player_data[4]],
+        labels: top_5_player_data.map(function (row) { return row.name; }),
         datasets: [
             {
                 label: "Wins",
                 backgroundColor: ["#3e95cd", "#8e5ea2","#3cba9f","#e8c3b9","#c45850"],
-                data: [top_5_player_data[5],top_5_player_data[6],top_5_player_data[7],top_5_player_data[8],top_5_player_data[9]]
+                data: top_5_player_data.map(function (row) { return row.wins; })
             }
         ]
     },
@@ -133,12 +133,12 @@ new Chart(document.getElementById("winsDonut"), {
     }
 });
 
-var top_5_game_data = CSVToArray(document.getElementById("top_5_games_chart_info").innerHTML, ",")[0]
+var top_5_game_data = JSON.parse(document.getElementById("top_5_games_chart_info").textContent)
 
 new Chart(document.getElementById("popGame"), {
     type: 'radar',
     data: {
-        labels: [top_5_game_data[0], top_5_game_data[1], top_5_game_data[2], top_5_game_data[3], top_5_game_data[4]],
+        labels: top_5_game_data.map(function (row) { return row.name; }),
         datasets: [
             {
                 label: "Most Popular Game",
@@ -147,7 +147,7 @@ new Chart(document.getElementById("popGame"), {
                 borderColor: "rgba(179,181,198,1)",
                 pointBorderColor: "#fff",
                 pointBackgroundColor: "rgba(179,181,198,1)",
-                data: [top_5_game_data[5], top_5_game_data[6],top_5_game_data[7],top_5_game_data[8],top_5_game_data[9]]
+                data: top_5_game_data.map(function (row) { return row.plays; })
             },
         ]
     },
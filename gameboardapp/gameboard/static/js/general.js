@@ -18,38 +18,59 @@ function getCookie(name) {
 // From https://www.w3schools.com/howto/howto_js_autocomplete.asp
 function autocomplete(inp, arr) {
     /*the autocomplete function takes two arguments,
-    the text field element and an array of possible autocompleted values:*/
+    the text field element and either an array of possible autocompleted values,
+    or the url of an endpoint which suggests them as {"results": [{"id": ..., "name": ...}]}.
+    The ids of the values suggested by an endpoint are kept in inp.autocompleteIds, by name:*/
     var currentFocus;
+    inp.autocompleteIds = {};
     /*execute a function when someone writes in the text field:*/
     inp.addEventListener("input", function(e) {
-        var a, b, i, val = this.value;
+        var val = this.value;
         /*close any already open lists of autocompleted values*/
         closeAllLists();
         if (!val) { return false;}
+        if (typeof arr === "string") {
+            /*ask the endpoint, and ignore the answer if more has been typed since*/
+            $.getJSON(arr, {q: val}, function(data) {
+                if (inp.value !== val) { return; }
+                var names = [];
+                for (var i = 0; i < data.results.length; i++) {
+                    names.push(data.results[i].name);
+                    inp.autocompleteIds[data.results[i].name] = data.results[i].id;
+                }
+                showList(val, names);
+            });
+        } else {
+            showList(val, arr);
+        }
+    });
+    function showList(val, values) {
+        var a, b, i;
+        closeAllLists();
         currentFocus = -1;
         /*create a DIV element that will contain the items (values):*/
         a = document.createElement("DIV");
-        a.setAttribute("id", this.id + "autocomplete-list");
+        a.setAttribute("id", inp.id + "autocomplete-list");
         a.setAttribute("class", "autocomplete-items");
         /*append the DIV element as a child of the autocomplete container:*/
-        this.parentNode.appendChild(a);
+        inp.parentNode.appendChild(a);
         /*for each item in the array...*/
-        for (i = 0; i < arr.length; i++) {
+        for (i = 0; i < values.length; i++) {
             /*check if the item starts with the same letters as the text field value:*/
-            if (arr[i].substr(0, val.length).toUpperCase() == val.toUpperCase()) {
+            if (values[i].substr(0, val.length).toUpperCase() == val.toUpperCase()) {
                 /*create a DIV element for each matching element:*/
                 b = document.createElement("DIV");
                 /*make the matching letters bold:*/
-                b.innerHTML = "<strong>" + arr[i].substr(0, val.length) + "</strong>";
-                b.innerHTML += arr[i].substr(val.length);
+                b.innerHTML = "<strong>" + values[i].substr(0, val.length) + "</strong>";
+                b.innerHTML += values[i].substr(val.length);
                 /*insert a input field that will hold the current array item's value:*/
-                b.innerHTML += "<input type='hidden' value='" + arr[i] + "'>";
+                b.innerHTML += "<input type='hidden' value='" + values[i] + "'>";
                 /*execute a function when someone clicks on the item value (DIV element):*/
                 b.addEventListener("click", function(e) {
                     /*insert the value for the autocomplete text field:*/
                     inp.value = this.getElementsByTagName("input")[0].value;
-                    if (inp.id == "id_player") {
-                        addPlayer(this.getElementsByTagName("input")[0].value);
+                    if (typeof inp.onAutocomplete === "function") {
+                        inp.onAutocomplete(inp.value);
                         inp.value = "";
                     }
                     /*close the list of autocompleted values,
@@ -59,7 +80,7 @@ function autocomplete(inp, arr) {
                 a.appendChild(b);
             }
         }
-    });
+    }
     /*execute a function presses a key on the keyboard:*/
     inp.addEventListener("keydown", function(e) {
         var x = document.getElementById(this.id + "autocomplete-list");
@@ -90,17 +90,17 @@ var myChart = new Chart(ctx, {
     }
 });
 
-var wins_by_game_data = CSVToArray(document.getElementById("wins_by_game_chart_info").innerHTML, ",")[0]
+var wins_by_game_data = JSON.parse(document.getElementById("wins_by_game_chart_info").textContent)
 
 new Chart(document.getElementById("winsBar"), {
     type: 'bar',
     data: {
-        labels: [wins_by_game_data[0], wins_by_game_data[1], wins_by_game_data[2], wins_by_game_data[3], wins_by_game_data[4]],
+        labels: wins_by_game_data.map(function (row) { return row.name; }),
         datasets: [
             {
                 label: "Wins",
                 backgroundColor: ["#3e95cd", "#8e5ea2","#3cba9f","#e8c3b9","#c45850"],
-                data: [wins_by_game_data[5],wins_by_game_data[6],wins_by_game_data[7],wins_by_game_data[8],wins_by_game_data[9]]
+                data: wins_by_game_data.map(function (row) { return row.wins; })
             }
         ]
     },
@@ -112,12 +112,12 @@ new Chart(document.getElementById("winsBar"), {
     }
 });
 
-var top_5_games_data = CSVToArray(document.getElementById("top_5_games_chart_info").innerHTML, ",")[0]
+var top_5_games_data = JSON.parse(document.getElementById("top_5_games_chart_info").textContent)
 
 new Chart(document.getElementById("popGame"), {
     type: 'radar',
     data: {
-        labels: [top_5_games_data[0], top_5_games_data[1], top_5_games_data[2], top_5_games_data[3], top_5_games_data[4]],
+        labels: top_5_games_data.map(function (row) { return row.name; }),
         datasets: [
             {
                 label: "Most Popular Game",
@@ -126,7 +126,7 @@ new Chart(document.getElementById("popGame"), {
                 borderColor: "rgba(179,181,198,1)",
                 pointBorderColor: "#fff",
                 pointBackgroundColor: "rgba(179,181,198,1)",
-                data: [top_5_games_data[5],top_5_games_data[6],top_5_games_data[7],top_5_games_data[8],top_5_games_data[9]]
+                data: top_5_games_data.map(function (row) { return row.plays; })
             },
         ]
     },
@@ -1,14 +1,53 @@
 from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
-from django.test import TestCase, LiveServerTestCase, Client
+from django.utils import timezone
+from django.test import TestCase, TransactionTestCase, LiveServerTestCase, Client, RequestFactory, override_settings
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.firefox.webdriver import WebDriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-from gameboard.models import Player, GamePlayed, Game, PlayerGroup, DashboardConfiguration
+from gameboard.helpers.activity import find_activity, rebuild_activity
+from gameboard.helpers.autocomplete import suggest
+from gameboard.helpers.counters import rebuild_player_counters, rebuild_player_game_stats
+from gameboard.helpers.dashboard import GroupDashboard
+from gameboard.helpers.dashboard_cache import bump_versions, cached_dashboard, current_version, wait_for_refreshes
+from gameboard.helpers.queries import find_player_stats, find_games_played, find_win_percentage_for_game, \
+    find_most_active_player_in_group, find_favorite_game_in_group, find_groups, \
+    find_longest_win_streak_in_group, find_longest_win_streak_in_game, find_best_player_in_group, find_rival_in_group
+from gameboard.helpers.head_to_head import HeadToHead, _cache_key as head_to_head_key
+from gameboard.helpers.history import find_history_page
+from gameboard.helpers.import_helper import ImportScores
+from gameboard.helpers.import_jobs import drain
+from gameboard.helpers.instrumentation import QueryRecorder, query_budget
+from gameboard.helpers.leaderboard import find_leaderboard
+from gameboard.helpers.legacy import LEGACY_WINNERS_TABLE, copy_legacy_winners
+from gameboard.helpers.ratings import elo_deltas, find_rankings, replay_ratings
+from gameboard.helpers.results import record_results
+from gameboard.helpers.streaks import scan_streaks
+from gameboard.helpers.write_queue import WriteQueue, configure_sqlite
+from gameboard.middleware import get_groups, get_player
+from gameboard.models import Player, GamePlayed, Game, PlayerGroup, DashboardConfiguration, PlayerGameStats, \
+    GroupWinStreak, GroupRating, PlayerActivity, GameParticipation, ImportCheckpoint, ImportJob
+import csv
 import datetime
+import hashlib
+import json
+import logging
+import numpy
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
 
 class TestGameBoardModels(TestCase):
     @classmethod
@@ -135,6 +174,1179 @@ class TestGameBoardModels(TestCase):
         self.assertEquals(len(players2), 3)
 
 
+class GameBoardData:
+    """
+    Three players in a group who have played four games of Catan and Uno, shared by the tests of the statistics.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        d = DashboardConfiguration(type="Default")
+        d.save()
+        players = []
+        for username, first_name in [("jeffx", "Jeff"), ("jennyh", "Jenny"), ("keeganw", "Keegan")]:
+            u = User(first_name=first_name, username=username, password="password")
+            u.save()
+            p = Player(user=u, dashboard_configuration=d)
+            p.save()
+            players.append(p)
+        (player1, player2, player3) = players
+
+        catan = Game(name="Catan", description="You play this!")
+        catan.save()
+        uno = Game(name="Uno", description="Reverse!")
+        uno.save()
+
+        group = PlayerGroup(name="Webapps_Group")
+        group.save()
+        group.players.add(player1, player2, player3)
+
+        results = [
+            (catan, "2019-12-01", [player1, player2], [player1]),
+            (catan, "2019-12-02", [player1, player2, player3], [player2]),
+            (uno, "2019-12-03", [player1, player3], [player1]),
+            (catan, "2019-12-04", [player1, player2], [player1]),
+        ]
+        for (game, date, game_players, winners) in results:
+            played = GamePlayed(game=game, date=datetime.datetime.strptime(date, "%Y-%m-%d").date(), group=group)
+            played.save()
+            played.players.add(*game_players)
+            played.winners.add(*winners)
+
+    def setUp(self):
+        # Cached statistics are not rolled back with the database between tests
+        cache.clear()
+
+
+class TestPlayerStats(GameBoardData, TestCase):
+    """
+    The profile statistics of a player, from a single aggregate query.
+    """
+
+    def test_player_stats(self):
+        player1 = Player.objects.get(user__username="jeffx")
+        with self.assertNumQueries(1):
+            stats = find_player_stats(player1)
+
+        self.assertEqual(stats.num_played, 4)
+        self.assertEqual(stats.num_wins, 3)
+        self.assertEqual(stats.num_losses, 1)
+        self.assertEqual(stats.win_percentage, 75)
+        self.assertEqual(stats.num_games, 2)
+        self.assertEqual(stats.fav_game, "Catan")
+
+    def test_player_stats_no_games(self):
+        u = User(first_name="New", username="newbie", password="password")
+        u.save()
+        p = Player(user=u, dashboard_configuration=DashboardConfiguration.objects.first())
+        p.save()
+        stats = find_player_stats(p)
+
+        self.assertEqual(stats.num_played, 0)
+        self.assertEqual(stats.win_percentage, 0)
+        self.assertEqual(stats.fav_game, '')
+        self.assertEqual(find_player_stats(None).num_played, 0)
+
+
+class TestPlayerCounters(GameBoardData, TestCase):
+    """
+    The played and win counters kept on each player.
+    """
+
+    def test_player_counters(self):
+        player1 = Player.objects.get(user__username="jeffx")
+        player3 = Player.objects.get(user__username="keeganw")
+
+        self.assertEqual(player1.num_played, 4)
+        self.assertEqual(player1.num_wins, 3)
+        self.assertEqual(player1.last_played, datetime.date(2019, 12, 4))
+        self.assertEqual(player3.num_played, 2)
+        self.assertEqual(player3.last_played, datetime.date(2019, 12, 3))
+
+        played = GamePlayed.objects.get(date=datetime.date(2019, 12, 3))
+        played.winners.remove(player1)
+        played.winners.add(player3)
+        player3.game_players.remove(played)
+        player1.refresh_from_db()
+        player3.refresh_from_db()
+        # Taking a winner out of the game takes their win with it
+        self.assertEqual(player1.num_wins, 2)
+        self.assertEqual(player3.num_wins, 0)
+        self.assertEqual(player3.num_played, 1)
+        self.assertEqual(player3.last_played, datetime.date(2019, 12, 2))
+
+        GamePlayed.objects.filter(date=datetime.date(2019, 12, 4)).delete()
+        played.players.clear()
+        player1.refresh_from_db()
+        self.assertEqual(player1.num_played, 2)
+        self.assertEqual(player1.last_played, datetime.date(2019, 12, 2))
+
+    def test_rebuild_player_counters(self):
+        Player.objects.update(num_played=0, num_wins=0, last_played=None)
+        rebuild_player_counters()
+        player1 = Player.objects.get(user__username="jeffx")
+
+        self.assertEqual(player1.num_played, 4)
+        self.assertEqual(player1.num_wins, 3)
+        self.assertEqual(player1.last_played, datetime.date(2019, 12, 4))
+
+
+class TestPlayerGameStats(GameBoardData, TestCase):
+    """
+    The plays and wins of each player in each game.
+    """
+
+    def test_player_game_stats(self):
+        player1 = Player.objects.get(user__username="jeffx")
+        stats = {s.game.name: (s.plays, s.wins) for s in PlayerGameStats.objects.filter(player=player1)}
+        self.assertEqual(stats, {"Catan": (3, 2), "Uno": (1, 1)})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(find_games_played(player1), {"Catan", "Uno"})
+        self.assertAlmostEqual(find_win_percentage_for_game(player1, "Catan"), 200 / 3)
+
+        # Moving a result to another game moves its counts too
+        played = GamePlayed.objects.get(date=datetime.date(2019, 12, 3))
+        played.game = Game.objects.get(name="Catan")
+        played.save()
+        stats = {s.game.name: (s.plays, s.wins) for s in PlayerGameStats.objects.filter(player=player1)}
+        self.assertEqual(stats, {"Catan": (4, 3), "Uno": (0, 0)})
+        self.assertEqual(find_player_stats(player1).num_games, 1)
+
+        played.delete()
+        self.assertEqual(PlayerGameStats.objects.get(player=player1, game__name="Catan").plays, 3)
+
+    def test_rebuild_player_game_stats(self):
+        player1 = Player.objects.get(user__username="jeffx")
+        PlayerGameStats.objects.all().delete()
+        rebuild_player_game_stats()
+        stats = {s.game.name: (s.plays, s.wins) for s in PlayerGameStats.objects.filter(player=player1)}
+        self.assertEqual(stats, {"Catan": (3, 2), "Uno": (1, 1)})
+
+
+class TestGroupDashboard(GameBoardData, TestCase):
+    """
+    The group page, built from one read of the group's history.
+    """
+
+    def test_group_dashboard(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        player1 = Player.objects.get(user__username="jeffx")
+        with self.assertNumQueries(12):
+            dashboard = GroupDashboard(group)
+            for (game, _) in dashboard.recent_games:
+                [str(p.player) for p in game.participations.all()] + [str(p) for p in game.winners.all()] \
+                    + [game.game.name]
+
+        self.assertEqual(dashboard.num_games_played, 4)
+        self.assertEqual(dashboard.num_players, 3)
+        self.assertEqual(dashboard.best_player, player1)
+        self.assertEqual(dashboard.best_player_win_rate, 75)
+        self.assertEqual(dashboard.longest_win_streak_player, player1)
+        self.assertEqual(dashboard.longest_win_streak, 2)
+        self.assertEqual((dashboard.most_active_player, dashboard.most_active_played), (player1, 4))
+        self.assertEqual((dashboard.favorite_game, dashboard.favorite_game_played), ("Catan", 3))
+        self.assertEqual(dashboard.recent_games[0][0].date, datetime.date(2019, 12, 4))
+        self.assertEqual([(r.name, r.plays) for r in dashboard.top_5_games], [("Catan", 3), ("Uno", 1)])
+
+
+class TestWinStreaks(GameBoardData, TestCase):
+    """
+    The streak engine and the win streak index.
+    """
+
+    def test_scan_streaks(self):
+        results = [(1, 10), (2, 10), (2, 11), (3, 11), (4, None), (5, 10), (6, 10)]
+        streaks = scan_streaks(results)
+
+        self.assertEqual(streaks[10], (2, 2, 1, 2))
+        self.assertEqual(streaks[11], (0, 2, 0, 2))
+
+    def test_win_streak_index(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        player1 = Player.objects.get(user__username="jeffx")
+        player2 = Player.objects.get(user__username="jennyh")
+        catan = Game.objects.get(name="Catan")
+        streak = GroupWinStreak.objects.get(group=group, player=player1)
+        self.assertEqual((streak.current, streak.longest), (2, 2))
+        self.assertEqual(find_longest_win_streak_in_group(group), (player1, 2))
+        self.assertEqual(find_longest_win_streak_in_game("Catan"), (player1, 1))
+
+        # Extending the latest game is incremental
+        played = GamePlayed(game=catan, date=datetime.date(2019, 12, 5), group=group)
+        played.save()
+        played.players.add(player1, player2)
+        played.winners.add(player1)
+        played.winners.add(player2)
+        played.winners.remove(player2)
+        group.refresh_from_db()
+        self.assertFalse(group.streaks_stale)
+        streak = GroupWinStreak.objects.get(group=group, player=player1)
+        self.assertEqual((streak.current, streak.longest), (3, 3))
+        self.assertEqual(GroupWinStreak.objects.get(group=group, player=player2).current, 0)
+
+        # An older result marks the index stale, and it is rescanned when read
+        played = GamePlayed(game=catan, date=datetime.date(2019, 11, 30), group=group)
+        played.save()
+        played.players.add(player1, player2)
+        played.winners.add(player1)
+        group.refresh_from_db()
+        self.assertTrue(group.streaks_stale)
+        self.assertEqual(find_longest_win_streak_in_group(group), (player1, 3))
+
+        GamePlayed.objects.filter(date=datetime.date(2019, 12, 2)).delete()
+        self.assertEqual(find_longest_win_streak_in_group(group), (player1, 5))
+        self.assertEqual(find_longest_win_streak_in_game("Catan"), (player1, 4))
+
+
+class TestRatings(GameBoardData, TestCase):
+    """
+    The Elo ratings of each group and game.
+    """
+
+    def test_elo_deltas(self):
+        deltas = elo_deltas(numpy.array([1500.0, 1500.0, 1600.0]), numpy.array([True, False, False]))
+
+        self.assertAlmostEqual(deltas.sum(), 0)
+        self.assertGreater(deltas[0], 0)
+        self.assertLess(deltas[2], deltas[1])
+
+    def test_ratings(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        player1 = Player.objects.get(user__username="jeffx")
+        incremental = {(r.player_id, round(r.rating, 6), r.games) for r in GroupRating.objects.filter(group=group)}
+        self.assertEqual(len(incremental), 3)
+
+        replay_ratings('group', group.id)
+        replayed = {(r.player_id, round(r.rating, 6), r.games) for r in GroupRating.objects.filter(group=group)}
+        self.assertEqual(incremental, replayed)
+
+        (best_player, percentage) = find_best_player_in_group(group)
+        self.assertEqual(best_player, player1)
+        self.assertEqual(percentage, 75)
+
+        # Changing the winner of an old game is replayed when the ratings are next read
+        played = GamePlayed.objects.get(date=datetime.date(2019, 12, 1))
+        played.winners.set([Player.objects.get(user__username="jennyh")])
+        group.refresh_from_db()
+        self.assertTrue(group.ratings_stale)
+        rankings = find_rankings('group', group.id)
+        group.refresh_from_db()
+        self.assertFalse(group.ratings_stale)
+        self.assertEqual(rankings[0].player.user.username, "jennyh")
+        self.assertEqual(sum(r.games for r in rankings), 9)
+
+
+class TestHeadToHead(GameBoardData, TestCase):
+    """
+    The head to head matrices of a group.
+    """
+
+    def test_head_to_head(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        (player1, player2, player3) = [Player.objects.get(user__username=u) for u in ["jeffx", "jennyh", "keeganw"]]
+        head_to_head = HeadToHead.for_group(group)
+
+        self.assertEqual(head_to_head.record(player1.id, player2.id), (2, 1))
+        self.assertEqual(head_to_head.nemesis(player1.id), (player2.id, 1))
+        self.assertEqual(head_to_head.favorite_victim(player1.id), (player2.id, 2))
+        self.assertEqual(head_to_head.rival(player3.id), (player1.id, 2))
+        self.assertEqual(find_rival_in_group(group, player1), (1, "jennyh"))
+        self.assertEqual(find_rival_in_group(group, player2), (2, "jeffx"))
+
+        # New results drop the cached matrix
+        played = GamePlayed(game=Game.objects.get(name="Uno"), date=datetime.date(2019, 12, 5), group=group)
+        played.save()
+        played.players.add(player1, player3)
+        played.winners.add(player3)
+        with self.assertNumQueries(2):
+            self.assertEqual(find_rival_in_group(group, player1), (1, "jennyh"))
+        self.assertEqual(HeadToHead.for_group(group).record(player1.id, player3.id), (1, 1))
+
+
+class TestActivity(GameBoardData, TestCase):
+    """
+    The daily activity rollups of groups and players.
+    """
+
+    def test_activity(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        player3 = Player.objects.get(user__username="keeganw")
+        self.assertEqual(find_activity('group', group.id), [(datetime.date(2019, 12, d), 1) for d in range(1, 5)])
+        self.assertEqual(find_activity('player', player3.id),
+                         [(datetime.date(2019, 12, 2), 1), (datetime.date(2019, 12, 3), 1)])
+
+        # Move one game into the next month, and drop another
+        played = GamePlayed.objects.get(date=datetime.date(2019, 12, 3))
+        played.date = datetime.date(2020, 1, 1)
+        played.save()
+        GamePlayed.objects.filter(date=datetime.date(2019, 12, 4)).delete()
+
+        self.assertEqual(find_activity('group', group.id, period='month'),
+                         [(datetime.date(2019, 12, 1), 2), (datetime.date(2020, 1, 1), 1)])
+        self.assertEqual(find_activity('group', group.id, period='week'),
+                         [(datetime.date(2019, 11, 25), 1), (datetime.date(2019, 12, 2), 1),
+                          (datetime.date(2019, 12, 30), 1)])
+        self.assertEqual(find_activity('player', player3.id, start=datetime.date(2019, 12, 3)),
+                         [(datetime.date(2020, 1, 1), 1)])
+
+        expected = set(PlayerActivity.objects.filter(games__gt=0).values_list('player_id', 'date', 'games'))
+        rebuild_activity()
+        self.assertEqual(set(PlayerActivity.objects.values_list('player_id', 'date', 'games')), expected)
+
+
+class TestLeaderboard(GameBoardData, TestCase):
+    """
+    The top N leaderboards, and the endpoint serving them.
+    """
+
+    def test_leaderboard(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        player1 = Player.objects.get(user__username="jeffx")
+        catan = Game.objects.get(name="Catan")
+
+        with self.assertNumQueries(1):
+            rows = find_leaderboard('group', group.id, 'wins', 2)
+        self.assertEqual([(r.rank, r.name, r.plays, r.wins) for r in rows], [(1, "jeffx", 4, 3), (2, "jennyh", 3, 1)])
+        rows = find_leaderboard('group', group.id, 'plays', None)
+        self.assertEqual([r.name for r in rows], ["jeffx", "jennyh", "keeganw"])
+        self.assertEqual(rows[2].win_rate, 0)
+
+        rows = find_leaderboard('player', player1.id, 'win_rate')
+        self.assertEqual([(r.name, r.win_rate) for r in rows], [("Uno", 100), ("Catan", 2 / 3 * 100)])
+        rows = find_leaderboard('game', catan.id, 'plays', 5)
+        self.assertEqual([(r.name, r.plays, r.wins) for r in rows],
+                         [("jeffx", 3, 2), ("jennyh", 3, 1), ("keeganw", 1, 0)])
+        self.assertEqual(rows[0].as_dict(), {'rank': 1, 'id': player1.id, 'name': "jeffx", 'plays': 3, 'wins': 2,
+                                             'win_rate': 66.67})
+
+        with self.assertRaises(ValueError):
+            find_leaderboard('group', group.id, 'wins', subject='games')
+        with self.assertRaises(ValueError):
+            find_leaderboard('group', group.id, 'losses')
+
+        client = Client()
+        client.force_login(player1.user)
+        for (n, length) in [(-1, 1), (0, 1), (1000, 3)]:
+            response = client.get("/leaderboard", {'id': group.id, 'n': n})
+            self.assertEqual(len(response.json()['rows']), length)
+        self.assertEqual(client.get("/leaderboard", {'id': group.id, 'n': "all"}).status_code, 400)
+
+        # Only the requester's groups, the players they share a group with and the games their groups played
+        outsider = Player.objects.create(user=User.objects.create(username="outsider"),
+                                         dashboard_configuration=DashboardConfiguration.objects.first())
+        other = PlayerGroup.objects.create(name="Other_Group")
+        other.players.add(outsider)
+        chess = Game.objects.create(name="Chess")
+        for game in [catan, chess]:
+            played = GamePlayed.objects.create(game=game, date=datetime.date(2019, 12, 5), group=other)
+            played.players.add(outsider)
+        for (scope, scope_id) in [('group', other.id), ('player', outsider.id), ('game', chess.id)]:
+            self.assertEqual(client.get("/leaderboard", {'scope': scope, 'id': scope_id}).status_code, 404)
+        response = client.get("/leaderboard", {'scope': 'game', 'id': catan.id, 'metric': 'plays'})
+        self.assertEqual([row['name'] for row in response.json()['rows']], ["jeffx", "jennyh", "keeganw"])
+        self.assertEqual(client.get("/leaderboard", {'scope': 'player', 'id': player1.id}).status_code, 200)
+        self.assertEqual(client.get("/leaderboard", {'scope': 'team', 'id': group.id}).status_code, 400)
+
+
+class TestQueryInstrumentation(GameBoardData, TestCase):
+    """
+    The per request query counts, timings and budgets.
+    """
+
+    def test_query_recorder(self):
+        player1 = Player.objects.get(user__username="jeffx")
+        with QueryRecorder(keep=1) as recorder:
+            find_player_stats(player1)
+            find_games_played(player1)
+        self.assertEqual(recorder.count, 2)
+        self.assertEqual(len(recorder.slowest), 1)
+        self.assertIn(recorder.slowest[0][2], ["queries.find_player_stats", "queries.find_games_played"])
+        # Statements which are not kept are not traced back to where they came from
+        with mock.patch('gameboard.helpers.instrumentation.find_origin', return_value="") as find_origin:
+            with QueryRecorder(keep=0) as recorder:
+                find_player_stats(player1)
+        self.assertEqual(recorder.count, 1)
+        find_origin.assert_not_called()
+
+    def test_query_budget(self):
+        player1 = Player.objects.get(user__username="jeffx")
+        with query_budget(1):
+            find_player_stats(player1)
+        with self.assertRaisesRegex(AssertionError, "over the budget of 1"):
+            with query_budget(1):
+                find_player_stats(player1)
+                find_games_played(player1)
+
+    def test_view_query_budgets(self):
+        client = Client()
+        client.force_login(User.objects.get(username="jeffx"))
+        with self.assertLogs('gameboard.queries') as logs:
+            with query_budget(18):
+                self.assertEqual(client.get("/group_page").status_code, 200)
+            with query_budget(10):
+                self.assertEqual(client.get("/player").status_code, 200)
+        self.assertIn('"path": "/group_page"', logs.output[0])
+
+    @override_settings(DEBUG=True)
+    def test_query_headers(self):
+        client = Client()
+        client.force_login(User.objects.get(username="jeffx"))
+        response = client.get("/player")
+        self.assertGreater(int(response["X-Query-Count"]), 0)
+        self.assertIn("X-Query-Time-Ms", response)
+        self.assertIn("X-Slowest-Queries", response)
+
+
+class TestRequestPlayer(GameBoardData, TestCase):
+    """
+    The request's player and groups, looked up once per request.
+    """
+
+    def test_edit_player(self):
+        player1 = Player.objects.get(user__username="jeffx")
+        client = Client()
+        client.force_login(player1.user)
+        response = client.get("/edit_player")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['edit_player_form'].current_username, "jeffx")
+
+        response = client.post("/edit_player", {'username': "jeffrey", 'first_name': "Jeffrey"})
+        self.assertEqual(response.status_code, 302)
+        player1.user.refresh_from_db()
+        self.assertEqual((player1.user.username, player1.user.first_name), ("jeffrey", "Jeffrey"))
+        # The new name is searchable straight away
+        self.assertEqual([p['name'] for p in suggest('players', "jeffr")], ["jeffrey"])
+
+    def test_request_player(self):
+        request = RequestFactory().get("/player")
+        request.user = User.objects.get(username="jeffx")
+        with self.assertNumQueries(2):
+            self.assertEqual(get_player(request).user.username, "jeffx")
+            self.assertEqual([g.name for g in get_groups(request)], ["Webapps_Group"])
+            get_player(request).dashboard_configuration
+            get_groups(request)
+
+
+class TestDashboardCache(GameBoardData, TestCase):
+    """
+    The versioned cache of the group and player dashboards.
+    """
+
+    @override_settings(GAMEBOARD_DASHBOARD_STALE_WHILE_REVALIDATE=False)
+    def test_dashboard_cache(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        player1 = Player.objects.get(user__username="jeffx")
+        player3 = Player.objects.get(user__username="keeganw")
+        client = Client()
+        client.force_login(player1.user)
+
+        with self.assertLogs('gameboard.queries'):
+            self.assertEqual(client.get("/group_page").context["data"]["num_games_played"], 4)
+            with query_budget(4):
+                self.assertEqual(client.get("/group_page").context["data"]["num_games_played"], 4)
+
+            # Recording a game moves the group on to a new version
+            played = GamePlayed(game=Game.objects.get(name="Uno"), date=datetime.date(2019, 12, 5), group=group)
+            played.save()
+            played.players.add(player1, player3)
+            self.assertEqual(client.get("/group_page").context["data"]["num_games_played"], 5)
+        self.assertEqual(client.get("/player/keeganw").context["player"], player3)
+        self.assertEqual(client.get("/player/nobody").status_code, 404)
+
+        # So does a change of members, for the group and everyone in it
+        computed = []
+        compute = lambda: computed.append(1) or len(computed)
+        self.assertEqual(cached_dashboard('player', player1.id, compute)[0], 1)
+        self.assertEqual(cached_dashboard('player', player1.id, compute)[0], 1)
+        group.players.remove(player3)
+        self.assertEqual(cached_dashboard('player', player1.id, compute)[0], 2)
+        group.name = "Renamed_Group"
+        group.save()
+        self.assertEqual(cached_dashboard('player', player1.id, compute)[0], 3)
+
+
+class TestStaleWhileRevalidate(GameBoardData, TestCase):
+    """
+    Serving stale dashboards while they are recomputed, and sharing computations.
+    """
+
+    @override_settings(GAMEBOARD_DASHBOARD_STALE_WHILE_REVALIDATE=True)
+    def test_stale_while_revalidate(self):
+        self.assertEqual(cached_dashboard('group', 1000, lambda: "first")[0], "first")
+
+        started = threading.Event()
+        release = threading.Event()
+        computed = []
+
+        def slow():
+            computed.append(1)
+            started.set()
+            release.wait(5)
+            return "second"
+
+        # A payload which has aged out is served while one background thread recomputes it
+        with override_settings(GAMEBOARD_DASHBOARD_CACHE_TIMEOUT=0):
+            (data, age) = cached_dashboard('group', 1000, slow)
+            self.assertEqual(data, "first")
+            self.assertGreaterEqual(age, 0)
+            self.assertTrue(started.wait(5))
+            self.assertEqual(cached_dashboard('group', 1000, slow)[0], "first")
+            release.set()
+            wait_for_refreshes(5)
+        self.assertEqual(computed, [1])
+        self.assertEqual(cached_dashboard('group', 1000, slow)[0], "second")
+
+        # But after a write the new version is computed straight away
+        bump_versions('group', [1000])
+        self.assertEqual(cached_dashboard('group', 1000, lambda: "third")[0], "third")
+
+    def test_dashboard_single_flight(self):
+        release = threading.Event()
+        computed = []
+        results = []
+
+        def slow():
+            computed.append(1)
+            release.wait(5)
+            return "payload"
+
+        # Concurrent misses on the same dashboard share one computation. The dashboard is given its version first: a
+        # file based cache does not add atomically, so threads which each started a version would compute different ones
+        current_version('player', 1000)
+        threads = [threading.Thread(target=lambda: results.append(cached_dashboard('player', 1000, slow)[0]))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ["payload"] * 4)
+        self.assertEqual(computed, [1])
+
+        # But a request after a write does not join a computation which started before it
+        started = threading.Event()
+        release.clear()
+
+        def before_the_write():
+            started.set()
+            release.wait(5)
+            return "before the write"
+
+        thread = threading.Thread(target=lambda: cached_dashboard('player', 1001, before_the_write))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        bump_versions('player', [1001])
+        self.assertEqual(cached_dashboard('player', 1001, lambda: "after the write")[0], "after the write")
+        release.set()
+        thread.join(5)
+
+
+class TestGroupQueries(GameBoardData, TestCase):
+    """
+    The group statistics queries, and the plans they use.
+    """
+
+    def test_group_queries(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        player1 = Player.objects.get(user__username="jeffx")
+        # A second group with the same name must not be mixed in
+        other = PlayerGroup(name="Webapps_Group")
+        other.save()
+        other.players.add(player1)
+        played = GamePlayed(game=Game.objects.get(name="Uno"), date=datetime.date(2019, 12, 5), group=other)
+        played.save()
+        played.players.add(player1)
+
+        self.assertEqual(find_most_active_player_in_group(group), (player1, 4))
+        self.assertEqual(find_favorite_game_in_group(group), ("Catan", 3))
+        self.assertEqual(find_favorite_game_in_group(other), ("Uno", 1))
+        self.assertEqual(list(find_groups(player1)), [group, other])
+
+    def test_query_plans(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("The plans are checked on SQLite")
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        player1 = Player.objects.get(user__username="jeffx")
+        catan = Game.objects.get(name="Catan")
+        hot_queries = [
+            ('gameboard_gp_group_date_idx', GamePlayed.objects.filter(group=group).order_by('date', 'id')),
+            ('gameboard_gp_game_date_idx', GamePlayed.objects.filter(game=catan).order_by('date', 'id')),
+            ('gameboard_gpp_player_idx', GameParticipation.objects.filter(player=player1, is_winner=True)
+                .values_list('gameplayed_id', flat=True)),
+            # A deep page of history seeks to its cursor, and is read in index order without sorting
+            ('gameboard_gp_group_date_idx', GamePlayed.objects.filter(group=group, date__lte=datetime.date(2019, 12, 3))
+                .exclude(date=datetime.date(2019, 12, 3), id__gte=3).order_by('-date', '-id')[:25]),
+            # Names are suggested from the database with a range scan of their search names
+            ('gameboard_game_search_name', Game.objects.filter(search_name__gte="ca", search_name__lt="ca\U0010ffff")
+                .order_by('search_name', 'id')[:10]),
+        ]
+        for (index, query) in hot_queries:
+            plan = query.explain()
+            self.assertIn(index, plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+            # Every table is searched through an index, never scanned
+            for line in plan.splitlines():
+                if " SCAN " in " %s " % line and "INDEX" not in line:
+                    self.fail("Table scan in the plan for %s:\n%s" % (index, plan))
+
+
+class TestParticipations(GameBoardData, TestCase):
+    """
+    The participations through model, and copying the legacy winners into it.
+    """
+
+    def test_participations(self):
+        player1 = Player.objects.get(user__username="jeffx")
+        player3 = Player.objects.get(user__username="keeganw")
+        played = GamePlayed.objects.get(date=datetime.date(2019, 12, 3))
+        GameParticipation.objects.filter(gameplayed=played, player=player1).update(score=10, placement=1)
+        self.assertEqual(GameParticipation.objects.get(gameplayed=played, is_winner=True).score, 10)
+
+        # Removing a winning player takes their win with them
+        played.players.remove(player1)
+        player1.refresh_from_db()
+        self.assertEqual((player1.num_played, player1.num_wins), (3, 2))
+        self.assertEqual(list(played.winners.all()), [])
+
+        # A winner who was not a player becomes one
+        played.winners.add(player1)
+        player1.refresh_from_db()
+        self.assertEqual((player1.num_played, player1.num_wins), (4, 3))
+        self.assertEqual(set(played.players.all()), {player1, player3})
+
+    def test_copy_legacy_winners(self):
+        player2 = Player.objects.get(user__username="jennyh")
+        player3 = Player.objects.get(user__username="keeganw")
+        played = GamePlayed.objects.get(date=datetime.date(2019, 12, 3))
+        self.assertEqual(copy_legacy_winners(), 0)
+
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE %s (id integer PRIMARY KEY, gameplayed_id integer, player_id integer)"
+                           % LEGACY_WINNERS_TABLE)
+            cursor.execute("INSERT INTO %s (gameplayed_id, player_id) VALUES (%%s, %%s), (%%s, %%s)"
+                           % LEGACY_WINNERS_TABLE, [played.id, player3.id, played.id, player2.id])
+        self.assertEqual(copy_legacy_winners(), 2)
+        self.assertEqual(copy_legacy_winners(), 2)
+
+        self.assertEqual(set(played.winners.all()), {Player.objects.get(user__username="jeffx"), player2, player3})
+        player2.refresh_from_db()
+        self.assertEqual((player2.num_played, player2.num_wins), (4, 2))
+
+
+def import_csv_rows(rows, importer=ImportScores, **kwargs):
+    """
+    Runs an import of some csv rows (the header is added), through a temporary file.
+    """
+    header = ["", "", ""] + ["Player %d" % i for i in range(13)] + ["", ""]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "scores.csv")
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerows([header] + rows)
+        return importer(source=path, **kwargs)
+
+
+class TestImportScores(GameBoardData, TestCase):
+    """
+    Importing the score spreadsheet in batches.
+    """
+
+    def test_import_scores(self):
+        imported = import_csv_rows([
+            ["Monday, 12/02/19", "Catan", ""] + ["1", "0", "0"] + [""] * 10 + ["", "1"],
+            # Three wins without ties are recorded as three games
+            ["Tuesday, 12/03/19", "Uno", ""] + ["2", "1", ""] + [""] * 10 + ["", "3"],
+            # Coop games are skipped
+            ["Wednesday, 12/04/19", "Pandemic", ""] + ["1", "1", "1"] + [""] * 10 + ["x", "1"],
+            ["Thursday, 12/05/19", "", ""] + [""] * 13 + ["", "0"],
+        ], batch_size=2)
+
+        group = imported.group
+        self.assertEqual(imported.num_games_played, 4)
+        self.assertEqual(group.players.count(), 13)
+        self.assertEqual(set(Game.objects.values_list('name', flat=True)), {"Catan", "Uno"})
+        first = Player.objects.get(user__username="Player0")
+        self.assertEqual((first.num_played, first.num_wins), (4, 3))
+        self.assertEqual(find_leaderboard('group', group.id, 'wins', 2)[1].name, "Player1")
+        self.assertEqual(find_activity('group', group.id), [(datetime.date(2019, 12, 2), 1),
+                                                            (datetime.date(2019, 12, 3), 3)])
+        self.assertEqual(find_longest_win_streak_in_group(group), (first, 3))
+
+
+class TestImportPasswords(GameBoardData, TestCase):
+    """
+    The passwords, or invites, of imported players.
+    """
+
+    def test_import_passwords(self):
+        rows = [["Monday, 12/02/19", "Catan", ""] + ["1", "0"] + [""] * 11 + ["", "1"]]
+        imported = import_csv_rows(rows)
+        users = User.objects.filter(username__startswith="Player")
+        self.assertEqual(len({u.password for u in users}), 1)
+        self.assertTrue(users[0].check_password(ImportScores.default_password))
+        self.assertEqual(imported.invites, {})
+
+        User.objects.filter(username__startswith="Player").delete()
+        imported = import_csv_rows(rows, password_mode='invite')
+        user = User.objects.get(username="Player3")
+        self.assertFalse(user.has_usable_password())
+        (uidb64, token) = imported.invites["Player3"]
+        self.assertTrue(default_token_generator.check_token(user, token))
+        self.assertEqual(len(imported.invites), 13)
+        with self.assertRaises(ValueError):
+            import_csv_rows(rows, password_mode='plain')
+
+
+class TestIncrementalImport(GameBoardData, TestCase):
+    """
+    Importing into an existing group, with the import ledger and checkpoints.
+    """
+
+    def test_incremental_import(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        catan = ["Monday, 12/09/19", "Catan", ""] + ["1", "0"] + [""] * 11 + ["", "1"]
+        uno = ["Tuesday, 12/10/19", "Uno", ""] + ["0", "1"] + [""] * 11 + ["", "1"]
+        rows = [catan, catan, uno]
+
+        class InterruptedImport(ImportScores):
+            def add_rows(self, rows, group):
+                if self.num_rows:
+                    raise RuntimeError("Interrupted")
+                super().add_rows(rows, group)
+
+        PlayerGroup.objects.filter(pk=group.pk).update(streaks_stale=False, ratings_stale=False)
+        with self.assertRaises(RuntimeError):
+            import_csv_rows(rows, InterruptedImport, batch_size=1, group=group)
+        self.assertEqual(GamePlayed.objects.filter(group=group).count(), 5)
+        # The committed batch has already marked the group's statistics out of date
+        self.assertTrue(PlayerGroup.objects.filter(pk=group.pk, streaks_stale=True, ratings_stale=True).exists())
+        self.assertEqual(ImportCheckpoint.objects.get(group=group).rows_done, 1)
+
+        # The same file resumes after the checkpoint, and the identical second game is still imported
+        imported = import_csv_rows(rows, batch_size=1, group=group)
+        self.assertEqual((imported.num_skipped, imported.num_rows, imported.num_games_played), (1, 2, 2))
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+        # A grown file only costs its new rows
+        imported = import_csv_rows([uno] + rows, group=group)
+        self.assertEqual((imported.num_skipped, imported.num_rows), (3, 1))
+        self.assertEqual(GamePlayed.objects.filter(group=group).count(), 8)
+        self.assertEqual(Player.objects.get(user__username="jeffx").num_played, 4)
+        newcomer = Player.objects.get(user__username="Player0")
+        self.assertEqual((newcomer.num_played, newcomer.num_wins), (4, 2))
+        self.assertIn(newcomer, group.players.all())
+        self.assertNotIn(newcomer, group.admins.all())
+        self.assertEqual(find_activity('player', newcomer.id), [(datetime.date(2019, 12, 9), 2),
+                                                               (datetime.date(2019, 12, 10), 2)])
+
+    def test_import_new_column(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        upload = SimpleUploadedFile("scores.csv", b",,,Jeff X,Nina,,\r\n"
+                                                  b"\"Monday, 12/09/19\",Catan,,1,0,,1\r\n")
+        ImportScores(source=upload, group=group)
+        self.assertEqual(GamePlayed.objects.filter(group=group, game__name="Catan").count(), 4)
+
+        # The spreadsheet gains a player, so every old row gets another (empty) cell, but is still recognised
+        upload = SimpleUploadedFile("scores.csv", b",,,Jeff X,Cat,Nina,,\r\n"
+                                                  b"\"Monday, 12/09/19\",Catan,,1,,0,,1\r\n"
+                                                  b"\"Tuesday, 12/10/19\",Catan,,0,1,0,,1\r\n")
+        imported = ImportScores(source=upload, group=group)
+        self.assertEqual((imported.num_skipped, imported.num_rows, imported.num_games_played), (1, 1, 1))
+        self.assertEqual(GamePlayed.objects.filter(group=group, game__name="Catan").count(), 5)
+
+
+class TestImportJobs(GameBoardData, TestCase):
+    """
+    Score imports run as background jobs.
+    """
+
+    def test_import_job(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        rows = [["Monday, 12/09/19", "Catan", ""] + ["1", "0"] + [""] * 11 + ["", "1"],
+                ["Tuesday, 12/10/19", "Uno", ""] + ["1", "1"] + [""] * 11 + ["", "3"],
+                ["Someday", "Uno", ""] + ["1", "0"] + [""] * 11 + ["", "1"]]
+        header = ["", "", ""] + ["Player %d" % i for i in range(13)] + ["", ""]
+        lines = StringIO()
+        csv.writer(lines).writerows([header] + rows)
+        client = Client()
+        client.force_login(User.objects.get(username="jeffx"))
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(MEDIA_ROOT=directory, GAMEBOARD_IMPORT_IN_BACKGROUND=False):
+            upload = SimpleUploadedFile("scores.csv", lines.getvalue().encode())
+            self.assertEqual(client.post("/import", {'scores': upload}).status_code, 403)
+
+            group.admins.add(Player.objects.get(user__username="jeffx"))
+            upload = SimpleUploadedFile("scores.csv", lines.getvalue().encode())
+            response = client.post("/import", {'scores': upload})
+            self.assertEqual(response.status_code, 202)
+            job = response.json()['job']
+            self.assertEqual((job['status'], job['rows_processed']), ('queued', 0))
+            self.assertEqual(GamePlayed.objects.filter(group=group).count(), 4)
+
+            out = StringIO()
+            with self.assertLogs('gameboard.imports', 'WARNING'):
+                call_command('run_import_jobs', stdout=out)
+            self.assertIn("Ran 1 import jobs", out.getvalue())
+            progress = client.get(response.json()['progress']).json()
+            self.assertEqual((progress['status'], progress['rows_processed'], progress['rows_rejected'],
+                              progress['games_added']), ('done', 3, 2, 1))
+            self.assertEqual(len(progress['rejections']), 2)
+            self.assertTrue(progress['rejections'][0].startswith("Ties in Uno on 2019-12-10"))
+            self.assertTrue(progress['rejections'][1].startswith("Unknown date 'Someday': Someday,Uno"))
+            self.assertEqual(GamePlayed.objects.filter(group=group).count(), 5)
+            self.assertFalse(os.listdir(os.path.join(directory, "imports")))
+
+        other = Client()
+        other.force_login(User.objects.get(username="jennyh"))
+        self.assertEqual(other.get(response.json()['progress']).status_code, 404)
+
+    def test_interrupted_import_job(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        catan = ["Monday, 12/09/19", "Catan", ""] + ["1", "0"] + [""] * 11 + ["", "1"]
+        uno = ["Tuesday, 12/10/19", "Uno", ""] + ["0", "1"] + [""] * 11 + ["", "1"]
+        lines = StringIO()
+        csv.writer(lines).writerows([["", "", ""] + ["Player %d" % i for i in range(13)] + ["", ""], catan, uno])
+        contents = lines.getvalue().encode()
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(MEDIA_ROOT=directory):
+            # A job whose process stopped after its first batch, and one which is still running
+            long_ago = timezone.now() - datetime.timedelta(hours=1)
+            (interrupted, running) = [ImportJob(group=group, status='running', started_at=started, heartbeat_at=started)
+                                      for started in [long_ago, timezone.now()]]
+            for job in [interrupted, running]:
+                job.source.save("scores.csv", SimpleUploadedFile("scores.csv", contents))
+            ImportCheckpoint.objects.create(group=group, source_hash=hashlib.sha256(contents).hexdigest(), rows_done=1)
+
+            with self.assertLogs('gameboard.imports', 'WARNING') as logs:
+                finished = drain()
+            self.assertEqual(logs.output, ["WARNING:gameboard.imports:Queued 1 interrupted import jobs again"])
+            self.assertEqual([job.id for job in finished], [interrupted.id])
+            self.assertEqual((finished[0].status, finished[0].rows_processed, finished[0].games_added), ('done', 2, 1))
+            self.assertEqual(GamePlayed.objects.filter(group=group, game__name="Uno").count(), 2)
+            self.assertFalse(GamePlayed.objects.filter(group=group, date=datetime.date(2019, 12, 9)).exists())
+            self.assertEqual(ImportJob.objects.get(pk=running.pk).status, 'running')
+
+
+class TestImportFormats(GameBoardData, TestCase):
+    """
+    The csv and JSON Lines import parsers.
+    """
+
+    def test_import_formats(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        # The columns of a csv are found from its header, in any order
+        upload = SimpleUploadedFile("scores.csv", b"\xef\xbb\xbfTotal,Jeff X,Game,Date,Nina\r\n"
+                                                  b"1,1,Catan,2019-12-09,0\r\n"
+                                                  b"2,1,Uno,2019-12-10,1\r\n")
+        imported = ImportScores(source=upload, group=group, batch_size=1)
+        self.assertEqual((imported.num_rows, imported.num_games_played, imported.num_rejected), (2, 3, 0))
+        nina = Player.objects.get(user__username="Nina")
+        self.assertEqual((nina.num_played, nina.num_wins), (3, 1))
+
+        # JSON Lines name the players in each row
+        upload = SimpleUploadedFile("scores.jsonl", b'{"date": "2019-12-11", "game": "Catan", "players": '
+                                                    b'["Nina", "Omar"], "winners": ["Omar"]}\n\n'
+                                                    b'{"date": "2019-12-11", "game": "Catan", "players": ["Nina"], '
+                                                    b'"winners": ["Omar"]}\n{"game": \n')
+        with self.assertLogs('gameboard.imports', 'WARNING') as logs:
+            imported = ImportScores(source=upload, group=group)
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual((imported.num_rows, imported.num_games_played, imported.num_rejected), (3, 1, 2))
+        self.assertEqual(Player.objects.get(user__username="Omar").num_wins, 1)
+        self.assertIn(nina, group.players.all())
+
+        # A player named twice in a row, or by two names which are the same username, only plays once
+        upload = SimpleUploadedFile("scores.jsonl", b'{"date": "2019-12-12", "game": "Uno", "players": '
+                                                    b'["Nina", "Nina", "Omar", "Om ar"], "winners": ["Om ar"]}\n')
+        imported = ImportScores(source=upload, group=group)
+        self.assertEqual((imported.num_games_played, imported.num_rejected), (1, 0))
+        game_played = GamePlayed.objects.get(group=group, date=datetime.date(2019, 12, 12))
+        self.assertEqual(sorted(game_played.players.values_list('user__username', flat=True)), ["Nina", "Omar"])
+        self.assertEqual([winner.user.username for winner in game_played.winners.all()], ["Omar"])
+        upload = SimpleUploadedFile("scores.csv", b"Date,Game,Total,Jeff X,JeffX\r\n2019-12-13,Catan,1,1,0\r\n")
+        self.assertEqual(ImportScores(source=upload, group=group).num_games_played, 1)
+        self.assertEqual(GamePlayed.objects.get(date=datetime.date(2019, 12, 13)).players.count(), 1)
+
+        with self.assertRaises(ValueError):
+            ImportScores(source=SimpleUploadedFile("scores.csv", b"Alice,Bob\r\n"), group=group)
+
+
+class TestBatchDataEntry(GameBoardData, TestCase):
+    """
+    Recording a batch of results in one transaction.
+    """
+
+    def test_batch_data_entry(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        (player1, player3) = [Player.objects.get(user__username=name) for name in ["jeffx", "keeganw"]]
+        outsider = User.objects.create(username="outsider")
+        Player(user=outsider, dashboard_configuration=player1.dashboard_configuration).save()
+        client = Client()
+        client.force_login(player1.user)
+
+        def post(results):
+            return client.post("/data_entry/batch", json.dumps({'results': results}), content_type="application/json")
+
+        night = [{'game': "Uno", 'date': "2019-12-05", 'players': ["jeffx", "keeganw"], 'winners': ["keeganw"]}] * 20
+        with query_budget(30):
+            response = post(night)
+        self.assertEqual(response.status_code, 201)
+        ids = response.json()['games_played']
+        self.assertEqual(len(ids), 20)
+        self.assertEqual(GameParticipation.objects.filter(gameplayed__in=ids, is_winner=True).count(), 20)
+        self.assertEqual(set(GamePlayed.objects.get(pk=ids[-1]).players.all()), {player1, player3})
+        player3.refresh_from_db()
+        self.assertEqual((player3.num_played, player3.num_wins), (22, 20))
+        self.assertEqual(find_longest_win_streak_in_group(group), (player3, 20))
+
+        # Nothing is written unless every result is valid
+        response = post([night[0], {'game': "Chess", 'date': "12/05/19", 'players': ["jeffx", "outsider", "nobody"],
+                                    'winners': ["jennyh"]}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['error']['1']), 5)
+        self.assertEqual(GamePlayed.objects.filter(group=group).count(), 24)
+        self.assertEqual(post([]).status_code, 400)
+        response = post([{'game': "Uno", 'date': "2019-12-05", 'players': [["jeffx"]], 'winners': [{}]}])
+        self.assertEqual(response.json()['error']['0'], ["The players and winners must be usernames"])
+
+
+class TestGroupHistory(GameBoardData, TestCase):
+    """
+    The keyset paginated history of a group.
+    """
+
+    def test_group_history(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        # A second game on the last day, so a page boundary falls within a day
+        played = GamePlayed.objects.create(game=Game.objects.get(name="Uno"), date=datetime.date(2019, 12, 4),
+                                           group=group)
+        played.players.add(Player.objects.get(user__username="jennyh"))
+
+        with self.assertNumQueries(2):
+            (games, cursor) = find_history_page(group, limit=2)
+        self.assertEqual([g.id for g in games], [played.id, played.id - 1])
+        seen = [g.id for g in games]
+        while cursor:
+            with self.assertNumQueries(2):
+                (games, cursor) = find_history_page(group, cursor, limit=2)
+            seen.extend(g.id for g in games)
+        self.assertEqual(seen, list(GamePlayed.objects.filter(group=group).order_by('-date', '-id')
+                                    .values_list('id', flat=True)))
+        with self.assertRaises(ValueError):
+            find_history_page(group, "yesterday")
+
+        client = Client()
+        client.force_login(User.objects.get(username="jeffx"))
+        page = client.get("/group_page/history", {'limit': 1}).json()
+        self.assertEqual((page['total'], len(page['games'])), (5, 1))
+        self.assertEqual(page['games'][0], {'id': played.id, 'game': "Uno", 'date': "2019-12-04", 'players': ["jennyh"],
+                                            'winners': []})
+        page = client.get("/group_page/history", {'cursor': page['next'], 'limit': 10}).json()
+        self.assertEqual((len(page['games']), page['next']), (4, None))
+        self.assertEqual(client.get("/group_page/history", {'cursor': "1.2.3"}).status_code, 400)
+
+
+class TestAutocomplete(GameBoardData, TestCase):
+    """
+    Suggesting game and player names as they are typed.
+    """
+
+    def test_autocomplete(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        player1 = Player.objects.get(user__username="jeffx")
+        outsider = User.objects.create(username="Jenkins", first_name="Leeroy")
+        Player(user=outsider, dashboard_configuration=player1.dashboard_configuration).save()
+
+        self.assertEqual(suggest('games', "CA"), [{'id': Game.objects.get(name="Catan").id, 'name': "Catan"}])
+        self.assertEqual([p['name'] for p in suggest('players', "je")], ["jeffx", "Jenkins", "jennyh"])
+        self.assertEqual([p['name'] for p in suggest('players', "je", limit=1)], ["jeffx"])
+        # A group's players are found with one indexed query, rather than by filtering the whole catalogue
+        with self.assertNumQueries(1):
+            self.assertEqual([p['name'] for p in suggest('players', "je", group=group)], ["jeffx", "jennyh"])
+        self.assertEqual([p['name'] for p in suggest('players', "je", group=group, in_group=False)], ["Jenkins"])
+        # Once built, the index answers without touching the database
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest('games', "u")[0]['name'], "Uno")
+
+        # Writes are seen by the next search
+        Game(name="Carcassonne").save()
+        outsider.username = "jenkinsl"
+        outsider.save()
+        self.assertEqual([g['name'] for g in suggest('games', "ca")], ["Carcassonne", "Catan"])
+        self.assertEqual([p['name'] for p in suggest('players', "jenk")], ["jenkinsl"])
+        Game.objects.get(name="Uno").delete()
+        self.assertEqual(suggest('games', "u"), [])
+
+        # The database gives the same suggestions when there is no index
+        for overrides in [{'GAMEBOARD_AUTOCOMPLETE_IN_MEMORY': False}, {'GAMEBOARD_AUTOCOMPLETE_MAX_ENTRIES': 2}]:
+            with override_settings(**overrides):
+                cache.clear()
+                self.assertEqual([g['name'] for g in suggest('games', "CA")], ["Carcassonne", "Catan"])
+                self.assertEqual([p['name'] for p in suggest('players', "je", group=group, in_group=False)],
+                                 ["jenkinsl"])
+
+        client = Client()
+        client.force_login(player1.user)
+        response = client.get("/autocomplete/players", {'q': "K", 'in_group': 1})
+        self.assertEqual(response.json()['results'], [{'id': Player.objects.get(user__username="keeganw").id,
+                                                       'name': "keeganw", 'first_name': "Keegan"}])
+        self.assertEqual(len(client.get("/autocomplete/games", {'q': "c", 'limit': 1}).json()['results']), 1)
+        self.assertEqual(client.get("/autocomplete/games", {'limit': "all"}).status_code, 400)
+        self.assertNotIn(b"jenkinsl", client.get("/data_entry").content)
+
+
+class TestEditGroup(GameBoardData, TestCase):
+    """
+    Editing a group's roster in bulk.
+    """
+
+    def test_edit_group(self):
+        group = PlayerGroup.objects.get(name="Webapps_Group")
+        (player1, player2) = [Player.objects.get(user__username=name) for name in ["jeffx", "jennyh"]]
+        group.admins.add(player1, player2)
+        for username in ["amy", "bob"]:
+            Player(user=User.objects.create(username=username),
+                   dashboard_configuration=player1.dashboard_configuration).save()
+        client = Client()
+        client.force_login(player1.user)
+
+        form = client.get("/edit_group").context['form']
+        self.assertEqual([c for (c, _) in form.fields['remove_player'].choices], ["jennyh", "keeganw"])
+        self.assertEqual([c for (c, _) in form.fields['make_admin'].choices], ["keeganw"])
+        self.assertEqual([c for (c, _) in form.fields['make_player'].choices], ["jennyh"])
+
+        # However many players change, the usernames are looked up once and each change is one bulk write
+        with query_budget(30):
+            response = client.post("/edit_group", {'group_name': "Renamed", 'add_player': ["amy", "bob", "nobody"],
+                                                   'remove_player': ["keeganw", "bob", "jeffx"],
+                                                   'make_admin': ["amy", "keeganw"], 'make_player': ["jennyh"]})
+        self.assertEqual(response.status_code, 302)
+        group = PlayerGroup.objects.get(pk=group.pk)
+        self.assertEqual(group.name, "Renamed")
+        self.assertEqual({p.user.username for p in group.players.all()}, {"jeffx", "jennyh", "amy", "bob"})
+        self.assertEqual({p.user.username for p in group.admins.all()}, {"jeffx", "amy"})
+
+
+class TestWriteQueue(TransactionTestCase):
+    """
+    Concurrent result submissions, through the write queue and straight to the database. The writer thread has its
+    own connection, so the data has to be committed for it to see.
+    """
+
+    # How many clients submit results at once, and how many each submits
+    CLIENTS = 8
+    RESULTS = 25
+
+    def setUp(self):
+        cache.clear()
+        d = DashboardConfiguration.objects.create(type="Default")
+        self.group = PlayerGroup.objects.create(name="Game_Night")
+        for username in ["anna", "ben"]:
+            self.group.players.add(Player.objects.create(user=User.objects.create(username=username),
+                                                         dashboard_configuration=d))
+        Game.objects.create(name="Catan")
+
+    def _submit_concurrently(self, submit):
+        """
+        Runs CLIENTS threads which each submit RESULTS results, one at a time.
+
+        :return: A tuple of how many submissions failed and the seconds taken
+        """
+        failures = []
+        result = {'game': "Catan", 'date': "2019-12-05", 'players': ["anna", "ben"], 'winners': ["ben"]}
+
+        def client():
+            try:
+                for _ in range(self.RESULTS):
+                    try:
+                        submit(result)
+                    except Exception as e:
+                        failures.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(self.CLIENTS)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        return (len(failures), time.perf_counter() - start)
+
+    def test_concurrent_writes(self):
+        total = self.CLIENTS * self.RESULTS
+        writes = WriteQueue(delay=0.005)
+        try:
+            (failed, seconds) = self._submit_concurrently(
+                lambda result: writes.submit(record_results, self.group, [result]).result(10))
+
+            # A bad write is rolled back on its own, without failing the rest of its batch
+            futures = [writes.submit(record_results, self.group, [{'game': "Chess"}]),
+                       writes.submit(record_results, self.group, [{'game': "Catan", 'date': "2019-12-06",
+                                                                   'players': ["anna"], 'winners': ["anna"]}])]
+            with self.assertRaises(ValidationError):
+                futures[0].result(10)
+            self.assertEqual(len(futures[1].result(10)), 1)
+        finally:
+            writes.stop(10)
+
+        self.assertEqual(failed, 0)
+        self.assertEqual(GamePlayed.objects.count(), total + 1)
+        self.assertEqual(Player.objects.get(user__username="ben").num_wins, total)
+        self.assertLess(writes.flushes, writes.writes)
+
+        # Straight to the database, the clients contend for the write lock and some of them fail. Only the results
+        # which were written count towards the rate
+        (direct_failed, direct_seconds) = self._submit_concurrently(lambda result: record_results(self.group, [result]))
+        self.assertEqual(GamePlayed.objects.count(), 2 * total + 1 - direct_failed)
+        logging.getLogger('gameboard.writes').info(
+            "%d clients: write queue %.0f results/s (%d transactions, %d failed), direct %.0f results/s (%d failed)",
+            self.CLIENTS, (total - failed) / seconds, writes.flushes, failed, (total - direct_failed) / direct_seconds,
+            direct_failed)
+
+    def test_sqlite_pragmas(self):
+        configure_sqlite(connection)
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+class TestCacheInvalidation(TransactionTestCase):
+    """
+    Cached statistics are invalidated again once a write commits, since a request in the middle of the transaction
+    can cache what it read from the rows as they were before the write.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_dashboard_versions_on_commit(self):
+        group = PlayerGroup.objects.create(name="Game_Night")
+        with transaction.atomic():
+            group.name = "Renamed_Night"
+            group.save()
+            self.assertEqual(cached_dashboard('group', group.id, lambda: "before the commit")[0], "before the commit")
+        self.assertEqual(cached_dashboard('group', group.id, lambda: "after the commit")[0], "after the commit")
+
+    def test_head_to_head_on_commit(self):
+        d = DashboardConfiguration.objects.create(type="Default")
+        group = PlayerGroup.objects.create(name="Game_Night")
+        (anna, ben) = [Player.objects.create(user=User.objects.create(username=username), dashboard_configuration=d)
+                       for username in ["anna", "ben"]]
+        group.players.add(anna, ben)
+        Game.objects.create(name="Catan")
+        before = HeadToHead.for_group(group)
+
+        with transaction.atomic():
+            record_results(group, [{'game': "Catan", 'date': "2019-12-01", 'players': ["anna", "ben"],
+                                    'winners': ["anna"]}])
+            # As if another request had cached the matrices it built before the results were committed
+            cache.set(head_to_head_key(group.id, current_version('group', group.id)), before, None)
+        self.assertEqual(HeadToHead.for_group(group).record(anna.id, ben.id), (1, 0))
+
+
 class TestMenuServeFunctions(StaticLiveServerTestCase):
     """
 
@@ -145,7 +1357,10 @@ class TestMenuServeFunctions(StaticLiveServerTestCase):
         super().setUpClass()
         cls.selenium = WebDriver()
         cls.selenium.implicitly_wait(10)
-        cls.selenium.get('%s%s' % (cls.live_server_url, '/import'))
+        # Loading /import used to import the sample dataset there and then, before redirecting to the index page. It now
+        # takes an upload and queues it, so the sample dataset is imported here instead
+        ImportScores()
+        cls.selenium.get('%s%s' % (cls.live_server_url, '/'))
         try:
             element = WebDriverWait(cls.selenium, 20).until(
                 EC.presence_of_element_located((By.ID, "register-btn"))
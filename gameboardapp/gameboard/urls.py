@@ -1,6 +1,7 @@
 from django.urls import path
-from gameboard.views import index, import_scores, game_page, group_page, data_entry, player, gb_logout, \
-    gb_register_login, edit_player, group_page_graph,edit_group
+from gameboard.views import index, import_scores, import_progress, game_page, group_page, data_entry, player, gb_logout, \
+    gb_register_login, edit_player, batch_data_entry, group_page_graph,edit_group, leaderboard, group_history, \
+    autocomplete_games, autocomplete_players
 from django.conf.urls.static import static
 from django.conf import settings
 
@@ -9,8 +10,9 @@ urlpatterns = [
     # Main page reference
     path('', index, name="index"),
 
-    # Sets up database
+    # Imports scores in the background
     path('import', import_scores, name="import"),
+    path('import/<int:job_id>', import_progress, name="import_progress"),
 
     # Player specific pages
     path('player', player, name="player"),
@@ -21,10 +23,15 @@ urlpatterns = [
     path('group_page', group_page, name="group_page"),
     path('game_page', game_page, name="game_page"),
     path('group_page_graph', group_page, name="group_page_graph"),
+    path('group_page/history', group_history, name="group_history"),
     path('edit_group', edit_group, name="edit_group"),
+    path('leaderboard', leaderboard, name="leaderboard"),
 
     # Site functionality
     path('logout', gb_logout, name="logout"),
     path('register_login', gb_register_login, name="register_login"),
-    path('data_entry', data_entry, name="data_entry")
+    path('data_entry', data_entry, name="data_entry"),
+    path('data_entry/batch', batch_data_entry, name="batch_data_entry"),
+    path('autocomplete/games', autocomplete_games, name="autocomplete_games"),
+    path('autocomplete/players', autocomplete_players, name="autocomplete_players")
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
@@ -1,14 +1,29 @@
+import json
+from concurrent.futures import TimeoutError
+
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import HttpResponseRedirect, JsonResponse
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 from django.urls import reverse
 
-from gameboard.forms import LoginForm, RegisterForm, DataEntryForm, EditForm, EditGroupForm
-from gameboard.helpers.import_helper import ImportScores
+from gameboard.forms import LoginForm, RegisterForm, DataEntryForm, EditForm, EditGroupForm, ImportScoresForm
+from gameboard.helpers import autocomplete
+from gameboard.helpers.dashboard import GroupDashboard
+from gameboard.helpers.dashboard_cache import cached_dashboard
+from gameboard.helpers.history import MAX_PAGE_SIZE, PAGE_SIZE, count_history, find_history_page, \
+    serialize_game_played
+from gameboard.helpers.import_jobs import queue_import
+from gameboard.helpers.leaderboard import MAX_LIMIT, can_view_leaderboard, find_leaderboard, LeaderboardRow
+from gameboard.helpers.membership import edit_membership, find_member_choices
 from gameboard.helpers.queries import *
-from gameboard.models import Player, GamePlayed, Game, PlayerGroup, DashboardConfiguration
+from gameboard.helpers.results import record_results
+from gameboard.helpers.write_queue import write
+from gameboard.middleware import get_groups, get_player
+from gameboard.models import Player, GamePlayed, Game, PlayerGroup, DashboardConfiguration, ImportJob
 
 
 """ Helper functions """
@@ -22,14 +37,20 @@ def get_user_info(request):
     :param request: A html request with user data (specifically username)
     :return: None if no user found, otherwise the Player object.
     """
-    try:
-        user = request.user
-        if user.is_anonymous:
-            return None
-        else:
-            return Player.objects.filter(user__username=user.username).first()
-    except KeyError:
-        return None
+    return get_player(request)
+
+
+def get_first_group(request):
+    """
+    A helper function which gets the first group that the logged in player belongs to.
+
+    :param request: A html request with user data
+    :return: None if the player is not in a group, otherwise the PlayerGroup object.
+    """
+    groups = get_groups(request)
+    if groups:
+        return groups[0]
+    return None
 
 
 def get_user_info_by_username(username):
@@ -66,6 +87,26 @@ def find_recent_games(games):
             break
     return recent_games
 
+
+# Shown in the leaderboard charts until there are results to rank
+SAMPLE_LEADERBOARD = [LeaderboardRow(rank, None, name, plays, wins) for (rank, (name, plays, wins))
+                      in enumerate([("sample", 15, 12), ("data", 10, 7), ("play", 9, 7), ("more", 8, 5),
+                                    ("games", 5, 2)], start=1)]
+
+
+def serialize_leaderboard(rows, sample=None):
+    """
+    Turns leaderboard rows into plain dicts, for the charts or a JSON response.
+
+    :param rows: A list of LeaderboardRow objects
+    :param sample: Optionally, rows to use instead if there are none
+    :return: A list of dicts
+    """
+    if not rows and sample is not None:
+        rows = sample
+    return [row.as_dict() for row in rows]
+
+
 def is_player_admin(group, player):
     """
     Determines if a player is an admin in a group or not.
@@ -74,11 +115,7 @@ def is_player_admin(group, player):
     :param player: The player object to check against
     :return: A boolean value
     """
-    admins = group.admins.all()
-    for admin in admins:
-        if player.user.username == admin.user.username:
-            return True
-    return False
+    return group.admins.filter(pk=player.pk).exists()
 
 """ Non login required functions """
 
@@ -97,17 +134,45 @@ def index(request):
         return HttpResponseRedirect(reverse(player))
 
 
+@login_required
 def import_scores(request):
     """
-    Requests the user for a CSV file, which is then used to generate a new group and populate it with data. An example
-    file that can be used can be found at <project root>/src/gameboardapp/gameboard/static/dataset.csv
+    Requests the user for a CSV file, which is then imported into the user's group in the background (the user must be
+    an admin of the group). An example file that can be used can be found at
+    <project root>/src/gameboardapp/gameboard/static/dataset.csv
 
     :param request: The user's request.
-    :return: A redirect to the index page, once the import is complete.
+    :return: The upload form, or once a file is uploaded a JSON response (202) with the queued job and where to poll its
+    progress, without waiting for the import.
     """
-    ImportScores()
+    form = ImportScoresForm()
+    if request.method == "POST":
+        form = ImportScoresForm(request.POST, request.FILES)
+        if form.is_valid():
+            p = get_user_info(request)
+            group = get_first_group(request)
+            if group is None or not is_player_admin(group, p):
+                return JsonResponse({'error': "Only a group's admins can import scores into it"}, status=403)
+            job = queue_import(form.cleaned_data['scores'], group=group, created_by=p)
+            return JsonResponse({'job': job.as_dict(), 'progress': reverse(import_progress, args=[job.id])},
+                                status=202)
 
-    return HttpResponseRedirect(reverse(index))
+    return render(request, "import_scores.html", {'form': form})
+
+
+@login_required
+def import_progress(request, job_id):
+    """
+    Reports how far an import job has got, for polling while it runs.
+
+    :param request: The user's request.
+    :param job_id: The id of the ImportJob
+    :return: A JSON response with the job's status, the rows processed and rejected so far, and the rows per second
+    """
+    job = ImportJob.objects.filter(pk=job_id, created_by=get_user_info(request)).first()
+    if job is None:
+        return JsonResponse({'error': "No such import"}, status=404)
+    return JsonResponse(job.as_dict())
 
 
 def gb_register_login(request):
@@ -240,46 +305,55 @@ def player(request, player=None, message=None):
         player = gb_user
     else:
         player = get_user_info_by_username(player)
+    if player is None:
+        raise Http404("No such player")
+
+    # Get user stats, which are cached until the player's results or groups change
+    own_page = player == gb_user
+    ((player_stats, groups), age) = cached_dashboard(
+        'player', player.id, lambda: player_page_data(player, get_groups(request) if own_page else None))
+
+    # Return stats with page
+    data["stats"] = player_stats
+    data["groups"] = groups
+    data["player"] = player
+    data["message"] = message
+    data["updated_ago"] = int(age)
+    return render(request, "profile.html", data)
 
-    # Get user stats
-    win_percentage = round(find_win_percentage(player), 4)
-    num_played = num_games_played(player)
-    num_wins = find_wins(player)
-    num_losses = find_losses(player)
-    games_played = find_games_played(player)
-    fav_game = find_favorite_game(player)
+
+def player_page_data(player, groups=None):
+    """
+    Computes the statistics and group listings shown on a player's page.
+
+    :param player: A Player object
+    :param groups: The player's groups, if they have already been looked up
+    :return: A tuple of the stats dict and a list of group dicts
+    """
+    stats = find_player_stats(player)
     games_played_by_date = games_played_by_player_by_day(player)
     if games_played_by_date == False:
         games_played_by_date = "sample, data, play, more, games, 7, 8, 10, 2, 5"
-    wins_by_game = wins_by_player_by_game(player)
-    if wins_by_game == False:
-        wins_by_game = "sample, data, play, more, games, 12, 7, 7, 5, 2"
-    top_5_games = top_5_games_by_player(player)
-    if top_5_games == False:
-        top_5_games = "sample, data, play, more, games, 12, 7, 7, 5, 2"
-
-    player_stats = {"win_percentage": win_percentage, 'num_played': num_played,
-                    'num_wins': num_wins, 'num_losses': num_losses,
-                    'games_played': games_played, 'fav_game': fav_game,
+    wins_by_game = serialize_leaderboard(find_leaderboard('player', player.id, 'wins', 5), SAMPLE_LEADERBOARD)
+    top_5_games = serialize_leaderboard(find_leaderboard('player', player.id, 'plays', 5), SAMPLE_LEADERBOARD)
+
+    player_stats = {"win_percentage": round(stats.win_percentage, 4), 'num_played': stats.num_played,
+                    'num_wins': stats.num_wins, 'num_losses': stats.num_losses,
+                    'num_games': stats.num_games, 'fav_game': stats.fav_game,
                     'games_played_by_date': games_played_by_date,
                     'wins_by_game': wins_by_game,
                     'top_5_games': top_5_games}
 
-    found_groups = find_groups(player)
-    groups = []
-    for group in found_groups:
+    if groups is None:
+        groups = find_groups(player)
+    group_list = []
+    for group in groups:
         group_json = {}
         group_json["name"] = group.name
         group_json["players"] = find_players_in_group(group)
         group_json["admins"] = find_admins_in_group(group)
-        groups.append(group_json)
-
-    # Return stats with page
-    data["stats"] = player_stats
-    data["groups"] = groups
-    data["player"] = player
-    data["message"] = message
-    return render(request, "profile.html", data)
+        group_list.append(group_json)
+    return (player_stats, group_list)
 
 
 @login_required
@@ -292,57 +366,72 @@ def group_page(request, message=None):
     :return:
     """
     gb_user = get_user_info(request)
-    group = find_first_group(gb_user)
+    group = get_first_group(request)
     if not group:
         print("go back to group")
         return player(request, gb_user, "You are not in a group")
-    group_name = group.name
-
-    players = group.players.all()
-    admins = group.admins.all()
-
-    # Generate grou
-    games = find_games_by_group(group)
-    recent_games = find_recent_games(games)
-    num_games_played = len(games)
-    (best_player, best_player_win_rate) = find_best_player_in_group(group)
-    best_player_win_rate = round(best_player_win_rate, 2)
-    (longest_win_streak_player, longest_win_streak) = find_longest_win_streak_in_group(group)
+
+    # Generate group stats, which are cached until the group's results or members change
+    (data, age) = cached_dashboard('group', group.id, lambda: group_page_data(group))
+    data = dict(data, message=message, updated_ago=int(age))
+    return render(request, "group_page.html", {"data": data})
+
+
+def group_page_data(group):
+    """
+    Computes the statistics, charts and recent games shown on a group's page.
+
+    :param group: A PlayerGroup object
+    :return: A dict of the page data
+    """
+    dashboard = GroupDashboard(group)
+    best_player_win_rate = round(dashboard.best_player_win_rate, 2)
+    longest_win_streak_player = dashboard.longest_win_streak_player
+    longest_win_streak = dashboard.longest_win_streak
     if longest_win_streak_player == None:
         longest_win_streak_player = ''
         longest_win_streak = 'No Win Streak Yet!'
-    (most_active_player, most_active_played) = find_most_active_player_in_group(group)
-    (favorite_game, favorite_game_played) = find_favorite_game_in_group(group)
-    num_players = find_num_player_in_group(group)
-    games_played_by_date = games_played_by_group_by_day(group)
+    games_played_by_date = dashboard.games_played_by_date
     if games_played_by_date == False:
         games_played_by_date = "sample, data, play, more, games, to, view, your, game, stats, 0, 4, 5, 1, 3, 7, 8, 10, 2, 5"
-    top_5_winners = top_5_winners_by_group(group)
-    top_5_winners = top_5_winners_by_group(group)
-    if top_5_winners == False:
-        top_5_winners = "sample, data, play, more, games, 5, 8, 9, 10, 15"
-    top_5_games = top_5_games_by_group(group)
-    if top_5_games == False:
-        top_5_games = "sample, data, play, more, games, 2, 5, 7, 8, 12"
-
-    data = {'group_name': group_name, 'players': players, 'admins': admins,
-            'recent_games': recent_games, 'best_player': best_player,
+    top_5_winners = serialize_leaderboard(dashboard.top_5_winners, SAMPLE_LEADERBOARD)
+    top_5_games = serialize_leaderboard(dashboard.top_5_games, SAMPLE_LEADERBOARD)
+
+    return {'group_name': group.name, 'players': dashboard.players, 'admins': dashboard.admins,
+            'recent_games': dashboard.recent_games, 'best_player': dashboard.best_player,
             'best_player_win_rate': best_player_win_rate,
-            'num_games_played': num_games_played,
+            'num_games_played': dashboard.num_games_played,
             'longest_win_streak_player': longest_win_streak_player,
             'longest_win_streak': longest_win_streak,
-            'most_active_player': most_active_player,
-            'most_active_played': most_active_played,
-            'favorite_game': favorite_game,
-            'favorite_game_played': favorite_game_played,
-            'num_players': num_players,
-            'games_played_by_date': games_played_by_date,
+            'most_active_player': dashboard.most_active_player,
+            'most_active_played': dashboard.most_active_played,
+            'favorite_game': dashboard.favorite_game,
+            'favorite_game_played': dashboard.favorite_game_played,
+            'num_players': dashboard.num_players,
             'games_played_by_date': games_played_by_date,
             'top_5_winners': top_5_winners,
-            'top_5_games': top_5_games,
-            'message': message}
+            'top_5_games': top_5_games}
 
-    return render(request, "group_page.html", {"data": data})
+
+@login_required
+def group_history(request):
+    """
+    A page of the group's games, newest first, for scrolling through its whole history. Pass the returned cursor back
+    as ?cursor= to get the next page.
+
+    :param request: A html request, optionally with cursor and limit parameters.
+    :return: Json data with the games, the cursor of the next page (null on the last page) and the total number of games
+    """
+    group = get_first_group(request)
+    if not group:
+        return JsonResponse({"error": "You are not in a group"}, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        (games, cursor) = find_history_page(group, request.GET.get('cursor'), limit)
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor or limit"}, status=400)
+    return JsonResponse({'games': [serialize_game_played(game) for game in games], 'next': cursor,
+                         'total': count_history(group)})
 
 
 def game_page(request):
@@ -365,87 +454,27 @@ def edit_group(request):
     :return:
     """
     gb_user = get_user_info(request)
-    group = find_first_group(gb_user)
+    group = get_first_group(request)
     if is_player_admin(group, gb_user) == False:
         print("user is not admin")
         return group_page(request, "You are not an admin, only admins can access that page")
 
-    group_players = find_players_in_group(find_first_group(gb_user))
-    group_admins = find_admins_in_group(find_first_group(gb_user))
-    all_players = Player.objects.all()
-
-    # this gets a list of all players in the group (admins + players)
-    all_group_players_list = []
-    all_player_group_set = set()
-    for i in range(len(group_players)):
-        if gb_user.user.username != group_players[i].user.username:  # cant remove self
-            all_player_group_set.add(group_players[i].user.username)
-            tpl = (group_players[i].user.username, group_players[i].user.first_name)
-            all_group_players_list.append(tpl)
-
-    # gets a list of only admins
-    group_admins_list = []
-    all_admins = set()
-    for i in range(len(group_admins)):
-        if gb_user.user.username != group_admins[i].user.username:
-            tpl = (group_admins[i].user.username, group_admins[i].user.first_name)
-            group_admins_list.append(tpl)
-            all_admins.add(group_admins[i].user.username)
-
-    # gets a list of only players that are not admins
-    group_players_list = []
-    for i in range(len(group_players)):
-        if (gb_user.user.username != group_players[i].user.username) and (
-                group_players[i].user.username not in all_admins):
-            tpl = (group_players[i].user.username, group_players[i].user.first_name)
-            group_players_list.append(tpl)
-
-    # players that are not in this group
-    not_in_group_list = []
-    for i in range(len(all_players)):
-        if gb_user.user.username != all_players[i].user.username:
-            username = all_players[i].user.username
-            if username not in all_player_group_set:
-                tpl = (all_players[i].user.username, all_players[i].user.first_name)
-                not_in_group_list.append(tpl)
-                # remove_player,         make_admin,         add_player,     make_player
-    edit_group_form = EditGroupForm(all_group_players_list, group_players_list, not_in_group_list, group_admins_list)
-
     if request.method == "POST":
-        if "group_name" in request.POST and request.POST["group_name"] != "":
-            group.name = request.POST["group_name"]
-            group.save()
-        if "make_admin" in request.POST:
-            make_admin_list = request.POST.getlist('make_admin')
-            for username in make_admin_list:
-                player_obj = Player.objects.filter(user__username__exact=username).first()
-                group.admins.add(player_obj)
-
-        if "make_player" in request.POST:
-            make_player_list = request.POST.getlist('make_player')
-            for username in make_player_list:
-                player_obj = Player.objects.filter(user__username__exact=username).first()
-                group.admins.remove(player_obj)
-                # currgroup = PlayerGroup.objects.filter(players__user__username__exact =  username).first()
-                # group.players.add(player_obj)
-
-        if "remove_player" in request.POST:
-            remove_list = request.POST.getlist('remove_player')
-            for username in remove_list:
-                player_obj = Player.objects.filter(user__username__exact=username).first()
-                # currgroup = PlayerGroup.objects.filter(players__user__username__exact =  username).first()
-                group.players.remove(player_obj)
-                group.admins.remove(player_obj)
-
-        if "add_player" in request.POST:
-            add_list = request.POST.getlist('add_player')
-            for username in add_list:
-                player_obj = Player.objects.filter(user__username__exact=username).first()
-                group.players.add(player_obj)
-
-        # form = EditGroupForm(group_players_list, add_players_list)
-
+        # The name and the whole roster change together
+        with transaction.atomic():
+            if "group_name" in request.POST and request.POST["group_name"] != "":
+                group.name = request.POST["group_name"]
+                group.save()
+            edit_membership(group, gb_user, add=request.POST.getlist('add_player'),
+                            remove=request.POST.getlist('remove_player'),
+                            make_admin=request.POST.getlist('make_admin'),
+                            make_player=request.POST.getlist('make_player'))
         return HttpResponseRedirect(reverse(group_page))
+
+    # players that are not in this group are suggested as their names are typed, rather than all listed
+    (group_players_list, not_admins_list, group_admins_list) = find_member_choices(group, gb_user)
+    # remove_player,         make_admin,         add_player,     make_player
+    edit_group_form = EditGroupForm(group_players_list, not_admins_list, [], group_admins_list)
     return render(request, "edit_group.html", {"form": edit_group_form, "player": gb_user})
 
 
@@ -457,9 +486,6 @@ def data_entry(request):
     :param request: The user's request.
     :return: A rendering of a web page for the user to interact with.
     """
-    # Get user
-    gb_user = get_user_info(request)
-
     # Get ready with the data to send to the front end
     data = dict()
 
@@ -471,23 +497,21 @@ def data_entry(request):
 
         # Check if the data is valid
         if data_entry_form.is_valid():
-            group = find_groups(gb_user).first()
-            game = data_entry_form.cleaned_data.get('game')
-            date = data_entry_form.cleaned_data.get('date')
-            players = data_entry_form.cleaned_data.get('players').split(",")
-            winners = data_entry_form.cleaned_data.get('winners').split(",")
-
-            # Valid, so add the new game played object
-            game_played = GamePlayed()
-            game_played.game = Game.objects.get(name__exact=game)
-            game_played.date = date
-            game_played.group = group
-            game_played.save()
-
-            for player in players:
-                game_played.players.add(Player.objects.get(user__username__exact=player))
-            for winner in winners:
-                game_played.winners.add(Player.objects.get(user__username__exact=winner))
+            group = get_first_group(request)
+            result = {
+                'game': data_entry_form.cleaned_data.get('game'),
+                'date': data_entry_form.cleaned_data.get('date').date(),
+                'players': data_entry_form.cleaned_data.get('players').split(","),
+                'winners': data_entry_form.cleaned_data.get('winners').split(","),
+            }
+
+            # Valid, so add the new game played object (through the write queue, if it is on)
+            try:
+                write(record_results, group, [result])
+            except ValidationError as e:
+                return JsonResponse({"error": e.message_dict['0']}, status=400)
+            except TimeoutError:
+                return JsonResponse({"error": "The server is busy, please try again"}, status=503)
 
             response = JsonResponse({})
             response.status_code = 200
@@ -498,13 +522,79 @@ def data_entry(request):
             response.status_code = 400
             return response
 
-    # Store the data and send to the view.
+    # Store the data and send to the view (the games and players are suggested as they are typed).
     data['data_entry_form'] = data_entry_form
-    data['all_games'] = find_games()
-    data['all_players'] = find_players_in_group(find_groups(gb_user).first())
     return render(request, "data_entry.html", data)
 
 
+@login_required
+def autocomplete_games(request):
+    """
+    Suggests the games whose names start with what has been typed, for the game field of data entry.
+
+    :param request: A html request, with the q (what has been typed) and optionally limit parameters.
+    :return: Json data with the matching games, each with its id and name
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', autocomplete.LIMIT)), 1), autocomplete.MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({"error": "Invalid limit"}, status=400)
+    return JsonResponse({'results': autocomplete.suggest('games', request.GET.get('q', ""), limit)})
+
+
+@login_required
+def autocomplete_players(request):
+    """
+    Suggests the players whose usernames start with what has been typed. With in_group=1 only the members of the
+    user's group are suggested (e.g. the players of a game being entered), and with in_group=0 only everyone else
+    (e.g. the players who could be added to the group).
+
+    :param request: A html request, with the q (what has been typed) and optionally limit and in_group parameters.
+    :return: Json data with the matching players, each with its id, name (the username) and first name
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', autocomplete.LIMIT)), 1), autocomplete.MAX_LIMIT)
+    except ValueError:
+        return JsonResponse({"error": "Invalid limit"}, status=400)
+    (group, in_group) = (None, True)
+    if request.GET.get('in_group') in ('0', '1'):
+        group = get_first_group(request)
+        if group is None:
+            return JsonResponse({"error": "You are not in a group"}, status=400)
+        in_group = request.GET['in_group'] == '1'
+    return JsonResponse({'results': autocomplete.suggest('players', request.GET.get('q', ""), limit, group,
+                                                         in_group)})
+
+
+@login_required
+def batch_data_entry(request):
+    """
+    Records many games played at once (e.g. a whole game night) in the user's group, from a JSON body of the form
+    {"results": [{"game": "Catan", "date": "2019-12-02", "players": ["jeffx", "jennyh"], "winners": ["jeffx"]}, ...]}.
+    Nothing is recorded unless every result is valid.
+
+    :param request: The user's request.
+    :return: A JSON response with the ids of the new games played (201), or the problems with each result (400)
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Results must be posted"}, status=405)
+    group = get_first_group(request)
+    if group is None:
+        return JsonResponse({"error": "You need to be in a group to record results"}, status=400)
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "The body must be JSON"}, status=400)
+
+    try:
+        games_played = write(record_results, group, body.get('results') if isinstance(body, dict) else None)
+    except ValidationError as e:
+        return JsonResponse({"error": e.message_dict}, status=400)
+    except TimeoutError:
+        return JsonResponse({"error": "The server is busy, please try again"}, status=503)
+    return JsonResponse({"games_played": [game_played.pk for game_played in games_played]}, status=201)
+
+
 @login_required
 def edit_player(request):
     """
@@ -513,11 +603,9 @@ def edit_player(request):
     :param request: A html request, that needs a post request to submit data.
     :return: A rendering of the edit player page.
     """
-    # Get user
-    gb_user = get_user_info(request)
-
     # Get ready with the data to send to the front end
     data = dict()
+    gb_user = get_user_info(request)
 
     edit_form = EditForm(gb_user.user.username)
     # Only do things if the user has submitted data
@@ -566,9 +654,36 @@ def group_page_graph(request):
     :param request: A html request.
     :return: Json data for the graphs
     """
-    gb_user = get_user_info(request)
-    group = find_first_group(gb_user)
+    group = get_first_group(request)
     games_played_by_date = games_played_by_group_by_day(group)
 
-    data = {"games_played_by_date": games_played_by_date}
+    data = {"games_played_by_date": games_played_by_date,
+            "top_5_winners": serialize_leaderboard(find_leaderboard('group', group.id, 'wins', 5)),
+            "top_5_games": serialize_leaderboard(find_leaderboard('group', group.id, 'plays', 5, subject='games'))}
     return JsonResponse(data)
+
+
+@login_required
+def leaderboard(request):
+    """
+    A leaderboard of the players or games within a group, game or player, as JSON. Takes the query parameters scope
+    (group, game or player), id, metric (plays, wins or win_rate), n (default 5, at most MAX_LIMIT) and optionally
+    subject (players or games). Only the requester's groups, the players they share a group with and the games their
+    groups have played can be ranked, and only the players they share a group with are shown.
+
+    :param request: A html request.
+    :return: Json data with the ranked rows, an error message with a 400 status, or a 404 if the requester cannot see
+    the leaderboard
+    """
+    group_ids = [group.id for group in get_groups(request)]
+    members = PlayerGroup.players.through.objects.filter(playergroup__in=group_ids).values('player')
+    try:
+        (scope, scope_id) = (request.GET.get("scope", "group"), int(request.GET["id"]))
+        limit = min(max(int(request.GET.get("n", 5)), 1), MAX_LIMIT)
+        if not can_view_leaderboard(scope, scope_id, get_player(request), group_ids):
+            return JsonResponse({"error": "No such leaderboard"}, status=404)
+        rows = find_leaderboard(scope, scope_id, request.GET.get("metric", "wins"), limit, request.GET.get("subject"),
+                                members)
+    except (KeyError, ValueError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"rows": serialize_leaderboard(rows)})
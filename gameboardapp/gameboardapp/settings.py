@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
 
 # Fix the css mimetype error from some css editors, if there’s a need for it
 import mimetypes
@@ -56,6 +57,18 @@ DATABASES = {
     }
 }
 
+# The cached dashboards, head to head matrices and the versions which invalidate them (and the autocomplete indexes)
+# must be seen by every worker process, so that a write in one process reaches the others. Django's default, a cache in
+# each process's memory, would leave the other workers serving what they cached before the write. A file based cache
+# is shared by the processes of one machine; use memcached or redis when serving from several machines.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'gameboard_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+
 
 ALLOWED_HOSTS = [os.environ['WEBSITE_SITE_NAME'] + '.azurewebsites.net', '127.0.0.1'] if 'WEBSITE_SITE_NAME' in os.environ else []
 
@@ -73,12 +86,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gameboard.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'gameboard.middleware.PlayerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -136,3 +151,63 @@ USE_L10N = True
 
 USE_TZ = True
 
+
+# Gameboard statistics
+
+# Also keep a rating for each player in each game (across all groups), not just in each group
+GAMEBOARD_GAME_RATINGS = True
+
+# How long (in seconds) a computed group or player dashboard is fresh for. Writes bump the dashboard's version, which
+# also makes it out of date
+GAMEBOARD_DASHBOARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Serve a dashboard which has outlived its timeout straight away while a background thread recomputes it, for up to
+# this many seconds past its timeout. The page shows how old its stats are. One which a write changed is never served
+GAMEBOARD_DASHBOARD_STALE_WHILE_REVALIDATE = True
+GAMEBOARD_DASHBOARD_STALE_TIMEOUT = 60 * 60 * 24 * 7
+
+# How many of the slowest SQL statements to report for each request
+GAMEBOARD_SLOWEST_QUERIES = 3
+
+# How many csv rows a score import reads and writes at a time
+GAMEBOARD_IMPORT_BATCH_SIZE = 1000
+
+# Uploaded score imports run on a pool of this many threads in the web process. Turn GAMEBOARD_IMPORT_IN_BACKGROUND off
+# to leave them queued for `manage.py run_import_jobs` instead (e.g. run as a separate worker)
+GAMEBOARD_IMPORT_WORKERS = 1
+GAMEBOARD_IMPORT_IN_BACKGROUND = True
+
+# A running import which has not reported progress for this many seconds was interrupted (e.g. by a restart), and is
+# queued again by the next `manage.py run_import_jobs`, which resumes it from its checkpoint
+GAMEBOARD_IMPORT_LEASE = 60 * 10
+
+# Write queue mode, for SQLite: results are written by a single writer thread per process, in batched transactions
+# (waiting up to GAMEBOARD_WRITE_QUEUE_DELAY seconds for up to GAMEBOARD_WRITE_QUEUE_BATCH writes), and connections
+# use write ahead logging. Requests wait up to GAMEBOARD_WRITE_QUEUE_TIMEOUT seconds for their write.
+GAMEBOARD_WRITE_QUEUE = False
+GAMEBOARD_WRITE_QUEUE_DELAY = 0.005
+GAMEBOARD_WRITE_QUEUE_BATCH = 100
+GAMEBOARD_WRITE_QUEUE_TIMEOUT = 10
+
+# Game and player names are suggested from a sorted index kept in each process's memory, rebuilt after they change.
+# Catalogues of more than GAMEBOARD_AUTOCOMPLETE_MAX_ENTRIES names (or all, with it off) are searched in the database
+GAMEBOARD_AUTOCOMPLETE_IN_MEMORY = True
+GAMEBOARD_AUTOCOMPLETE_MAX_ENTRIES = 100000
+
+# Per request query counts and timings are logged (as INFO) when DEBUG is off. Only warnings are shown by default; set
+# the gameboard.queries level to INFO to log every request
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'gameboard.queries': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}